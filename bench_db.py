@@ -0,0 +1,367 @@
+"""
+Мікробенчмарки database.py та data_cleaner.py на синтетичній базі клієнтів.
+
+    python bench_db.py --size 100000 --output bench-100k.json
+    python bench_db.py --size 100000 --baseline bench-100k.json
+
+Клієнти генеруються детерміновано (--seed) для окремої команди BENCH_OWNER_ID
+у базі DATABASE_URL і перевикористовуються між запусками того самого розміру
+та seed (його записано в службовій таблиці bench_dataset),
+тож результати різних комітів та наборів індексів можна порівнювати.
+"""
+import argparse
+import asyncio
+import json
+import math
+import platform
+import random
+import subprocess
+import sys
+import time
+from datetime import datetime, timezone
+from typing import Any, Awaitable, Callable, Dict, List, Optional, Tuple
+
+from config import settings
+import database as db
+from data_cleaner import normalize_phone_list
+from face_index import EMBEDDING_DIM, encode_embedding, to_pgvector_literal
+
+# Команда, якій належать синтетичні клієнти (поза діапазоном реальних Telegram ID)
+BENCH_OWNER_ID = 8_000_000_000
+
+SEED_BATCH_SIZE = 10_000
+SAMPLE_SIZE = 256
+
+# Коди мобільних операторів України
+_OPERATOR_CODES = ('50', '63', '66', '67', '68', '73', '91', '93', '95', '96', '97', '98', '99')
+
+_COMMENT_WORDS = (
+    'постійний', 'клієнт', 'VIP', 'любить', 'каву', 'чай', 'знижка', 'борг', 'передзвонити',
+    'після', 'обіду', 'вечора', 'доставка', 'самовивіз', 'Київ', 'Львів', 'Одеса', 'Харків',
+    'Дніпро', 'оптовий', 'роздріб', 'замовлення', 'повернення', 'гарантія', 'рекомендація',
+    'друг', 'власника', 'новий', 'важливий', 'безготівка', 'готівка', 'термін', 'оплати',
+)
+
+
+# --- ГЕНЕРАТОР ---
+
+def _client_rng(seed: int, index: int) -> random.Random:
+    # Окремий генератор на клієнта: будь-якого клієнта можна відтворити без БД
+    return random.Random(seed * 10_000_019 + index)
+
+
+def _phone(rng: random.Random) -> str:
+    return f"+380{rng.choice(_OPERATOR_CODES)}{rng.randrange(10_000_000):07d}"
+
+
+def generate_client(seed: int, index: int) -> Dict[str, Any]:
+    """Реалістичний клієнт: 1-3 номери, коментар українською, 0-4 фото, кодування для частини з фото."""
+    rng = _client_rng(seed, index)
+    phones = list(dict.fromkeys(_phone(rng) for _ in range(rng.choices((1, 2, 3), (70, 22, 8))[0])))
+    comment = ' '.join(rng.choice(_COMMENT_WORDS) for _ in range(rng.randint(2, 9)))
+    photo_count = rng.choices((0, 1, 2, 4), (35, 40, 15, 10))[0]
+    photo_url = [
+        f"https://bench.invalid/clients/{index}/{rng.getrandbits(64):016x}.jpg" for _ in range(photo_count)
+    ]
+    encoding = [rng.uniform(-0.25, 0.25) for _ in range(EMBEDDING_DIM)] if photo_count else []
+    return {
+        'telegram_id': BENCH_OWNER_ID,
+        'phone': phones,
+        'comment': comment,
+        'photo_url': photo_url,
+        'encoding': encoding,
+    }
+
+
+def raw_phone_variants(phone: str) -> List[str]:
+    """Варіанти того самого номера в тому вигляді, як їх вводять оператори."""
+    national = phone[4:]
+    return [
+        phone,
+        f"0{national[:2]} {national[2:5]} {national[5:7]} {national[7:]}",
+        f"+38 (0{national[:2]}) {national[2:5]}-{national[5:7]}-{national[7:]}",
+        f"80{national}",
+        f"380{national}",
+    ]
+
+
+async def _dataset_info() -> Tuple[int, Optional[int]]:
+    """Кількість клієнтів BENCH_OWNER_ID та seed, яким їх згенеровано (None — невідомо)."""
+    async with db.db_pool.acquire() as connection:
+        # Службова таблиця бенчмарку, а не міграція: у робочій базі її немає
+        await connection.execute("""
+            CREATE TABLE IF NOT EXISTS bench_dataset (
+                owner_id BIGINT PRIMARY KEY,
+                seed BIGINT NOT NULL
+            )
+        """)
+        size = await connection.fetchval("SELECT count(*) FROM clients WHERE owner_id = $1", BENCH_OWNER_ID)
+        seed = await connection.fetchval("SELECT seed FROM bench_dataset WHERE owner_id = $1", BENCH_OWNER_ID)
+    return size, seed
+
+
+async def _drop_dataset():
+    async with db.db_pool.acquire() as connection:
+        await connection.execute("DELETE FROM bench_dataset WHERE owner_id = $1", BENCH_OWNER_ID)
+        await connection.execute("DELETE FROM clients WHERE owner_id = $1", BENCH_OWNER_ID)
+
+
+async def seed_dataset(size: int, seed: int):
+    """
+    Заповнює команду BENCH_OWNER_ID: пакети через COPY у тимчасову таблицю,
+    як у bulk_io.import_clients, потім злиття в clients та client_phones.
+    """
+    with_vectors = settings.FACE_INDEX_BACKEND == "pgvector"
+    # Колонка face_vector існує лише з бекендом pgvector
+    vector_column = ", face_vector" if with_vectors else ""
+    vector_value = ", face_vector::vector" if with_vectors else ""
+    started = time.perf_counter()
+    async with db.db_pool.acquire() as connection:
+        for start in range(0, size, SEED_BATCH_SIZE):
+            clients = [generate_client(seed, index) for index in range(start, min(start + SEED_BATCH_SIZE, size))]
+            async with connection.transaction():
+                await connection.execute("""
+                    CREATE TEMP TABLE clients_seed (
+                        telegram_id BIGINT,
+                        phone TEXT[] NOT NULL,
+                        comment TEXT,
+                        photo_url TEXT[] NOT NULL,
+                        face_embedding BYTEA,
+                        face_vector TEXT
+                    ) ON COMMIT DROP;
+                """)
+                await connection.copy_records_to_table('clients_seed', records=[
+                    (
+                        client['telegram_id'], client['phone'], client['comment'], client['photo_url'],
+                        encode_embedding(client['encoding']),
+                        to_pgvector_literal(client['encoding']) if with_vectors and client['encoding'] else None,
+                    )
+                    for client in clients
+                ])
+                await connection.execute(f"""
+                    WITH inserted AS (
+                        INSERT INTO clients (owner_id, telegram_id, phone, comment, face_embedding, photo_url{vector_column})
+                        SELECT $1, telegram_id, to_jsonb(phone), comment, face_embedding, to_jsonb(photo_url){vector_value}
+                        FROM clients_seed
+                        RETURNING id, owner_id, phone
+                    )
+                    INSERT INTO client_phones (client_id, owner_id, phone, digits)
+                    SELECT id, owner_id, p, regexp_replace(p, '[^0-9]', '', 'g')
+                    FROM inserted, jsonb_array_elements_text(phone) AS p
+                    ON CONFLICT DO NOTHING
+                """, BENCH_OWNER_ID)
+            print(f"  seeded {min(start + SEED_BATCH_SIZE, size)}/{size}", file=sys.stderr)
+
+        # Seed записується лише після повного заповнення: перерваний запуск перегенерує набір
+        await connection.execute("""
+            INSERT INTO bench_dataset (owner_id, seed) VALUES ($1, $2)
+            ON CONFLICT (owner_id) DO UPDATE SET seed = EXCLUDED.seed
+        """, BENCH_OWNER_ID, seed)
+        await connection.execute("ANALYZE clients; ANALYZE client_phones;")
+    print(f"  seeding took {time.perf_counter() - started:.1f}s", file=sys.stderr)
+
+
+# --- ВИМІРЮВАННЯ ---
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    # Метод найближчого рангу
+    return sorted_values[max(0, math.ceil(fraction * len(sorted_values)) - 1)]
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    values = sorted(samples)
+    total = sum(values)
+    return {
+        'iterations': len(values),
+        'ops_per_s': len(values) / total if total else 0.0,
+        'min_ms': values[0] * 1000,
+        'mean_ms': total / len(values) * 1000,
+        'p50_ms': _percentile(values, 0.50) * 1000,
+        'p95_ms': _percentile(values, 0.95) * 1000,
+        'p99_ms': _percentile(values, 0.99) * 1000,
+        'max_ms': values[-1] * 1000,
+    }
+
+
+async def measure(call: Callable[[int], Awaitable[Any]], iterations: int, warmup: int) -> Dict[str, float]:
+    """Послідовно викликає call(i): спершу warmup разів без замірів, потім iterations із замірами."""
+    for i in range(warmup):
+        await call(i)
+    samples = []
+    for i in range(iterations):
+        started = time.perf_counter()
+        await call(warmup + i)
+        samples.append(time.perf_counter() - started)
+    return _summary(samples)
+
+
+async def _sample(size: int, seed: int, rng: random.Random) -> Tuple[List[Dict[str, Any]], List[int]]:
+    """Випадкові клієнти набору (відтворені генератором) та реальні ID клієнтів у БД."""
+    clients = [generate_client(seed, rng.randrange(size)) for _ in range(SAMPLE_SIZE)]
+    async with db.db_pool.acquire() as connection:
+        ids = [record['id'] for record in await connection.fetch(
+            "SELECT id FROM clients WHERE owner_id = $1 ORDER BY random() LIMIT $2", BENCH_OWNER_ID, SAMPLE_SIZE
+        )]
+    return clients, ids
+
+
+async def run_benchmarks(size: int, seed: int, iterations: int, warmup: int,
+                         only: Optional[List[str]] = None) -> Dict[str, Dict[str, float]]:
+    rng = random.Random(seed)
+    clients, ids = await _sample(size, seed, rng)
+
+    def pick(i: int) -> Dict[str, Any]:
+        return clients[i % len(clients)]
+
+    def first_digits(i: int) -> str:
+        return pick(i)['phone'][0][1:]
+
+    def full_number(i: int) -> str:
+        # Той самий номер у «людському» форматі: канонізація входить у замір
+        return raw_phone_variants(pick(i)['phone'][0])[1 + i % 4]
+
+    def keyword(i: int) -> str:
+        return pick(i)['comment'].split()[0]
+
+    async def by_id_uncached(i: int):
+        db.client_cache.clear()
+        await db.find_client_by_id(ids[i % len(ids)], BENCH_OWNER_ID)
+
+    added_ids: List[int] = []
+
+    async def add(i: int):
+        client = generate_client(seed + 1, i)
+        added_ids.append(await db.add_client(
+            BENCH_OWNER_ID, client['telegram_id'], client['phone'], client['comment'],
+            client['encoding'], client['photo_url'],
+        ))
+
+    raw_lists = [
+        [variant for phone in client['phone'] for variant in raw_phone_variants(phone)[:2]]
+        for client in clients
+    ]
+
+    async def normalize(i: int):
+        normalize_phone_list(raw_lists[i % len(raw_lists)])
+
+    benchmarks: Dict[str, Tuple[Callable[[int], Awaitable[Any]], int]] = {
+        'find_client_by_query[full_number]':
+            (lambda i: db.find_client_by_query(BENCH_OWNER_ID, full_number(i)), iterations),
+        'find_client_by_query[partial_number]':
+            (lambda i: db.find_client_by_query(BENCH_OWNER_ID, first_digits(i)[5:12]), iterations),
+        'find_client_by_query[last_5_digits]':
+            (lambda i: db.find_client_by_query(BENCH_OWNER_ID, first_digits(i)[-5:]), iterations),
+        'find_client_by_query[comment_keyword]':
+            (lambda i: db.find_client_by_query(BENCH_OWNER_ID, keyword(i)), max(1, iterations // 10)),
+        'search_clients[comment_keyword_page]':
+            (lambda i: db.search_clients(BENCH_OWNER_ID, keyword(i)), iterations),
+        'find_client_by_id[cached]':
+            (lambda i: db.find_client_by_id(ids[0], BENCH_OWNER_ID), iterations),
+        'find_client_by_id[uncached]': (by_id_uncached, iterations),
+        'add_client': (add, iterations),
+        'get_all_encodings': (lambda i: db.get_all_encodings(), max(1, min(iterations, 5))),
+        'normalize_phone_list': (normalize, iterations * 10),
+    }
+
+    results = {}
+    try:
+        for name, (call, count) in benchmarks.items():
+            if only and not any(pattern in name for pattern in only):
+                continue
+            print(f"  {name} x{count}", file=sys.stderr)
+            results[name] = await measure(call, count, warmup if count > warmup else 0)
+    finally:
+        # Додані клієнти не повинні змінювати розмір набору для наступних запусків
+        if added_ids:
+            async with db.db_pool.acquire() as connection:
+                await connection.execute("DELETE FROM clients WHERE id = ANY($1::int[])", added_ids)
+            for db_id in added_ids:
+                db.face_index.index.remove(db_id)
+    return results
+
+
+# --- ЗВІТ ---
+
+def _git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+async def _environment() -> Dict[str, Any]:
+    async with db.db_pool.acquire() as connection:
+        server_version = await connection.fetchval("SHOW server_version")
+        indexes = [record['indexname'] for record in await connection.fetch(
+            "SELECT indexname FROM pg_indexes WHERE tablename IN ('clients', 'client_phones') ORDER BY indexname"
+        )]
+    return {
+        'commit': _git_commit(),
+        'timestamp': datetime.now(timezone.utc).isoformat(),
+        'python': platform.python_version(),
+        'postgres': server_version,
+        'face_index_backend': settings.FACE_INDEX_BACKEND,
+        'indexes': indexes,
+    }
+
+
+def _print_table(results: Dict[str, Dict[str, float]], baseline: Optional[Dict[str, Dict[str, float]]]):
+    print(f"{'':42} {'iters':>6} {'ops/s':>10} {'p50':>9} {'p95':>9} {'p99':>9}" + ("  Δp50" if baseline else ""))
+    for name, stats in results.items():
+        line = (f"{name:42} {stats['iterations']:>6} {stats['ops_per_s']:>10.1f} "
+                f"{stats['p50_ms']:>7.2f}ms {stats['p95_ms']:>7.2f}ms {stats['p99_ms']:>7.2f}ms")
+        previous = (baseline or {}).get(name)
+        if previous and previous['p50_ms']:
+            line += f"  {(stats['p50_ms'] / previous['p50_ms'] - 1) * 100:+.1f}%"
+        print(line)
+
+
+async def _main(args: argparse.Namespace):
+    await db.init_db()
+    try:
+        current_size, current_seed = await _dataset_info()
+        # Вибірки бенчмарків відтворюються з --seed, тож набір іншого seed дав би лише промахи
+        if args.reseed or current_size != args.size or current_seed != args.seed:
+            print(f"Seeding {args.size} clients with seed {args.seed} "
+                  f"(found {current_size}, seed {current_seed})...", file=sys.stderr)
+            await _drop_dataset()
+            await seed_dataset(args.size, args.seed)
+            # Індекс облич у пам'яті має відповідати новому набору
+            async with db.db_pool.acquire() as connection:
+                await db._load_face_index(connection)
+
+        report = {
+            'dataset': {'size': args.size, 'seed': args.seed, 'owner_id': BENCH_OWNER_ID},
+            'environment': await _environment(),
+            'results': await run_benchmarks(args.size, args.seed, args.iterations, args.warmup, args.only),
+        }
+    finally:
+        await db.close_db()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as file:
+            baseline = json.load(file)['results']
+    _print_table(report['results'], baseline)
+
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+    else:
+        json.dump(report, sys.stdout, ensure_ascii=False)
+        print()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Бенчмарки запитів до бази клієнтів.")
+    parser.add_argument('--size', type=int, default=10_000, help="Розмір набору: 10000, 100000, 1000000, ...")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--iterations', type=int, default=200, help="Замірів на бенчмарк")
+    parser.add_argument('--warmup', type=int, default=20)
+    parser.add_argument('--only', nargs='*', help="Лише бенчмарки, назва яких містить один із рядків")
+    parser.add_argument('--reseed', action='store_true', help="Перегенерувати набір навіть того самого розміру")
+    parser.add_argument('--output', help="JSON-звіт у файл (інакше — у stdout)")
+    parser.add_argument('--baseline', help="Попередній JSON-звіт для порівняння p50")
+    asyncio.run(_main(parser.parse_args()))
@@ -0,0 +1,317 @@
+import argparse
+import asyncio
+import csv
+import json
+import logging
+import os
+import re
+import tempfile
+from typing import Any, Dict, Iterator, List, Optional, TextIO, Tuple
+
+from aiogram import Bot, F, Router
+from aiogram.filters import Command
+from aiogram.types import FSInputFile, Message
+
+from config import settings
+import database as db
+from data_cleaner import normalize_phone_list
+
+logging.basicConfig(level=logging.INFO)
+
+router = Router()
+
+IMPORT_BATCH_SIZE = 5000
+EXPORT_PREFETCH = 1000
+
+# Роздільник кількох номерів/URL в одній клітинці CSV
+_LIST_SEPARATOR = re.compile(r'[;,\n]')
+
+ImportRecord = Tuple[Optional[str], Optional[int], List[str], str, List[str]]
+
+
+# --- ЧИТАННЯ ФАЙЛІВ ---
+
+def _split_list(value: Any) -> List[str]:
+    if not value:
+        return []
+    if isinstance(value, list):
+        return [str(item).strip() for item in value if str(item).strip()]
+    return [item.strip() for item in _LIST_SEPARATOR.split(str(value)) if item.strip()]
+
+
+def _iter_rows(file: TextIO, fmt: str) -> Iterator[Dict[str, Any]]:
+    if fmt == 'csv':
+        yield from csv.DictReader(file)
+    else:
+        for line in file:
+            if line.strip():
+                yield json.loads(line)
+
+
+def _to_record(row: Dict[str, Any]) -> Optional[ImportRecord]:
+    """Рядок файлу -> запис для staging-таблиці (None, якщо рядок непридатний)."""
+    external_id = str(row.get('external_id') or '').strip() or None
+    try:
+        telegram_id = int(row['telegram_id']) if row.get('telegram_id') else None
+    except (TypeError, ValueError):
+        return None
+    phones = normalize_phone_list(_split_list(row.get('phone')))
+    comment = (row.get('comment') or '').strip()
+    if not phones and not comment:
+        return None
+    return external_id, telegram_id, phones, comment or "(Коментар відсутній)", _split_list(row.get('photo_url'))
+
+
+def _iter_batches(file: TextIO, fmt: str, batch_size: int, stats: Dict[str, int]) -> Iterator[List[ImportRecord]]:
+    batch = []
+    for row in _iter_rows(file, fmt):
+        stats['read'] += 1
+        record = _to_record(row)
+        if record is None:
+            stats['skipped'] += 1
+            continue
+        batch.append(record)
+        if len(batch) >= batch_size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+
+def detect_format(path: str) -> str:
+    return 'csv' if path.lower().endswith('.csv') else 'jsonl'
+
+
+# --- ІМПОРТ / ЕКСПОРТ ---
+
+async def import_clients(path: str, owner_id: int, fmt: Optional[str] = None,
+                         batch_size: int = IMPORT_BATCH_SIZE) -> Dict[str, int]:
+    """
+    Масовий імпорт клієнтів команди owner_id з CSV/JSONL: пакети через COPY
+    у тимчасову staging-таблицю, потім одне злиття в clients та client_phones.
+    Рядок з відомим external_id оновлює клієнта (повторний external_id у файлі —
+    перемагає останній рядок), рядок без external_id завжди створює нового.
+    """
+    if not db.db_pool:
+        raise Exception("Database pool is not initialized.")
+    fmt = fmt or detect_format(path)
+    stats = {'read': 0, 'skipped': 0, 'imported': 0}
+
+    async with db.db_pool.acquire() as connection:
+        async with connection.transaction():
+            await connection.execute("""
+                CREATE TEMP TABLE clients_import (
+                    seq BIGSERIAL,
+                    external_id TEXT,
+                    telegram_id BIGINT,
+                    phone TEXT[] NOT NULL,
+                    comment TEXT,
+                    photo_url TEXT[] NOT NULL
+                ) ON COMMIT DROP;
+            """)
+
+            with open(path, encoding='utf-8-sig', newline='') as file:
+                for batch in _iter_batches(file, fmt, batch_size, stats):
+                    await connection.copy_records_to_table(
+                        'clients_import', records=batch,
+                        columns=['external_id', 'telegram_id', 'phone', 'comment', 'photo_url']
+                    )
+
+            # Фото, які зникнуть із перезаписаних клієнтів, — у чергу прибирання Spaces
+            # (варіанти — лише ті, чий оригінал не лишається в новому списку)
+            await connection.execute("""
+                INSERT INTO orphaned_objects (url)
+                SELECT old.url
+                FROM clients c
+                JOIN (
+                    SELECT DISTINCT ON (external_id) external_id, photo_url
+                    FROM clients_import
+                    WHERE external_id IS NOT NULL
+                    ORDER BY external_id, seq DESC
+                ) i ON i.external_id = c.external_id
+                CROSS JOIN LATERAL (
+                    SELECT url FROM jsonb_array_elements_text(
+                        CASE WHEN jsonb_typeof(c.photo_url) = 'array' THEN c.photo_url ELSE '[]'::jsonb END
+                    ) AS url
+                    WHERE url <> ALL(i.photo_url)
+                    UNION
+                    SELECT variant.value
+                    FROM jsonb_array_elements(c.photo_variants) AS item, jsonb_each_text(item) AS variant
+                    WHERE COALESCE(item->>'original', '') <> ALL(i.photo_url)
+                ) AS old
+                WHERE c.owner_id = $1
+                ON CONFLICT DO NOTHING
+            """, owner_id)
+            # Один NOTIFY на весь імпорт замість тригера clients_changed на кожен рядок
+            await connection.execute(f"SET LOCAL {db.SUPPRESS_CLIENT_NOTIFY_SETTING} = 'on'")
+
+            # Старі номери клієнтів, які буде перезаписано
+            await connection.execute("""
+                DELETE FROM client_phones cp
+                USING clients c, clients_import i
+                WHERE cp.owner_id = $1 AND cp.client_id = c.id
+                  AND c.owner_id = $1 AND c.external_id = i.external_id
+            """, owner_id)
+            # DISTINCT ON: рядки без external_id унікальні за seq, решта — за external_id
+            stats['imported'] = await connection.fetchval("""
+                WITH merged AS (
+                    INSERT INTO clients (owner_id, external_id, telegram_id, phone, comment, photo_url)
+                    SELECT DISTINCT ON (external_id, CASE WHEN external_id IS NULL THEN seq END)
+                        $1, external_id, telegram_id, to_jsonb(phone), comment, to_jsonb(photo_url)
+                    FROM clients_import
+                    ORDER BY external_id, CASE WHEN external_id IS NULL THEN seq END, seq DESC
+                    ON CONFLICT (owner_id, external_id) DO UPDATE SET
+                        phone = EXCLUDED.phone,
+                        comment = EXCLUDED.comment,
+                        photo_url = EXCLUDED.photo_url,
+                        photo_variants = COALESCE((
+                            SELECT jsonb_agg(item) FROM jsonb_array_elements(clients.photo_variants) AS item
+                            WHERE EXCLUDED.photo_url @> jsonb_build_array(item->'original')
+                        ), '[]'::jsonb)
+                    RETURNING id, owner_id, phone
+                ), indexed AS (
+                    INSERT INTO client_phones (client_id, owner_id, phone, digits)
+                    SELECT id, owner_id, p, regexp_replace(p, '[^0-9]', '', 'g')
+                    FROM merged, jsonb_array_elements_text(phone) AS p
+                    ON CONFLICT DO NOTHING
+                )
+                SELECT count(*) FROM merged
+            """, owner_id)
+            # Доставляється іншим процесам разом із комітом
+            await connection.execute(
+                "SELECT pg_notify($1, $2)", db.CLIENTS_CHANGED_CHANNEL, db.bulk_change_payload(owner_id)
+            )
+
+    # Власне повідомлення цей процес пропускає (див. db._on_clients_changed), тож кеш скидаємо тут
+    db.client_cache.clear()
+    db.mark_written(owner_id=owner_id)
+    logging.info(f"Bulk import from {path}: {stats}")
+    return stats
+
+
+def _export_row(record, fmt: str):
+    if fmt == 'csv':
+        return [
+            record['id'], record['external_id'], record['telegram_id'],
+            ';'.join(record['phone'] or []), record['comment'],
+            ';'.join(record['photo_url'] or []),
+        ]
+    return json.dumps(dict(record), ensure_ascii=False)
+
+
+async def export_clients(file: TextIO, fmt: str = 'jsonl', owner_id: Optional[int] = None) -> int:
+    """
+    Потоковий експорт через серверний курсор: пам'ять не залежить від розміру таблиці.
+    owner_id=None — клієнти всіх команд.
+    """
+    if not db.db_pool:
+        raise Exception("Database pool is not initialized.")
+    writer = None
+    if fmt == 'csv':
+        writer = csv.writer(file)
+        writer.writerow(['id', 'external_id', 'telegram_id', 'phone', 'comment', 'photo_url'])
+
+    query = f"SELECT {db.CLIENT_COLUMNS}, external_id FROM clients"
+    args = []
+    if owner_id is not None:
+        query += " WHERE owner_id = $1"
+        args.append(owner_id)
+    query += " ORDER BY id"
+
+    count = 0
+    # Вивантаження читає всю таблицю, тож іде через пул читань (репліку)
+    async with db.read_pool_for(owner_id=owner_id).acquire() as connection:
+        # Курсори asyncpg працюють лише всередині транзакції
+        async with connection.transaction():
+            async for record in connection.cursor(query, *args, prefetch=EXPORT_PREFETCH):
+                row = _export_row(record, fmt)
+                if writer:
+                    writer.writerow(row)
+                else:
+                    file.write(row + '\n')
+                count += 1
+    return count
+
+
+# --- КОМАНДИ БОТА ---
+
+def _is_admin(message: Message) -> bool:
+    return message.from_user.id in settings.ADMIN_IDS
+
+
+@router.message(Command("import"), F.document)
+async def cmd_import(message: Message, bot: Bot):
+    """Імпорт: надішліть файл .csv або .jsonl з підписом /import."""
+    if not _is_admin(message):
+        await message.answer("⛔ Імпорт доступний лише адміністраторам.")
+        return
+
+    fmt = detect_format(message.document.file_name or '')
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"import.{fmt}")
+        await bot.download(message.document, destination=path)
+        await message.answer("⏳ Імпортую клієнтів...")
+        try:
+            owner_id = await db.resolve_owner(message.from_user.id)
+            stats = await import_clients(path, owner_id, fmt)
+        except Exception as e:
+            logging.error(f"Bulk import failed: {e}")
+            await message.answer(f"❌ Імпорт не вдався: {e}")
+            return
+
+    await message.answer(
+        f"✅ Імпорт завершено.\n"
+        f"Прочитано рядків: {stats['read']}\n"
+        f"Збережено клієнтів: {stats['imported']}\n"
+        f"Пропущено: {stats['skipped']}"
+    )
+
+
+@router.message(Command("export"))
+async def cmd_export(message: Message):
+    """Експорт клієнтів команди у JSONL-файл (/export csv — у CSV)."""
+    if not _is_admin(message):
+        await message.answer("⛔ Експорт доступний лише адміністраторам.")
+        return
+
+    fmt = 'csv' if 'csv' in (message.text or '').lower() else 'jsonl'
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        path = os.path.join(tmp_dir, f"clients.{fmt}")
+        with open(path, 'w', encoding='utf-8', newline='') as file:
+            count = await export_clients(file, fmt, await db.resolve_owner(message.from_user.id))
+        await message.answer_document(FSInputFile(path), caption=f"📦 Експортовано клієнтів: {count}")
+
+
+# --- CLI ---
+
+async def _main(args: argparse.Namespace):
+    await db.init_db()
+    try:
+        if args.command == 'import':
+            stats = await import_clients(args.path, args.owner_id, args.format, args.batch_size)
+            print(json.dumps(stats))
+        else:
+            fmt = args.format or detect_format(args.path)
+            with open(args.path, 'w', encoding='utf-8', newline='') as file:
+                count = await export_clients(file, fmt, args.owner_id)
+            print(f"Exported {count} clients to {args.path}")
+    finally:
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Масовий імпорт та експорт клієнтів.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    import_parser = subparsers.add_parser('import', help="Імпорт з CSV/JSONL")
+    import_parser.add_argument('path')
+    import_parser.add_argument('--owner-id', type=int, required=True, help="Команда, якій належатимуть клієнти")
+    import_parser.add_argument('--format', choices=['csv', 'jsonl'])
+    import_parser.add_argument('--batch-size', type=int, default=IMPORT_BATCH_SIZE)
+
+    export_parser = subparsers.add_parser('export', help="Експорт у CSV/JSONL")
+    export_parser.add_argument('path')
+    export_parser.add_argument('--owner-id', type=int, help="Лише клієнти цієї команди (за замовчуванням — усі)")
+    export_parser.add_argument('--format', choices=['csv', 'jsonl'])
+
+    asyncio.run(_main(parser.parse_args()))
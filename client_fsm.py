@@ -1,19 +1,19 @@
-import uuid
 import re
 from aiogram import Router, F, Bot, types
 from aiogram.filters import Command, StateFilter
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import StatesGroup, State, default_state
+from aiogram.exceptions import TelegramBadRequest
 from aiogram.types import (
     Message, InlineKeyboardMarkup, InlineKeyboardButton, CallbackQuery, 
-    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove
+    ReplyKeyboardMarkup, KeyboardButton, ReplyKeyboardRemove, InputMediaPhoto
 )
 import logging
 from typing import List, Dict, Any, Union
 
 from config import settings
 import database as db
-import s3_storage
+import photo_jobs
 from data_cleaner import normalize_phone_number, normalize_phone_list # Переконайтесь, що цей імпорт коректний
 
 # Ми імпортуємо MENU_KEYBOARD з main.py, але для коректної роботи в цьому файлі
@@ -39,6 +39,9 @@ PHOTO_SKIP_KEYBOARD = ReplyKeyboardMarkup(
 router = Router()
 logging.basicConfig(level=logging.INFO)
 
+# Telegram дозволяє не більше 10 фото в одному альбомі
+MEDIA_GROUP_LIMIT = 10
+
 # --- FSM СТАНИ (ОНОВЛЕНО) ---
 class ClientForm(StatesGroup):
     # Додавання
@@ -70,10 +73,43 @@ def create_edit_inline_keyboard(db_id: int):
             [
                 InlineKeyboardButton(text="✏️ Змінити коментар", callback_data=f"edit_comment_{db_id}"),
                 InlineKeyboardButton(text="❌ Видалити клієнта", callback_data=f"delete_client_{db_id}"),
+            ],
+            [
+                InlineKeyboardButton(text="🖼️ Переглянути фото", callback_data=f"show_photos_{db_id}"),
             ]
         ]
     )
 
+def format_results_page(clients: List[Dict[str, Any]]) -> str:
+    """Текст сторінки результатів пошуку."""
+    response = "✅ Знайдені клієнти (найрелевантніші першими):\n\n"
+    for client in clients:
+        phones = ", ".join(client['phone']) if client['phone'] else "Не вказано"
+        response += f"**ID:{client['id']}**: 📞{phones}, 📝{client['comment'][:20]}...\n"
+    response += "\nОберіть клієнта, щоб відкрити його картку."
+    return response
+
+def create_results_keyboard(clients: List[Dict[str, Any]], prev_cursor, next_cursor):
+    """Кнопки відкриття кожного результату та ◀/▶ з курсорами сусідніх сторінок."""
+    rows = []
+    for client in clients:
+        phones = ", ".join(client['phone']) if client['phone'] else "—"
+        rows.append([InlineKeyboardButton(
+            text=f"ID:{client['id']} · {phones}"[:60], callback_data=f"open_client_{client['id']}"
+        )])
+    navigation = []
+    if prev_cursor:
+        navigation.append(InlineKeyboardButton(
+            text="◀", callback_data=f"results_prev_{db.encode_search_cursor(prev_cursor)}"
+        ))
+    if next_cursor:
+        navigation.append(InlineKeyboardButton(
+            text="▶", callback_data=f"results_next_{db.encode_search_cursor(next_cursor)}"
+        ))
+    if navigation:
+        rows.append(navigation)
+    return InlineKeyboardMarkup(inline_keyboard=rows)
+
 def format_client_info(client: Dict[str, Any]) -> str:
     """Форматує інформацію про клієнта."""
     phones = ", ".join(client['phone']) if client['phone'] else "Не вказано"
@@ -99,22 +135,13 @@ async def cmd_add_client_start(message: Message, state: FSMContext):
 
 
 @router.message(ClientForm.photo_or_skip, F.photo)
-async def process_photo(message: Message, state: FSMContext, bot: Bot):
+async def process_photo(message: Message, state: FSMContext):
     """Обробка отриманого фото (Крок 1/2)."""
     
-    # Завантаження фото
-    photo_file = await bot.get_file(message.photo[-1].file_id)
-    file_io = await bot.download_file(photo_file.file_path)
-    
-    filename = f"{message.from_user.id}_{uuid.uuid4()}.jpg"
-    photo_url = await s3_storage.upload_photo_to_spaces(file_io, filename)
-    
-    if not photo_url:
-        await message.answer("❌ Не вдалося завантажити фотографію. Спробуйте ще раз.")
-        return
-
+    # Фото лише запам'ятовується: завантаження у Spaces виконає фонова черга
     await state.update_data(
-        photo_url=[photo_url],
+        photo_url=[],
+        photo_file_id=message.photo[-1].file_id,
         telegram_id=message.from_user.id 
     )
     
@@ -181,15 +208,22 @@ async def process_phone_and_comment(message: Message, state: FSMContext):
     
     phone_str = ", ".join(normalized_phones)
     photo_urls = data.get('photo_url', [])
-    photo_status = 'Є' if photo_urls else 'Немає'
+    photo_file_id = data.get('photo_file_id')
+    photo_status = 'Є (обробляється)' if photo_file_id else 'Немає'
     
-    await db.add_client(
+    owner_id = await db.resolve_owner(message.from_user.id)
+    db_id = await db.add_client(
+        owner_id=owner_id,
         telegram_id=data.get('telegram_id'), 
         phone=normalized_phones, 
         comment=comment, 
         face_encoding_array=[], 
         photo_url=photo_urls 
     )
+
+    # Фото завантажить і додасть до клієнта фоновий воркер
+    if photo_file_id:
+        await photo_jobs.enqueue(db_id, photo_file_id)
     
     # 4. Завершення
     await state.clear()
@@ -226,21 +260,24 @@ async def process_search_query(message: Message, state: FSMContext):
         await message.answer("Будь ласка, введіть принаймні 3 символи для пошуку.")
         return
     
-    found_clients = await db.find_client_by_query(query)
+    # Ліміт передається в SQL: з БД приходять лише рядки, які буде показано
+    owner_id = await db.resolve_owner(message.from_user.id)
+    found_clients, _, next_cursor = await db.browse_clients(owner_id, query, limit=db.SEARCH_PAGE_SIZE)
     
     if not found_clients:
         await message.answer("❌ За вашим запитом клієнтів не знайдено.")
         await state.clear()
         return
 
-    if len(found_clients) > 1:
-        response = f"✅ Знайдено {len(found_clients)} клієнтів:\n\n"
-        for i, client in enumerate(found_clients[:5]): 
-            phones = ", ".join(client['phone']) if client['phone'] else "Не вказано"
-            response += f"**{i+1}. ID:{client['id']}**: 📞{phones}, 📝{client['comment'][:20]}...\n"
-        response += "\nБудь ласка, уточніть запит."
-        await message.answer(response, parse_mode="Markdown")
-        await state.clear()
+    if len(found_clients) > 1 or next_cursor:
+        # Запит лишається в даних FSM: кнопки ◀/▶ несуть лише курсор сторінки
+        await state.set_state(None)
+        await state.update_data(search_query=query)
+        await message.answer(
+            format_results_page(found_clients),
+            reply_markup=create_results_keyboard(found_clients, None, next_cursor),
+            parse_mode="Markdown"
+        )
     
     else:
         client = found_clients[0]
@@ -253,6 +290,52 @@ async def process_search_query(message: Message, state: FSMContext):
         await message.answer(format_client_info(client), parse_mode="Markdown")
         await state.set_state(ClientForm.waiting_for_edit_select)
     
+@router.callback_query(F.data.startswith("results_prev_") | F.data.startswith("results_next_"))
+async def browse_search_results(call: CallbackQuery, state: FSMContext):
+    """Гортання сторінок результатів (keyset-курсор у callback_data)."""
+    direction, encoded = call.data[len("results_"):].split('_', 1)
+    cursor = db.decode_search_cursor(encoded)
+    query = (await state.get_data()).get('search_query')
+    if not cursor or not query:
+        await call.answer("Результати пошуку застаріли. Повторіть пошук.", show_alert=True)
+        return
+
+    owner_id = await db.resolve_owner(call.from_user.id)
+    if direction == "next":
+        clients, prev_cursor, next_cursor = await db.browse_clients(owner_id, query, after=cursor)
+    else:
+        clients, prev_cursor, next_cursor = await db.browse_clients(owner_id, query, before=cursor)
+    if not clients:
+        await call.answer("Більше результатів немає.", show_alert=True)
+        return
+
+    await call.message.edit_text(
+        format_results_page(clients),
+        reply_markup=create_results_keyboard(clients, prev_cursor, next_cursor),
+        parse_mode="Markdown"
+    )
+    await call.answer()
+
+
+@router.callback_query(F.data.startswith("open_client_"))
+async def open_search_result(call: CallbackQuery, state: FSMContext):
+    """Відкриває картку клієнта зі списку результатів."""
+    db_id = int(call.data.split('_')[-1])
+    owner_id = await db.resolve_owner(call.from_user.id)
+    client = await db.find_client_by_id(db_id, owner_id)
+    if not client:
+        await call.answer("❌ Клієнта не знайдено.", show_alert=True)
+        return
+
+    await state.update_data(found_client_data=client)
+    await call.message.answer(
+        "Що далі?",
+        reply_markup=create_edit_inline_keyboard(client['id'])
+    )
+    await call.message.answer(format_client_info(client), parse_mode="Markdown")
+    await state.set_state(ClientForm.waiting_for_edit_select)
+    await call.answer()
+
 # --- 3. ЛОГІКА РЕДАГУВАННЯ ---
 
 # 3.1. Додати номер
@@ -276,17 +359,12 @@ async def process_new_phone(message: Message, state: FSMContext):
     data = await state.get_data()
     db_id = data.get('client_id_to_edit')
     
-    client = await db.find_client_by_id(db_id)
+    owner_id = await db.resolve_owner(message.from_user.id)
+    client = await db.append_client_phone(db_id, new_phone, owner_id)
     if not client:
         await message.answer("❌ Клієнта не знайдено.")
         await state.clear()
         return
-
-    updated_phones = client['phone']
-    if new_phone not in updated_phones:
-        updated_phones.append(new_phone)
-    
-    await db.update_client_data(db_id, updated_phones, client['comment'], client['photo_url'])
     
     await message.answer(f"✅ Номер **{new_phone}** успішно додано до клієнта ID:{db_id}.", reply_markup=MENU_KEYBOARD)
     await state.clear()
@@ -307,15 +385,12 @@ async def process_new_comment(message: Message, state: FSMContext):
     data = await state.get_data()
     db_id = data.get('client_id_to_edit')
     
-    client = await db.find_client_by_id(db_id)
+    owner_id = await db.resolve_owner(message.from_user.id)
+    client = await db.set_client_comment(db_id, new_comment, owner_id)
     if not client:
         await message.answer("❌ Клієнта не знайдено.")
         await state.clear()
         return
-
-    await db.update_client_data(
-        db_id, client['phone'], new_comment, client['photo_url']
-    )
     
     await message.answer(f"✅ Коментар для клієнта ID:{db_id} успішно оновлено.", reply_markup=MENU_KEYBOARD)
     await state.clear()
@@ -330,37 +405,19 @@ async def start_add_photo(call: CallbackQuery, state: FSMContext):
     await call.answer()
 
 @router.message(ClientForm.waiting_for_new_photo, F.photo)
-async def process_new_photo(message: Message, state: FSMContext, bot: Bot):
+async def process_new_photo(message: Message, state: FSMContext):
     data = await state.get_data()
     db_id = data.get('client_id_to_edit')
     
-    # Завантаження фото
-    photo_file = await bot.get_file(message.photo[-1].file_id)
-    file_io = await bot.download_file(photo_file.file_path)
-    
-    filename = f"{db_id}_{uuid.uuid4()}.jpg"
-    new_photo_url = await s3_storage.upload_photo_to_spaces(file_io, filename)
-    
-    if not new_photo_url:
-        await message.answer("❌ Не вдалося завантажити фотографію. Спробуйте ще раз.")
-        await state.clear()
-        return
-    
-    client = await db.find_client_by_id(db_id)
-    if not client:
+    # Завантаження у Spaces та прив'язку до клієнта виконає фонова черга
+    owner_id = await db.resolve_owner(message.from_user.id)
+    job_id = await photo_jobs.enqueue(db_id, message.photo[-1].file_id, owner_id)
+    if not job_id:
         await message.answer("❌ Клієнта не знайдено.")
         await state.clear()
         return
-
-    updated_photos = client['photo_url']
-    updated_photos.append(new_photo_url)
-    
-    # Оновлення даних
-    await db.update_client_data(
-        db_id, client['phone'], client['comment'], updated_photos
-    )
     
-    await message.answer(f"✅ Нова фотографія успішно додана до профілю клієнта ID:{db_id}.", reply_markup=MENU_KEYBOARD)
+    await message.answer(f"✅ Фотографію прийнято. Вона з'явиться в профілі клієнта ID:{db_id} за кілька секунд.", reply_markup=MENU_KEYBOARD)
     await state.clear()
     
 # 3.4. Видалити клієнта
@@ -368,7 +425,8 @@ async def process_new_photo(message: Message, state: FSMContext, bot: Bot):
 async def confirm_delete_client(call: CallbackQuery, state: FSMContext):
     db_id = int(call.data.split('_')[-1])
     
-    was_deleted = await db.delete_client(db_id)
+    owner_id = await db.resolve_owner(call.from_user.id)
+    was_deleted = await db.delete_client(db_id, owner_id)
 
     if was_deleted:
         await call.message.edit_text(f"❌ Клієнта ID:{db_id} **успішно видалено** з бази даних.", parse_mode="Markdown")
@@ -377,3 +435,60 @@ async def confirm_delete_client(call: CallbackQuery, state: FSMContext):
         
     await state.clear()
     await call.answer()
+
+
+# --- 4. ГАЛЕРЕЯ ФОТО ---
+
+async def _send_photos(bot: Bot, chat_id: int, sources: List[str]) -> List[Message]:
+    """Альбом із 2–10 фото; одне фото Telegram в альбомі не приймає, тому воно йде через send_photo."""
+    if len(sources) == 1:
+        return [await bot.send_photo(chat_id, sources[0])]
+    return await bot.send_media_group(chat_id, [InputMediaPhoto(media=source) for source in sources])
+
+
+async def send_photo_album(bot: Bot, chat_id: int, client: Dict[str, Any]):
+    """
+    Надсилає фото клієнта альбомами. Використовує збережені Telegram file_id,
+    а URL зі Spaces (прев'ю, якщо є) — лише для фото, яких ще немає в кеші.
+    """
+    photo_urls = client['photo_url'] or []
+    previews = {
+        variant['original']: variant.get('preview', variant['original'])
+        for variant in client.get('photo_variants') or []
+    }
+    cached = await db.get_photo_file_ids(photo_urls)
+
+    for start in range(0, len(photo_urls), MEDIA_GROUP_LIMIT):
+        chunk = photo_urls[start:start + MEDIA_GROUP_LIMIT]
+        try:
+            messages = await _send_photos(bot, chat_id, [cached.get(url) or previews.get(url, url) for url in chunk])
+        except TelegramBadRequest as e:
+            # Застарілий file_id: повторюємо з URL і перезаписуємо кеш
+            logging.warning(f"Cached file_id rejected for client {client['id']}: {e}")
+            for url in chunk:
+                cached.pop(url, None)
+            messages = await _send_photos(bot, chat_id, [previews.get(url, url) for url in chunk])
+
+        new_file_ids = {
+            url: sent.photo[-1].file_id
+            for url, sent in zip(chunk, messages)
+            if url not in cached and sent.photo
+        }
+        await db.save_photo_file_ids(new_file_ids)
+
+
+@router.callback_query(F.data.startswith("show_photos_"))
+async def show_client_photos(call: CallbackQuery, bot: Bot):
+    db_id = int(call.data.split('_')[-1])
+    owner_id = await db.resolve_owner(call.from_user.id)
+    client = await db.find_client_by_id(db_id, owner_id)
+
+    if not client:
+        await call.answer("❌ Клієнта не знайдено.", show_alert=True)
+        return
+    if not client['photo_url']:
+        await call.answer("У клієнта немає фото.", show_alert=True)
+        return
+
+    await call.answer()
+    await send_photo_album(bot, call.message.chat.id, client)
@@ -1,4 +1,6 @@
+import importlib.util
 import os
+import re
 from dotenv import load_dotenv
 
 load_dotenv()
@@ -9,17 +11,123 @@ class Settings:
     API_ID: str = os.getenv("API_ID")
     API_HASH: str = os.getenv("API_HASH")
 
+    # Telegram ID адміністраторів (через кому): масовий імпорт/експорт
+    ADMIN_IDS: set = {int(x) for x in os.getenv("ADMIN_IDS", "").split(",") if x.strip()}
+
+    # Режим отримання оновлень: "polling" або "webhook"
+    BOT_MODE: str = os.getenv("BOT_MODE", "polling")
+    WEBHOOK_URL: str = os.getenv("WEBHOOK_URL")  # Публічна адреса, напр. https://crm.example.com
+    WEBHOOK_PATH: str = os.getenv("WEBHOOK_PATH", "/webhook")
+    WEBHOOK_SECRET: str = os.getenv("WEBHOOK_SECRET")
+    WEBHOOK_HOST: str = os.getenv("WEBHOOK_HOST", "0.0.0.0")
+    WEBHOOK_PORT: int = int(os.getenv("WEBHOOK_PORT", "8080"))
+    WEBHOOK_DRAIN_TIMEOUT: float = float(os.getenv("WEBHOOK_DRAIN_TIMEOUT", "30"))
+
     # PostgreSQL
     DATABASE_URL: str = os.getenv("DATABASE_URL")
+    DB_POOL_MIN_SIZE: int = int(os.getenv("DB_POOL_MIN_SIZE", "2"))
+    DB_POOL_MAX_SIZE: int = int(os.getenv("DB_POOL_MAX_SIZE", "10"))
+    DB_STATEMENT_CACHE_SIZE: int = int(os.getenv("DB_STATEMENT_CACHE_SIZE", "100"))
+    DB_COMMAND_TIMEOUT: float = float(os.getenv("DB_COMMAND_TIMEOUT", "30"))
+    DB_MAX_INACTIVE_CONNECTION_LIFETIME: float = float(os.getenv("DB_MAX_INACTIVE_CONNECTION_LIFETIME", "300"))
+    # Міграції схеми під час старту (0 — лише перевірка, міграції виконує
+    # окремий крок `python database.py`) та спроби підключення до БД при старті
+    DB_AUTO_MIGRATE: bool = os.getenv("DB_AUTO_MIGRATE", "1") == "1"
+    DB_CONNECT_RETRIES: int = int(os.getenv("DB_CONNECT_RETRIES", "5"))
+    # Пул читань (пошук, повні вибірки): репліка або, без неї, основна БД з окремим
+    # лімітом з'єднань (DB_READ_POOL_MAX_SIZE=0 — один спільний пул). Протягом
+    # DB_READ_YOUR_WRITES_WINDOW секунд після зміни клієнт і його команда читаються з основної БД.
+    DATABASE_REPLICA_URL: str = os.getenv("DATABASE_REPLICA_URL")
+    DB_READ_POOL_MIN_SIZE: int = int(os.getenv("DB_READ_POOL_MIN_SIZE", "1"))
+    DB_READ_POOL_MAX_SIZE: int = int(os.getenv("DB_READ_POOL_MAX_SIZE", "5"))
+    DB_READ_YOUR_WRITES_WINDOW: float = float(os.getenv("DB_READ_YOUR_WRITES_WINDOW", "5"))
+    # Кількість хеш-секцій client_phones за owner_id (0 — без секціонування).
+    # Застосовується один раз; змінити кількість секцій після цього не можна.
+    DB_PHONE_PARTITIONS: int = int(os.getenv("DB_PHONE_PARTITIONS", "0"))
+
+    # FSM-сховище: "memory" (один процес) або "postgres" (спільне для кількох реплік)
+    FSM_STORAGE: str = os.getenv("FSM_STORAGE", "memory")
+    FSM_STATE_TTL: float = float(os.getenv("FSM_STATE_TTL", "86400"))
+
+    # Кеш клієнтів у пам'яті процесу (0 — вимкнено)
+    CLIENT_CACHE_SIZE: int = int(os.getenv("CLIENT_CACHE_SIZE", "1024"))
+    CLIENT_CACHE_TTL: float = float(os.getenv("CLIENT_CACHE_TTL", "60"))
+    # Кеш «оператор -> команда (owner_id)»
+    OPERATOR_CACHE_TTL: float = float(os.getenv("OPERATOR_CACHE_TTL", "300"))
+
+    # Inline-пошук (@bot запит): пауза між натисканнями клавіш, розмір сторінки,
+    # кеш відповідей у Telegram (cache_time) та в пам'яті процесу
+    INLINE_DEBOUNCE: float = float(os.getenv("INLINE_DEBOUNCE", "0.3"))
+    INLINE_PAGE_SIZE: int = int(os.getenv("INLINE_PAGE_SIZE", "20"))
+    INLINE_CACHE_TIME: int = int(os.getenv("INLINE_CACHE_TIME", "10"))
+    INLINE_CACHE_SIZE: int = int(os.getenv("INLINE_CACHE_SIZE", "512"))
+    INLINE_CACHE_TTL: float = float(os.getenv("INLINE_CACHE_TTL", "30"))
+
+    # Метрики Prometheus на локальному HTTP-порту (0 — вимкнено) та журнал
+    # повільних операцій (обробники, SQL, S3, Bot API) понад поріг у секундах
+    METRICS_HOST: str = os.getenv("METRICS_HOST", "127.0.0.1")
+    METRICS_PORT: int = int(os.getenv("METRICS_PORT", "9464"))
+    METRICS_SLOW_THRESHOLD: float = float(os.getenv("METRICS_SLOW_THRESHOLD", "1.0"))
+
+    # Планувальник вихідних повідомлень: загальний ліміт бота (повідомлень/с),
+    # ліміт і допустимий сплеск на чат, повтори після 429 та об'єднання черги чату
+    SEND_GLOBAL_RATE: float = float(os.getenv("SEND_GLOBAL_RATE", "25"))
+    SEND_CHAT_RATE: float = float(os.getenv("SEND_CHAT_RATE", "1"))
+    SEND_CHAT_BURST: int = int(os.getenv("SEND_CHAT_BURST", "3"))
+    SEND_MAX_RETRIES: int = int(os.getenv("SEND_MAX_RETRIES", "3"))
+    SEND_COALESCE: bool = os.getenv("SEND_COALESCE", "1") == "1"
+
+    # Країна для номерів без міжнародного коду (див. phone_numbers.COUNTRY_RULES)
+    DEFAULT_PHONE_COUNTRY: str = os.getenv("DEFAULT_PHONE_COUNTRY", "UA")
 
     # DigitalOcean Spaces
     SPACES_ACCESS_KEY: str = os.getenv("SPACES_ACCESS_KEY")
     SPACES_SECRET_KEY: str = os.getenv("SPACES_SECRET_KEY")
     SPACES_ENDPOINT_URL: str = os.getenv("SPACES_ENDPOINT_URL")
     SPACES_BUCKET_NAME: str = os.getenv("SPACES_BUCKET_NAME")
+    SPACES_MAX_CONCURRENT_UPLOADS: int = int(os.getenv("SPACES_MAX_CONCURRENT_UPLOADS", "4"))
+    SPACES_MAX_POOL_CONNECTIONS: int = int(os.getenv("SPACES_MAX_POOL_CONNECTIONS", "10"))
 
-settings = Settings()
+    # Похідні зображення (мініатюра та прев'ю) і пул потоків для їх рендерингу
+    PHOTO_THUMB_SIZE: int = int(os.getenv("PHOTO_THUMB_SIZE", "320"))
+    PHOTO_PREVIEW_SIZE: int = int(os.getenv("PHOTO_PREVIEW_SIZE", "1280"))
+    IMAGE_WORKERS: int = int(os.getenv("IMAGE_WORKERS", "2"))
+
+    # Прибирання осиротілих об'єктів у Spaces (0 — фоновий прибиральник вимкнений)
+    STORAGE_GC_INTERVAL: float = float(os.getenv("STORAGE_GC_INTERVAL", "300"))
+    STORAGE_GC_GRACE: float = float(os.getenv("STORAGE_GC_GRACE", "300"))
+
+    # Фонова черга обробки фото
+    PHOTO_JOB_WORKERS: int = int(os.getenv("PHOTO_JOB_WORKERS", "2"))
+    PHOTO_JOB_POLL_INTERVAL: float = float(os.getenv("PHOTO_JOB_POLL_INTERVAL", "2"))
+    PHOTO_JOB_MAX_ATTEMPTS: int = int(os.getenv("PHOTO_JOB_MAX_ATTEMPTS", "5"))
+    PHOTO_JOB_BACKOFF: float = float(os.getenv("PHOTO_JOB_BACKOFF", "5"))
+    PHOTO_JOB_LEASE: float = float(os.getenv("PHOTO_JOB_LEASE", "120"))
+
+    # Пошук за обличчям: "memory" (NumPy-матриця в процесі) або "pgvector"
+    FACE_INDEX_BACKEND: str = os.getenv("FACE_INDEX_BACKEND", "memory")
 
-# Критична перевірка: без токена, БД та API-ключів бот не працюватиме
-if not all([settings.BOT_TOKEN, settings.DATABASE_URL, settings.API_ID, settings.API_HASH]):
-    raise ValueError("Критична помилка: Не всі необхідні ключі (BOT_TOKEN, DATABASE_URL, API_ID, API_HASH) знайдені у змінних середовища.")
+    # Обчислення кодувань облич: "" (вимкнено), "stub" або "face_recognition"
+    FACE_ENCODER: str = os.getenv("FACE_ENCODER", "")
+    FACE_ENCODER_WORKERS: int = int(os.getenv("FACE_ENCODER_WORKERS", "1"))
+    FACE_BATCH_SIZE: int = int(os.getenv("FACE_BATCH_SIZE", "8"))
+    FACE_BATCH_WINDOW_MS: int = int(os.getenv("FACE_BATCH_WINDOW_MS", "200"))
+
+    def validate(self):
+        """
+        Критична перевірка: без токена, БД та API-ключів бот не працюватиме.
+        Викликається під час запуску бота, а не при імпорті, тож утиліти й
+        профілювання імпорту працюють без повного набору змінних середовища.
+        """
+        if not all([self.BOT_TOKEN, self.DATABASE_URL, self.API_ID, self.API_HASH]):
+            raise ValueError("Критична помилка: Не всі необхідні ключі (BOT_TOKEN, DATABASE_URL, API_ID, API_HASH) знайдені у змінних середовища.")
+        if self.BOT_MODE == "webhook" and not (self.WEBHOOK_URL and self.WEBHOOK_SECRET):
+            # Без секрету будь-хто, хто знає адресу, може надсилати підроблені оновлення
+            raise ValueError("Критична помилка: Для BOT_MODE=webhook потрібно задати WEBHOOK_URL та WEBHOOK_SECRET.")
+        if self.BOT_MODE == "webhook" and not re.fullmatch(r'[A-Za-z0-9_-]{1,256}', self.WEBHOOK_SECRET):
+            raise ValueError("Критична помилка: WEBHOOK_SECRET може містити лише A-Z, a-z, 0-9, _ та - (до 256 символів).")
+        if self.FACE_INDEX_BACKEND == "memory" and importlib.util.find_spec("numpy") is None:
+            # Інакше пошук за обличчям падав би лише під час запиту, а індекс мовчки не будувався
+            raise ValueError("Критична помилка: FACE_INDEX_BACKEND=memory потребує numpy (або задайте FACE_INDEX_BACKEND=pgvector).")
+
+settings = Settings()
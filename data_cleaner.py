@@ -2,7 +2,9 @@
 import re
 from typing import List
 
-def normalize_phone_number(raw_number: str) -> str:
+from phone_numbers import canonicalize, canonicalize_many
+
+def _strip_phone_number(raw_number: str) -> str:
     """Видаляє всі символи, крім цифр та знака '+', залишаючи '+' на початку."""
     # 1. Видаляємо всі символи, крім цифр та знака '+'
     cleaned_number = re.sub(r'[^0-9\+]', '', raw_number)
@@ -13,9 +15,16 @@ def normalize_phone_number(raw_number: str) -> str:
         
     return cleaned_number
 
+def normalize_phone_number(raw_number: str) -> str:
+    """
+    Канонічний E.164-номер (див. phone_numbers.canonicalize). Рядок, який не
+    вдалося розібрати як повний номер, лише очищується від зайвих символів.
+    """
+    return canonicalize(raw_number) or _strip_phone_number(raw_number)
+
 def normalize_phone_list(raw_phone_list: List[str]) -> List[str]:
-    """Нормалізує список номерів та видаляє дублікати."""
-    normalized_list = set()
-    for num in raw_phone_list:
-        normalized_list.add(normalize_phone_number(num))
+    """Нормалізує список номерів та видаляє дублікати (порядок зберігається)."""
+    normalized_list = {}
+    for raw_number, canonical in zip(raw_phone_list, canonicalize_many(raw_phone_list)):
+        normalized_list[canonical or _strip_phone_number(raw_number)] = None
     return list(normalized_list)
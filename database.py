@@ -1,18 +1,199 @@
 import asyncpg
 from config import settings
+import asyncio
+import base64
+import binascii
+import copy
 import json
 import logging
 import re
-from typing import List, Dict, Any, Union
+import struct
+import time
+from typing import List, Dict, Any, Union, Optional, Tuple
 
 # ІМПОРТУЄМО ФУНКЦІЮ НОРМАЛІЗАЦІЇ З ВАШОГО ОКРЕМОГО ФАЙЛУ
-from data_cleaner import normalize_phone_number 
+from data_cleaner import normalize_phone_list
+from phone_numbers import canonicalize, phone_key
+import face_index
+from face_index import encode_embedding, decode_embedding, to_pgvector_literal
+from cache import LRUTTLCache
+import metrics
 
+# orjson значно швидший за стандартний json; використовується, якщо встановлений
+try:
+    import orjson
+
+    def _json_dumps(value: Any) -> str:
+        return orjson.dumps(value).decode()
+
+    _json_loads = orjson.loads
+except ImportError:
+    _json_dumps = json.dumps
+    _json_loads = json.loads
+
+# db_pool — основна БД: записи та читання, яким потрібні щойно зроблені зміни.
+# read_pool — важкі читання (пошук, повні вибірки) з власним лімітом з'єднань,
+# на репліці DATABASE_REPLICA_URL, якщо вона задана; інакше — теж на основній БД.
 db_pool = None
+read_pool = None
 logging.basicConfig(level=logging.INFO)
 
+# Колонки клієнта, які повертаються обробникам (без службових tsvector/кодувань)
+CLIENT_COLUMNS = "id, owner_id, telegram_id, phone, comment, photo_url, photo_variants"
+
+# Розмір сторінки результатів пошуку за замовчуванням
+SEARCH_PAGE_SIZE = 5
+
+# Кеш клієнтів за ID. Інвалідується локально при змінах та через
+# LISTEN/NOTIFY, коли клієнта змінює інший процес бота.
+client_cache = LRUTTLCache(maxsize=settings.CLIENT_CACHE_SIZE, ttl=settings.CLIENT_CACHE_TTL)
+CLIENTS_CHANGED_CHANNEL = "clients_changed"
+# Параметр сесії, що вимикає NOTIFY на кожен рядок (масові зміни надсилають одне повідомлення)
+SUPPRESS_CLIENT_NOTIFY_SETTING = "crm.suppress_client_notify"
+BULK_CHANGE_PREFIX = "owner:"
+# Команда (owner_id) оператора за його Telegram ID
+operator_cache = LRUTTLCache(maxsize=settings.CLIENT_CACHE_SIZE, ttl=settings.OPERATOR_CACHE_TTL)
+_listener_connection = None
+_listener_task = None
+# Клієнти, змінені іншими процесами, чиї рядки in-memory індексу облич треба перечитати
+_face_refresh_ids = set()
+_face_refresh_task = None
+# PID бекендів пулу записів цього процесу: їхні зміни вже враховано локально
+_own_backend_pids = set()
+
+# Нещодавно змінені клієнти та команди: поки репліка може відставати,
+# їх читання йде в основну БД (read-your-writes)
+RECENT_WRITES_SIZE = 10000
+_recent_writes = LRUTTLCache(maxsize=RECENT_WRITES_SIZE, ttl=settings.DB_READ_YOUR_WRITES_WINDOW)
+
+metrics.watch_cache("client", client_cache)
+metrics.watch_cache("operator", operator_cache)
+
 # --- УТИЛІТА: (Попередня функція нормалізації ВИДАЛЕНА) ---
 
+class _TimedAcquire:
+    def __init__(self, context, pool_name: str):
+        self._context = context
+        self._pool_name = pool_name
+
+    async def __aenter__(self):
+        started = time.perf_counter()
+        try:
+            return await self._context.__aenter__()
+        finally:
+            metrics.DB_POOL_WAIT.observe(time.perf_counter() - started, pool=self._pool_name)
+
+    async def __aexit__(self, *exc_info):
+        return await self._context.__aexit__(*exc_info)
+
+
+class InstrumentedPool:
+    """
+    Обгортка пулу asyncpg: acquire() додатково вимірює очікування вільного
+    з'єднання, решта атрибутів (close, get_size, ...) передається пулу.
+    """
+
+    def __init__(self, pool: asyncpg.Pool, name: str = "write"):
+        self._pool = pool
+        self.name = name
+
+    def acquire(self, *, timeout: Optional[float] = None):
+        return _TimedAcquire(self._pool.acquire(timeout=timeout), self.name)
+
+    def __getattr__(self, attribute):
+        return getattr(self._pool, attribute)
+
+
+_TABLE_PATTERN = re.compile(r'\b(?:FROM|INTO|UPDATE)\s+(\w+)', re.IGNORECASE)
+
+
+def _query_label(query: str) -> str:
+    """
+    Назва запиту для метрик: ім'я з HOT_STATEMENTS або «дієслово таблиця»
+    (select clients, insert photo_jobs, ...).
+    """
+    name = _HOT_STATEMENT_NAMES.get(query)
+    if name:
+        return name
+    words = query.split(None, 1)
+    table = _TABLE_PATTERN.search(query)
+    return f"{words[0].lower() if words else ''} {table.group(1) if table else ''}".strip()
+
+
+def _log_query(record):
+    metrics.DB_QUERY_LATENCY.observe(record.elapsed, query=_query_label(record.query))
+
+
+async def _setup_connection(connection):
+    """Хук пулу: нативні JSON/JSONB-кодеки замість ручних json.dumps/json.loads."""
+    for type_name in ('json', 'jsonb'):
+        await connection.set_type_codec(
+            type_name, encoder=_json_dumps, decoder=_json_loads, schema='pg_catalog'
+        )
+    connection.add_query_logger(_log_query)
+
+
+async def _setup_write_connection(connection):
+    """Хук пулу записів: ще й запам'ятовує PID бекенда, щоб не обробляти власні NOTIFY."""
+    await _setup_connection(connection)
+    pid = connection.get_server_pid()
+    _own_backend_pids.add(pid)
+    connection.add_termination_listener(lambda _: _own_backend_pids.discard(pid))
+
+
+async def close_db():
+    """Закриває пули підключень та з'єднання слухача інвалідацій."""
+    global db_pool, read_pool, _listener_connection, _listener_task, _face_refresh_task
+    if _listener_task:
+        _listener_task.cancel()
+        _listener_task = None
+    if _face_refresh_task:
+        _face_refresh_task.cancel()
+        _face_refresh_task = None
+    _face_refresh_ids.clear()
+    if _listener_connection and not _listener_connection.is_closed():
+        _listener_connection.remove_termination_listener(_on_listener_lost)
+        await _listener_connection.close()
+    _listener_connection = None
+    if read_pool and read_pool is not db_pool:
+        await read_pool.close()
+    read_pool = None
+    if db_pool:
+        await db_pool.close()
+        db_pool = None
+    _recent_writes.clear()
+
+
+async def _create_pool(dsn: str, min_size: int, max_size: int, name: str) -> InstrumentedPool:
+    return InstrumentedPool(await asyncpg.create_pool(
+        dsn=dsn,
+        min_size=min_size,
+        max_size=max_size,
+        command_timeout=settings.DB_COMMAND_TIMEOUT,
+        statement_cache_size=settings.DB_STATEMENT_CACHE_SIZE,
+        max_inactive_connection_lifetime=settings.DB_MAX_INACTIVE_CONNECTION_LIFETIME,
+        init=_setup_write_connection if name == "write" else _setup_connection,
+    ), name=name)
+
+
+async def _init_read_pool():
+    """Пул читань: репліка, основна БД (окремий ліміт з'єднань) або спільний db_pool."""
+    global read_pool
+    if settings.DB_READ_POOL_MAX_SIZE <= 0:
+        read_pool = db_pool
+        return
+    dsn = settings.DATABASE_REPLICA_URL or settings.DATABASE_URL
+    try:
+        read_pool = await _create_pool(
+            dsn, settings.DB_READ_POOL_MIN_SIZE, settings.DB_READ_POOL_MAX_SIZE, name="read"
+        )
+    except Exception as e:
+        if not settings.DATABASE_REPLICA_URL:
+            raise
+        # Недоступна репліка не повинна зупиняти бота: читаємо з основної БД
+        logging.error(f"ERROR: Read replica is unavailable, reads fall back to the primary: {e}")
+        read_pool = db_pool
+
 async def init_db():
     """Створює пул підключень до PostgreSQL та ініціалізує таблиці."""
     global db_pool
@@ -20,131 +201,1238 @@ async def init_db():
         return
 
     try:
-        db_pool = await asyncpg.create_pool(dsn=settings.DATABASE_URL)
+        db_pool = await _create_pool(
+            settings.DATABASE_URL, settings.DB_POOL_MIN_SIZE, settings.DB_POOL_MAX_SIZE, name="write"
+        )
         async with db_pool.acquire() as connection:
-            await connection.execute("""
-                CREATE TABLE IF NOT EXISTS clients (
-                    id SERIAL PRIMARY KEY,
-                    telegram_id BIGINT UNIQUE NOT NULL,
-                    phone JSONB, 
-                    comment TEXT,
-                    face_encoding JSONB, 
-                    photo_url JSONB
-                );
-            """)
+            if settings.DB_AUTO_MIGRATE:
+                await _run_migrations(connection)
+            else:
+                await _check_migrations(connection)
+            await _load_face_index(connection)
+        await _init_read_pool()
+        await _start_invalidation_listener()
         logging.info("INFO: PostgreSQL database and tables initialized successfully.")
 
     except Exception as e:
         logging.error(f"ERROR: Failed to connect or initialize PostgreSQL: {e}")
+        # Наступна спроба init_db має починати з нуля, а не з напівготового пулу
+        await close_db()
         raise
 
-async def add_client(telegram_id: int, phone: List[str], comment: str, face_encoding_array: List[float], photo_url: List[str]):
-    """Зберігає або оновлює дані клієнта (номери мають бути нормалізовані)."""
+async def migrate():
+    """Окремий крок розгортання: застосовує міграції без запуску бота."""
+    connection = await asyncpg.connect(dsn=settings.DATABASE_URL)
+    try:
+        await _setup_connection(connection)
+        await _run_migrations(connection)
+    finally:
+        await connection.close()
+
+# --- МІГРАЦІЇ ---
+
+async def _applied_migrations(connection) -> set:
+    if not await connection.fetchval("SELECT to_regclass('schema_migrations') IS NOT NULL"):
+        return set()
+    return {record['version'] for record in await connection.fetch("SELECT version FROM schema_migrations")}
+
+
+def _pending_migrations(applied: set) -> list:
+    """Ще не застосовані міграції, крім вимкнених налаштуваннями (MIGRATION_CONDITIONS)."""
+    pending = []
+    for migration in MIGRATIONS:
+        condition = MIGRATION_CONDITIONS.get(migration[0])
+        if migration[0] not in applied and (condition is None or condition()):
+            pending.append(migration)
+    return pending
+
+
+async def _run_migrations(connection):
+    """
+    Застосовує ще не виконані міграції з MIGRATIONS. Для актуальної схеми це
+    кілька SELECT без DDL. Процеси бота, що стартують одночасно, чекають
+    один одного на advisory-lock, тож кожна міграція виконується рівно раз.
+    """
+    if not _pending_migrations(await _applied_migrations(connection)):
+        return
+
+    await connection.execute("SELECT pg_advisory_lock($1)", MIGRATIONS_LOCK_ID)
+    try:
+        await connection.execute("""
+            CREATE TABLE IF NOT EXISTS schema_migrations (
+                version INTEGER PRIMARY KEY,
+                name TEXT NOT NULL,
+                applied_at TIMESTAMPTZ NOT NULL DEFAULT now()
+            );
+        """)
+        # Поки ми чекали на блокування, міграції міг застосувати інший процес
+        for version, name, migration in _pending_migrations(await _applied_migrations(connection)):
+            started = time.perf_counter()
+            async with connection.transaction():
+                await migration(connection)
+                await connection.execute(
+                    "INSERT INTO schema_migrations (version, name) VALUES ($1, $2)", version, name
+                )
+            logging.info(f"INFO: Applied migration {version:03d}_{name} in {time.perf_counter() - started:.2f}s.")
+    finally:
+        await connection.execute("SELECT pg_advisory_unlock($1)", MIGRATIONS_LOCK_ID)
+
+
+async def _check_migrations(connection):
+    """DB_AUTO_MIGRATE=0: схему готує окремий крок (python database.py), бот лише перевіряє її."""
+    applied = await _applied_migrations(connection)
+    pending = [f"{version:03d}_{name}" for version, name, _ in _pending_migrations(applied)]
+    if pending:
+        raise Exception(f"Database schema is outdated, pending migrations: {', '.join(pending)}")
+
+
+async def _migrate_phone_partitions(connection):
+    """Секціонування client_phones для бази, створеної до DB_PHONE_PARTITIONS."""
+    if await _partition_client_phones(connection, settings.DB_PHONE_PARTITIONS):
+        await _create_phone_indexes(connection)
+
+
+async def _migrate_clients_table(connection):
+    """Початкова таблиця клієнтів."""
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS clients (
+            id SERIAL PRIMARY KEY,
+            owner_id BIGINT NOT NULL,
+            telegram_id BIGINT,
+            phone JSONB, 
+            comment TEXT,
+            face_encoding JSONB, 
+            photo_url JSONB
+        );
+    """)
+
+async def _migrate_client_phones(connection):
+    """Створює таблицю номерів клієнтів (індекси та заповнення — у _migrate_tenancy)."""
+    await connection.execute("""
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+
+        CREATE TABLE IF NOT EXISTS client_phones (
+            client_id INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE,
+            phone TEXT NOT NULL,
+            digits TEXT NOT NULL,
+            PRIMARY KEY (client_id, phone)
+        );
+    """)
+
+
+async def _migrate_comment_search(connection):
+    """Додає tsvector-колонку коментаря (GIN-індекси за командою — у _migrate_tenancy)."""
+    # 'simple' — без стемінгу: у стандартному PostgreSQL немає української конфігурації
+    await connection.execute("""
+        ALTER TABLE clients
+            ADD COLUMN IF NOT EXISTS comment_tsv tsvector
+            GENERATED ALWAYS AS (to_tsvector('simple', coalesce(comment, ''))) STORED;
+    """)
+
+
+async def _migrate_tenancy(connection):
+    """
+    Модель власності: оператор належить команді (operators.owner_id), клієнт — команді
+    (clients.owner_id). Раніше telegram_id оператора був UNIQUE, і кожен новий клієнт
+    перезаписував попереднього; наявні рядки переходять у команду свого оператора.
+    Усі індекси пошуку починаються з owner_id, тож запит команди не читає чужих рядків.
+    """
+    await connection.execute("""
+        -- btree_gin: owner_id у складених GIN-індексах разом із tsvector/триграмами
+        CREATE EXTENSION IF NOT EXISTS btree_gin;
+
+        CREATE TABLE IF NOT EXISTS operators (
+            id BIGINT PRIMARY KEY,
+            owner_id BIGINT NOT NULL,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS operators_owner_id_idx ON operators (owner_id);
+
+        -- telegram_id тепер лише автор запису, а не ключ клієнта
+        ALTER TABLE clients DROP CONSTRAINT IF EXISTS clients_telegram_id_key;
+        ALTER TABLE clients ALTER COLUMN telegram_id DROP NOT NULL;
+        ALTER TABLE clients ADD COLUMN IF NOT EXISTS owner_id BIGINT;
+        -- Ключ запису у зовнішній системі (повторний масовий імпорт оновлює, а не дублює)
+        ALTER TABLE clients ADD COLUMN IF NOT EXISTS external_id TEXT;
+        ALTER TABLE client_phones ADD COLUMN IF NOT EXISTS owner_id BIGINT;
+    """)
+
+    async with connection.transaction():
+        await connection.execute("""
+            INSERT INTO operators (id, owner_id)
+            SELECT DISTINCT telegram_id, telegram_id FROM clients
+            WHERE owner_id IS NULL AND telegram_id IS NOT NULL
+            ON CONFLICT (id) DO NOTHING;
+        """)
+        result = await connection.execute("""
+            UPDATE clients c SET owner_id = o.owner_id
+            FROM operators o
+            WHERE c.owner_id IS NULL AND o.id = c.telegram_id;
+        """)
+        await connection.execute("""
+            UPDATE client_phones cp SET owner_id = c.owner_id
+            FROM clients c
+            WHERE cp.owner_id IS NULL AND c.id = cp.client_id;
+
+            ALTER TABLE clients ALTER COLUMN owner_id SET NOT NULL;
+            ALTER TABLE client_phones ALTER COLUMN owner_id SET NOT NULL;
+        """)
+    if result != 'UPDATE 0':
+        logging.info(f"INFO: Assigned owners to existing clients: {result}.")
+
+    await _partition_client_phones(connection, settings.DB_PHONE_PARTITIONS)
+
+    await connection.execute("""
+        -- Індекси без owner_id замінено складеними
+        DROP INDEX IF EXISTS client_phones_digits_idx;
+        DROP INDEX IF EXISTS client_phones_digits_rev_idx;
+        DROP INDEX IF EXISTS client_phones_digits_trgm_idx;
+        DROP INDEX IF EXISTS clients_comment_tsv_idx;
+        DROP INDEX IF EXISTS clients_comment_trgm_idx;
+
+        CREATE INDEX IF NOT EXISTS clients_owner_id_idx
+            ON clients (owner_id, id);
+        CREATE UNIQUE INDEX IF NOT EXISTS clients_owner_external_id_key
+            ON clients (owner_id, external_id);
+        CREATE INDEX IF NOT EXISTS clients_owner_comment_tsv_idx
+            ON clients USING GIN (owner_id, comment_tsv);
+        CREATE INDEX IF NOT EXISTS clients_owner_comment_trgm_idx
+            ON clients USING GIN (owner_id, comment gin_trgm_ops);
+    """)
+    await _create_phone_indexes(connection)
+
+    # Backfill виконується лише один раз, поки таблиця ще порожня
+    await connection.execute("""
+        INSERT INTO client_phones (client_id, owner_id, phone, digits)
+        SELECT c.id, c.owner_id, elem, regexp_replace(elem, '[^0-9]', '', 'g')
+        FROM clients c, jsonb_array_elements_text(c.phone) AS elem
+        WHERE jsonb_typeof(c.phone) = 'array'
+          AND NOT EXISTS (SELECT 1 FROM client_phones)
+        ON CONFLICT DO NOTHING;
+    """)
+
+
+async def _create_phone_indexes(connection):
+    """Індекси пошуку за номером (для звичайної і для секціонованої client_phones)."""
+    await connection.execute("""
+        -- Точний збіг повного номера
+        CREATE INDEX IF NOT EXISTS client_phones_owner_digits_idx
+            ON client_phones (owner_id, digits);
+        -- Збіг за останніми N цифрами: reverse(digits) LIKE 'reversed%'
+        CREATE INDEX IF NOT EXISTS client_phones_owner_digits_rev_idx
+            ON client_phones (owner_id, reverse(digits) text_pattern_ops);
+        -- Довільна частина номера: digits LIKE '%...%'
+        CREATE INDEX IF NOT EXISTS client_phones_owner_digits_trgm_idx
+            ON client_phones USING GIN (owner_id, digits gin_trgm_ops);
+    """)
+
+
+async def _migrate_canonical_phones(connection):
+    """
+    Переводить номери клієнтів у канонічний E.164 (див. phone_numbers) і
+    перебудовує їхні ключі в client_phones. Перевіряються лише масиви, де є
+    номер не у форматі '+цифри', тож повторний запуск нічого не змінює.
+    """
+    records = await connection.fetch("""
+        SELECT id, phone FROM clients
+        WHERE jsonb_typeof(phone) = 'array'
+          AND EXISTS (
+              SELECT 1 FROM jsonb_array_elements_text(phone) AS p
+              WHERE p !~ '^\\+[0-9]+$'
+          )
+    """)
+    changed = []
+    for record in records:
+        phones = normalize_phone_list(record['phone'])
+        if phones != record['phone']:
+            changed.append((record['id'], phones))
+    if not changed:
+        return
+
+    async with connection.transaction():
+        await connection.executemany(
+            "UPDATE clients SET phone = $2 WHERE id = $1",
+            [(db_id, phones) for db_id, phones in changed]
+        )
+        ids = [db_id for db_id, _ in changed]
+        await connection.execute("DELETE FROM client_phones WHERE client_id = ANY($1::int[])", ids)
+        await connection.execute("""
+            INSERT INTO client_phones (client_id, owner_id, phone, digits)
+            SELECT c.id, c.owner_id, elem, regexp_replace(elem, '[^0-9]', '', 'g')
+            FROM clients c, jsonb_array_elements_text(c.phone) AS elem
+            WHERE c.id = ANY($1::int[])
+            ON CONFLICT DO NOTHING;
+        """, ids)
+    logging.info(f"INFO: Canonicalized phone numbers of {len(changed)} clients.")
+
+
+async def _partition_client_phones(connection, partitions: int) -> bool:
+    """
+    Одноразово перебудовує client_phones у таблицю, секціоновану хешем owner_id:
+    пошук команди читає одну секцію замість спільних індексів усіх команд.
+    Повертає True, якщо таблицю перебудовано (індекси треба створити заново).
+    """
+    if partitions <= 0:
+        return False
+    is_partitioned = await connection.fetchval(
+        "SELECT relkind = 'p' FROM pg_class WHERE oid = 'client_phones'::regclass"
+    )
+    if is_partitioned:
+        return False
+
+    async with connection.transaction():
+        await connection.execute("""
+            ALTER TABLE client_phones RENAME TO client_phones_unpartitioned;
+            ALTER TABLE client_phones_unpartitioned
+                RENAME CONSTRAINT client_phones_pkey TO client_phones_unpartitioned_pkey;
+
+            -- Ключ секціонування має входити до первинного ключа
+            CREATE TABLE client_phones (
+                client_id INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE,
+                owner_id BIGINT NOT NULL,
+                phone TEXT NOT NULL,
+                digits TEXT NOT NULL,
+                PRIMARY KEY (client_id, phone, owner_id)
+            ) PARTITION BY HASH (owner_id);
+        """)
+        for remainder in range(partitions):
+            await connection.execute(f"""
+                CREATE TABLE client_phones_p{remainder} PARTITION OF client_phones
+                FOR VALUES WITH (MODULUS {partitions}, REMAINDER {remainder});
+            """)
+        await connection.execute("""
+            INSERT INTO client_phones (client_id, owner_id, phone, digits)
+            SELECT client_id, owner_id, phone, digits FROM client_phones_unpartitioned;
+
+            DROP TABLE client_phones_unpartitioned;
+        """)
+    logging.info(f"INFO: client_phones partitioned by owner_id into {partitions} partitions.")
+    return True
+
+
+async def _migrate_face_embeddings(connection):
+    """Додає бінарну колонку кодувань (float32) і переносить у неї старі JSONB-кодування."""
+    await connection.execute("""
+        ALTER TABLE clients ADD COLUMN IF NOT EXISTS face_embedding BYTEA;
+    """)
+
+    # Переносимо старі JSONB-кодування у бінарний формат
+    records = await connection.fetch("""
+        SELECT id, face_encoding FROM clients
+        WHERE face_embedding IS NULL
+          AND jsonb_typeof(face_encoding) = 'array'
+          AND jsonb_array_length(face_encoding) > 0
+    """)
+    if records:
+        await connection.executemany(
+            "UPDATE clients SET face_embedding = $2, face_encoding = NULL WHERE id = $1",
+            [(r['id'], encode_embedding(r['face_encoding'])) for r in records]
+        )
+        logging.info(f"INFO: Migrated {len(records)} face encodings to float32 binary.")
+
+
+async def _migrate_face_vectors(connection):
+    """pgvector-колонка та HNSW-індекс; дозаповнює вектори, записані без бекенду pgvector."""
+    await connection.execute(f"""
+        CREATE EXTENSION IF NOT EXISTS vector;
+        ALTER TABLE clients
+            ADD COLUMN IF NOT EXISTS face_vector vector({face_index.EMBEDDING_DIM});
+        CREATE INDEX IF NOT EXISTS clients_face_vector_idx
+            ON clients USING hnsw (face_vector vector_l2_ops);
+    """)
+    records = await connection.fetch("""
+        SELECT id, face_embedding FROM clients
+        WHERE face_embedding IS NOT NULL AND face_vector IS NULL
+    """)
+    if records:
+        await connection.executemany(
+            "UPDATE clients SET face_vector = $2::vector WHERE id = $1",
+            [(r['id'], to_pgvector_literal(decode_embedding(r['face_embedding']))) for r in records]
+        )
+
+
+async def _migrate_change_notifications(connection):
+    """Тригер, що повідомляє всі процеси бота про зміну рядка clients."""
+    await connection.execute(f"""
+        CREATE OR REPLACE FUNCTION notify_clients_changed() RETURNS trigger AS $$
+        BEGIN
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('{CLIENTS_CHANGED_CHANNEL}', OLD.id::text);
+            ELSE
+                PERFORM pg_notify('{CLIENTS_CHANGED_CHANNEL}', NEW.id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+
+        DROP TRIGGER IF EXISTS clients_changed_notify ON clients;
+        CREATE TRIGGER clients_changed_notify
+            AFTER INSERT OR UPDATE OR DELETE ON clients
+            FOR EACH ROW EXECUTE FUNCTION notify_clients_changed();
+    """)
+
+
+async def _migrate_bulk_change_notifications(connection):
+    """Тригер clients_changed мовчить, якщо транзакція сама повідомляє про масову зміну."""
+    await connection.execute(f"""
+        CREATE OR REPLACE FUNCTION notify_clients_changed() RETURNS trigger AS $$
+        BEGIN
+            IF current_setting('{SUPPRESS_CLIENT_NOTIFY_SETTING}', true) = 'on' THEN
+                RETURN NULL;
+            END IF;
+            IF TG_OP = 'DELETE' THEN
+                PERFORM pg_notify('{CLIENTS_CHANGED_CHANNEL}', OLD.id::text);
+            ELSE
+                PERFORM pg_notify('{CLIENTS_CHANGED_CHANNEL}', NEW.id::text);
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql;
+    """)
+
+
+async def _migrate_fsm_storage(connection):
+    """Таблиця спільного FSM-сховища (див. pg_storage.PostgresStorage)."""
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS fsm_storage (
+            key TEXT PRIMARY KEY,
+            state TEXT,
+            data JSONB NOT NULL DEFAULT '{}'::jsonb,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS fsm_storage_updated_at_idx ON fsm_storage (updated_at);
+    """)
+
+
+async def _migrate_photo_jobs(connection):
+    """Черга фонової обробки фото (статуси: pending, running, done, dead)."""
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS photo_jobs (
+            id BIGSERIAL PRIMARY KEY,
+            client_id INTEGER NOT NULL REFERENCES clients(id) ON DELETE CASCADE,
+            file_id TEXT NOT NULL,
+            status TEXT NOT NULL DEFAULT 'pending',
+            attempts INTEGER NOT NULL DEFAULT 0,
+            run_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            last_error TEXT,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now(),
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS photo_jobs_ready_idx
+            ON photo_jobs (run_at) WHERE status IN ('pending', 'running');
+    """)
+
+
+async def _migrate_photo_variants(connection):
+    """Варіанти фото клієнта: список {'original', 'preview', 'thumb'} -> URL."""
+    await connection.execute("""
+        ALTER TABLE clients ADD COLUMN IF NOT EXISTS photo_variants JSONB NOT NULL DEFAULT '[]'::jsonb;
+    """)
+
+
+async def _migrate_photo_file_ids(connection):
+    """Кеш Telegram file_id для фото зі Spaces (повторна відправка без завантаження з бакета)."""
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS telegram_photo_cache (
+            photo_url TEXT PRIMARY KEY,
+            file_id TEXT NOT NULL,
+            updated_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+    """)
+
+
+async def _migrate_orphaned_objects(connection):
+    """Черга об'єктів Spaces, на які після видалення клієнта ніхто не посилається."""
+    await connection.execute("""
+        CREATE TABLE IF NOT EXISTS orphaned_objects (
+            url TEXT PRIMARY KEY,
+            created_at TIMESTAMPTZ NOT NULL DEFAULT now()
+        );
+        CREATE INDEX IF NOT EXISTS orphaned_objects_created_at_idx ON orphaned_objects (created_at);
+
+        -- Перевірка «чи ще хтось посилається на URL» через @>
+        CREATE INDEX IF NOT EXISTS clients_photo_url_gin_idx
+            ON clients USING GIN (photo_url jsonb_path_ops);
+        CREATE INDEX IF NOT EXISTS clients_photo_variants_gin_idx
+            ON clients USING GIN (photo_variants jsonb_path_ops);
+    """)
+
+
+async def _migrate_orphaned_objects_claims(connection):
+    """Позначка запису, який прибиральник уже видаляє з бакета (див. storage_gc.sweep_once)."""
+    await connection.execute("""
+        ALTER TABLE orphaned_objects ADD COLUMN IF NOT EXISTS claimed_at TIMESTAMPTZ;
+    """)
+
+
+# Версіоновані міграції: (номер, назва, функція). Кожна виконується один раз і
+# записується в schema_migrations; нові додаються лише в кінець з наступним номером.
+# Міграції ідемпотентні, тож база, створена до появи schema_migrations, просто
+# проходить їх усі один раз.
+MIGRATIONS = [
+    (1, 'clients', _migrate_clients_table),
+    (2, 'client_phones', _migrate_client_phones),
+    (3, 'comment_search', _migrate_comment_search),
+    (4, 'tenancy', _migrate_tenancy),
+    (5, 'canonical_phones', _migrate_canonical_phones),
+    (6, 'face_embeddings', _migrate_face_embeddings),
+    (7, 'change_notifications', _migrate_change_notifications),
+    (8, 'fsm_storage', _migrate_fsm_storage),
+    (9, 'photo_jobs', _migrate_photo_jobs),
+    (10, 'photo_variants', _migrate_photo_variants),
+    (11, 'photo_file_ids', _migrate_photo_file_ids),
+    (12, 'orphaned_objects', _migrate_orphaned_objects),
+    (13, 'orphaned_objects_claims', _migrate_orphaned_objects_claims),
+    (14, 'bulk_change_notifications', _migrate_bulk_change_notifications),
+    (15, 'face_vectors', _migrate_face_vectors),
+    (16, 'phone_partitions', _migrate_phone_partitions),
+]
+# Міграції, що залежать від налаштувань: поки умова хибна, вони не виконуються
+# й не записуються, тож застосуються на першому старті після ввімкнення
+MIGRATION_CONDITIONS = {
+    15: lambda: settings.FACE_INDEX_BACKEND == "pgvector",
+    16: lambda: settings.DB_PHONE_PARTITIONS > 0,
+}
+# Ключ pg_advisory_lock, під яким застосовуються міграції
+MIGRATIONS_LOCK_ID = 0x43524D01
+
+
+def bulk_change_payload(owner_id: int) -> str:
+    """Повідомлення clients_changed про масову зміну клієнтів команди (див. bulk_io)."""
+    return f"{BULK_CHANGE_PREFIX}{owner_id}"
+
+
+def _on_clients_changed(connection, pid, channel, payload):
+    if pid in _own_backend_pids:
+        # Власна зміна: кеш, індекс облич і read-your-writes вже оновив той, хто писав
+        return
+    if payload.startswith(BULK_CHANGE_PREFIX):
+        # Масовий імпорт не змінює кодувань облич, тож індекс облич не чіпаємо
+        client_cache.clear()
+        mark_written(owner_id=int(payload[len(BULK_CHANGE_PREFIX):]))
+        return
+    client_id = int(payload)
+    client_cache.invalidate(client_id)
+    # Зміна з іншого процесу: репліка могла її ще не отримати
+    mark_written(client_id=client_id)
+    _schedule_face_refresh(client_id)
+
+
+def _face_index_in_memory() -> bool:
+    return settings.FACE_INDEX_BACKEND == "memory" and face_index.index.available
+
+
+def _schedule_face_refresh(client_id: int):
+    """Перечитує рядок індексу облич у фоні; зміни, що надійшли разом, — одним запитом."""
+    global _face_refresh_task
+    if not _face_index_in_memory():
+        return
+    _face_refresh_ids.add(client_id)
+    if _face_refresh_task is None or _face_refresh_task.done():
+        _face_refresh_task = asyncio.create_task(_refresh_face_index())
+
+
+async def _refresh_face_index():
+    while _face_refresh_ids and db_pool:
+        ids = list(_face_refresh_ids)
+        _face_refresh_ids.clear()
+        try:
+            async with db_pool.acquire() as connection:
+                records = await connection.fetch(
+                    "SELECT id, owner_id, face_embedding FROM clients WHERE id = ANY($1::int[])", ids
+                )
+        except Exception as e:
+            # Наступне повідомлення про зміни повторить спробу разом із цими ID
+            _face_refresh_ids.update(ids)
+            logging.error(f"ERROR: Failed to refresh face index rows: {e}")
+            return
+        found = set()
+        for record in records:
+            found.add(record['id'])
+            face_index.index.upsert(record['id'], record['face_embedding'], record['owner_id'])
+        # Видалені клієнти
+        for client_id in set(ids) - found:
+            face_index.index.remove(client_id)
+
+
+def _on_listener_lost(connection):
+    # Поки слухача немає, повідомлення губляться: кеш не можна вважати актуальним
+    # (індекс облич перезавантажується після відновлення слухача)
+    client_cache.clear()
+    global _listener_task
+    if db_pool and (_listener_task is None or _listener_task.done()):
+        _listener_task = asyncio.create_task(_reconnect_invalidation_listener())
+
+
+async def _start_invalidation_listener():
+    """Окреме (не з пулу) з'єднання, яке слухає канал змін клієнтів."""
+    global _listener_connection
+    _listener_connection = await asyncpg.connect(dsn=settings.DATABASE_URL)
+    _listener_connection.add_termination_listener(_on_listener_lost)
+    await _listener_connection.add_listener(CLIENTS_CHANGED_CHANNEL, _on_clients_changed)
+
+
+async def _reconnect_invalidation_listener():
+    delay = 1
+    while db_pool:
+        try:
+            await _start_invalidation_listener()
+            client_cache.clear()
+            # Пропущені повідомлення могли стосуватися й кодувань облич
+            async with db_pool.acquire() as connection:
+                await _load_face_index(connection)
+            logging.info("INFO: Client cache invalidation listener reconnected.")
+            return
+        except Exception as e:
+            logging.error(f"ERROR: Failed to reconnect cache invalidation listener: {e}")
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 60)
+
+
+def mark_written(client_id: Optional[int] = None, owner_id: Optional[int] = None):
+    """
+    Фіксує запис: протягом DB_READ_YOUR_WRITES_WINDOW читання цього клієнта
+    та пошук у цій команді йдуть в основну БД, а не на репліку.
+    """
+    if client_id is not None:
+        _recent_writes.set(('client', client_id), True)
+    if owner_id is not None:
+        _recent_writes.set(('owner', owner_id), True)
+
+
+def read_pool_for(client_id: Optional[int] = None, owner_id: Optional[int] = None):
+    """Пул для читання з урахуванням нещодавніх записів клієнта чи команди."""
+    if read_pool is db_pool:
+        return db_pool
+    if client_id is not None and _recent_writes.get(('client', client_id)):
+        return db_pool
+    if owner_id is not None and _recent_writes.get(('owner', owner_id)):
+        return db_pool
+    return read_pool
+
+
+def get_cache_stats() -> Dict[str, Any]:
+    """Статистика кешу клієнтів (влучання/промахи/розмір) для налаштування."""
+    return client_cache.stats()
+
+
+def _cache_client(client: Dict[str, Any]):
+    client_cache.set(client['id'], copy.deepcopy(
+        {key: value for key, value in client.items() if key not in ('score', 'distance')}
+    ))
+
+
+async def _load_face_index(connection):
+    """Наповнює in-memory індекс облич одним запитом."""
+    if settings.FACE_INDEX_BACKEND != "memory" or not face_index.index.available:
+        return
+    records = await connection.fetch(
+        "SELECT id, owner_id, face_embedding FROM clients WHERE face_embedding IS NOT NULL"
+    )
+    face_index.index.load((r['id'], r['owner_id'], r['face_embedding']) for r in records)
+
+
+async def _sync_face_vector(connection, db_id: int, encoding: List[float]):
+    """Дублює кодування у pgvector-колонку (лише для бекенду pgvector)."""
+    if settings.FACE_INDEX_BACKEND != "pgvector":
+        return
+    await connection.execute(
+        "UPDATE clients SET face_vector = $2::vector WHERE id = $1",
+        db_id, to_pgvector_literal(encoding) if encoding else None
+    )
+
+
+async def _sync_client_phones(connection, client_id: int, owner_id: int, phone: List[str]):
+    """Синхронізує client_phones зі списком номерів клієнта (викликати в транзакції)."""
+    await connection.execute("""
+        DELETE FROM client_phones
+        WHERE owner_id = $2 AND client_id = $1 AND phone <> ALL($3::text[]);
+    """, client_id, owner_id, phone)
+    await connection.execute("""
+        INSERT INTO client_phones (client_id, owner_id, phone, digits)
+        SELECT $1, $2, p, regexp_replace(p, '[^0-9]', '', 'g')
+        FROM unnest($3::text[]) AS p
+        ON CONFLICT DO NOTHING;
+    """, client_id, owner_id, phone)
+
+
+def _record_to_client(record) -> Dict[str, Any]:
+    """Перетворює запис asyncpg на словник клієнта (JSONB уже розпаковано кодеком)."""
+    return dict(record)
+
+
+async def add_client(owner_id: int, telegram_id: int, phone: List[str], comment: str, face_encoding_array: List[float], photo_url: List[str]) -> int:
+    """
+    Створює клієнта команди owner_id (номери мають бути нормалізовані).
+    telegram_id — оператор, який додав клієнта. Повертає ID.
+    """
     if not db_pool:
         raise Exception("Database pool is not initialized.")
         
-    encoding_json = json.dumps(face_encoding_array)
-    phone_json = json.dumps(phone)
-    photo_json = json.dumps(photo_url)
+    embedding = encode_embedding(face_encoding_array)
     
     async with db_pool.acquire() as connection:
-        await connection.execute("""
-            INSERT INTO clients (telegram_id, phone, comment, face_encoding, photo_url) 
-            VALUES ($1, $2, $3, $4, $5) 
-            ON CONFLICT (telegram_id) 
-            DO UPDATE SET 
-                phone = $2, 
-                comment = $3,
-                face_encoding = $4,
-                photo_url = $5;
-        """, telegram_id, phone_json, comment, encoding_json, photo_json)
-
-
-async def find_client_by_query(query: str) -> List[Dict[str, Any]]:
-    """Пошук клієнта за номером (повним/частиною) або ключовими словами у коментарі."""
-    if not db_pool:
-        raise Exception("Database pool is not initialized.")
+        async with connection.transaction():
+            db_id = await connection.fetchval("""
+                INSERT INTO clients (owner_id, telegram_id, phone, comment, face_embedding, photo_url) 
+                VALUES ($1, $2, $3, $4, $5, $6) 
+                RETURNING id;
+            """, owner_id, telegram_id, phone, comment, embedding, photo_url)
+            await _sync_client_phones(connection, db_id, owner_id, phone)
+            await _sync_face_vector(connection, db_id, face_encoding_array)
+    client_cache.invalidate(db_id)
+    mark_written(client_id=db_id, owner_id=owner_id)
+    face_index.index.upsert(db_id, embedding, owner_id)
+    return db_id
 
-    # ВИКОРИСТАННЯ ЗОВНІШНЬОЇ ФУНКЦІЇ НОРМАЛІЗАЦІЇ
-    search_term = normalize_phone_number(query)
-    
-    comment_param = f"%{query}%"
-    phone_param = f"%{search_term}%" 
-    last_5_digits = f"%{search_term[-5:]}" if len(search_term) >= 5 else phone_param
-
-    sql_query = """
-        SELECT * FROM clients 
-        WHERE 
-            comment ILIKE $1 
-        OR 
-            EXISTS (
-                SELECT 1 FROM jsonb_array_elements_text(phone) AS elem
-                WHERE 
-                    elem ILIKE $2 OR      
-                    elem ILIKE $3         
-            )
+
+async def resolve_owner(operator_id: int) -> int:
+    """
+    Повертає команду (owner_id) оператора. Оператор, якого ще немає в operators,
+    реєструється власною командою з owner_id = його Telegram ID.
     """
+    owner_id = operator_cache.get(operator_id)
+    if owner_id is not None:
+        return owner_id
 
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
     async with db_pool.acquire() as connection:
-        records = await connection.fetch(sql_query, comment_param, phone_param, last_5_digits)
-        
-        results = []
-        for record in records:
-            results.append({
-                **dict(record), 
-                'phone': json.loads(record['phone']), 
-                'photo_url': json.loads(record['photo_url'])
-            })
-        return results
+        owner_id = await connection.fetchval(HOT_STATEMENTS['resolve_owner'], operator_id)
+    operator_cache.set(operator_id, owner_id)
+    return owner_id
 
-async def find_client_by_id(db_id: int):
-    """Пошук клієнта за внутрішнім ID."""
+
+async def assign_operator(operator_id: int, owner_id: int):
+    """
+    Переводить оператора до команди owner_id. Інші процеси бота побачать
+    зміну після OPERATOR_CACHE_TTL.
+    """
     if not db_pool:
         raise Exception("Database pool is not initialized.")
     async with db_pool.acquire() as connection:
-        record = await connection.fetchrow("SELECT * FROM clients WHERE id = $1", db_id)
-        if record:
-            return {**dict(record), 'phone': json.loads(record['phone']), 'photo_url': json.loads(record['photo_url'])}
+        await connection.execute("""
+            INSERT INTO operators (id, owner_id) VALUES ($1, $2)
+            ON CONFLICT (id) DO UPDATE SET owner_id = EXCLUDED.owner_id
+        """, operator_id, owner_id)
+    operator_cache.invalidate(operator_id)
+
+
+def _like_escape(value: str) -> str:
+    """Екранує спецсимволи LIKE/ILIKE (\\, %, _)."""
+    return value.replace('\\', '\\\\').replace('%', '\\%').replace('_', '\\_')
+
+
+def _phone_search_params(query: str) -> Tuple[Optional[str], Optional[str], Optional[str]]:
+    """Повертає параметри точного, суфіксного та часткового пошуку за номером."""
+    # Цифри саме введеного фрагмента: канонізація додала б код країни за замовчуванням
+    digits = re.sub(r'[^0-9]', '', query)
+    if not digits:
+        # Запит без цифр: пошук лише за коментарем (NULL не збігається ні з чим)
+        return None, None, None
+
+    # Повний номер точно збігається з канонічним ключем і отримує найвищу оцінку.
+    # Суфікс і підрядок лишаються: фрагмент без коду країни ("501234567")
+    # канонізується за DEFAULT_PHONE_COUNTRY, але може бути частиною номера іншої країни.
+    canonical = canonicalize(query)
+    exact = phone_key(canonical) if canonical else digits
+    last_5_digits = digits[-5:] if len(digits) >= 5 else digits
+    return exact, f"{last_5_digits[::-1]}%", f"%{digits}%"
+
+
+# Номери шукаються через індекси client_phones, коментарі — через tsvector та триграми.
+# Точний збіг номера важить найбільше, далі частковий номер і релевантність коментаря.
+_SEARCH_CLIENTS_TEMPLATE = f"""
+    WITH phone_hits AS (
+        SELECT client_id AS id,
+               MAX(CASE WHEN digits = $2 THEN 2.0 ELSE 1.0 END)::float8 AS score
+        FROM client_phones
+        WHERE owner_id = $9
+          AND (digits = $2 OR reverse(digits) LIKE $3 OR digits LIKE $4)
+        GROUP BY client_id
+    ),
+    comment_hits AS (
+        SELECT id,
+               (ts_rank(comment_tsv, plainto_tsquery('simple', $1))
+                + word_similarity($1, comment))::float8 AS score
+        FROM clients
+        WHERE owner_id = $9
+          AND (comment_tsv @@ plainto_tsquery('simple', $1)
+               OR comment ILIKE $5
+               OR $1 <% comment)
+    ),
+    ranked AS (
+        SELECT id, SUM(score) AS score
+        FROM (SELECT * FROM phone_hits UNION ALL SELECT * FROM comment_hits) AS hits
+        GROUP BY id
+    )
+    SELECT {', '.join('c.' + col for col in CLIENT_COLUMNS.split(', '))}, r.score
+    FROM ranked r
+    JOIN clients c ON c.id = r.id
+    WHERE $6::float8 IS NULL OR (r.score, r.id) {{cmp}} ($6::float8, $7::int)
+    ORDER BY r.score {{order}}, r.id {{order}}
+    LIMIT $8
+"""
+# Прямий порядок (наступні сторінки) та зворотний (попередні, від курсора вгору)
+SEARCH_CLIENTS_SQL = _SEARCH_CLIENTS_TEMPLATE.format(cmp='<', order='DESC')
+SEARCH_CLIENTS_BEFORE_SQL = _SEARCH_CLIENTS_TEMPLATE.format(cmp='>', order='ASC')
+
+
+def _cursor_of(client: Dict[str, Any]) -> Tuple[float, int]:
+    return client['score'], client['id']
+
+
+async def _search_page(owner_id: int, query: str, limit: Optional[int],
+                       cursor: Optional[Tuple[float, int]], backward: bool) -> Tuple[List[Dict[str, Any]], bool]:
+    """
+    Одна сторінка ранжованого пошуку від курсора (у порядку показу) та ознака,
+    чи є ще рядки далі в напрямку руху.
+    """
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+
+    exact_param, suffix_param, substring_param = _phone_search_params(query)
+    comment_param = f"%{_like_escape(query)}%"
+    cursor_score, cursor_id = cursor if cursor else (None, None)
+    # Беремо на один рядок більше, щоб дізнатися, чи є наступна сторінка
+    sql_limit = limit + 1 if limit is not None else None
+
+    pool = read_pool_for(owner_id=owner_id)
+    async with pool.acquire() as connection:
+        records = await connection.fetch(
+            HOT_STATEMENTS['search_clients_before' if backward else 'search_clients'],
+            query, exact_param, suffix_param, substring_param,
+            comment_param, cursor_score, cursor_id, sql_limit, owner_id
+        )
+
+    has_more = limit is not None and len(records) > limit
+    results = [_record_to_client(record) for record in records[:limit]]
+    if backward:
+        results.reverse()
+    # Щойно завантажені записи знадобляться callback-обробникам редагування.
+    # Рядки з репліки можуть бути застарілими, тож у спільний кеш потрапляють лише з основної БД
+    if pool is db_pool:
+        for client in results:
+            _cache_client(client)
+    return results, has_more
+
+
+async def search_clients(
+    owner_id: int,
+    query: str,
+    limit: Optional[int] = SEARCH_PAGE_SIZE,
+    after: Optional[Tuple[float, int]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[float, int]]]:
+    """
+    Ранжований пошук клієнтів команди owner_id за номером або коментарем.
+    Повертає сторінку результатів та курсор (score, id) наступної сторінки
+    (None, якщо сторінка остання). limit=None — без обмеження.
+    """
+    results, has_more = await _search_page(owner_id, query, limit, after, backward=False)
+    return results, _cursor_of(results[-1]) if has_more else None
+
+
+async def browse_clients(
+    owner_id: int,
+    query: str,
+    limit: int = SEARCH_PAGE_SIZE,
+    after: Optional[Tuple[float, int]] = None,
+    before: Optional[Tuple[float, int]] = None
+) -> Tuple[List[Dict[str, Any]], Optional[Tuple[float, int]], Optional[Tuple[float, int]]]:
+    """
+    Сторінка результатів для гортання в обидва боки: після курсора after
+    або перед курсором before. Повертає (результати, курсор попередньої
+    сторінки, курсор наступної); None — у цей бік сторінок немає.
+    """
+    if before is not None:
+        results, has_prev = await _search_page(owner_id, query, limit, before, backward=True)
+        has_next = True
+    else:
+        results, has_next = await _search_page(owner_id, query, limit, after, backward=False)
+        has_prev = after is not None
+    if not results:
+        return results, None, None
+    return (
+        results,
+        _cursor_of(results[0]) if has_prev else None,
+        _cursor_of(results[-1]) if has_next else None,
+    )
+
+
+# Курсор пошуку (score, id) у компактному вигляді: 12 байт -> 16 символів base64url,
+# що вміщується в inline next_offset та callback_data (ліміт Telegram — 64 байти)
+_CURSOR_FORMAT = struct.Struct('>di')
+
+
+def encode_search_cursor(cursor: Tuple[float, int]) -> str:
+    return base64.urlsafe_b64encode(_CURSOR_FORMAT.pack(*cursor)).decode()
+
+
+def decode_search_cursor(value: str) -> Optional[Tuple[float, int]]:
+    """Зворотне до encode_search_cursor; None для порожнього чи пошкодженого рядка."""
+    try:
+        return _CURSOR_FORMAT.unpack(base64.urlsafe_b64decode(value.encode()))
+    except (binascii.Error, struct.error, ValueError):
+        return None
+
+
+async def find_client_by_query(owner_id: int, query: str) -> List[Dict[str, Any]]:
+    """Пошук клієнта за номером (повним/частиною) або ключовими словами у коментарі."""
+    results, _ = await search_clients(owner_id, query, limit=None)
+    return results
+
+async def find_client_by_id(db_id: int, owner_id: Optional[int] = None):
+    """Пошук клієнта за внутрішнім ID (з owner_id — лише серед клієнтів цієї команди)."""
+    client = client_cache.get(db_id)
+    if client is not None:
+        client = copy.deepcopy(client)
+    else:
+        if not db_pool:
+            raise Exception("Database pool is not initialized.")
+        pool = read_pool_for(client_id=db_id, owner_id=owner_id)
+        async with pool.acquire() as connection:
+            record = await connection.fetchrow(HOT_STATEMENTS['client_by_id'], db_id)
+        if not record:
+            return None
+        client = _record_to_client(record)
+        # Відстала репліка не повинна повертати старий рядок у кеш після інвалідації
+        if pool is db_pool:
+            _cache_client(client)
+
+    if owner_id is not None and client['owner_id'] != owner_id:
         return None
+    return client
 
-async def update_client_data(db_id: int, phone: List[str], comment: str, photo_url: List[str]):
+async def update_client_data(db_id: int, phone: List[str], comment: str, photo_url: List[str],
+                             owner_id: Optional[int] = None):
     """Оновлення даних клієнта."""
     if not db_pool:
         raise Exception("Database pool is not initialized.")
     
-    phone_json = json.dumps(phone)
-    photo_json = json.dumps(photo_url)
-    
     async with db_pool.acquire() as connection:
-        await connection.execute("""
-            UPDATE clients 
-            SET phone = $2, comment = $3, photo_url = $4 
-            WHERE id = $1;
-        """, db_id, phone_json, comment, photo_json)
+        async with connection.transaction():
+            client_owner = await connection.fetchval("""
+                UPDATE clients 
+                SET phone = $2, comment = $3, photo_url = $4 
+                WHERE id = $1 AND ($5::bigint IS NULL OR owner_id = $5)
+                RETURNING owner_id;
+            """, db_id, phone, comment, photo_url, owner_id)
+            if client_owner is not None:
+                await _sync_client_phones(connection, db_id, client_owner, phone)
+    client_cache.invalidate(db_id)
+    mark_written(client_id=db_id, owner_id=client_owner)
+
+# --- АТОМАРНІ ЗМІНИ (один UPDATE ... RETURNING замість читання + запису) ---
+# Останній параметр — owner_id: NULL дозволяє зміну будь-якого клієнта (фонові задачі),
+# інакше рядок чужої команди просто не знаходиться.
+
+APPEND_PHONE_SQL = f"""
+    WITH updated AS (
+        UPDATE clients
+        SET phone = CASE
+            WHEN COALESCE(phone, '[]'::jsonb) @> jsonb_build_array($2::text) THEN phone
+            ELSE COALESCE(phone, '[]'::jsonb) || jsonb_build_array($2::text)
+        END
+        WHERE id = $1 AND ($3::bigint IS NULL OR owner_id = $3)
+        RETURNING {CLIENT_COLUMNS}
+    ), indexed AS (
+        INSERT INTO client_phones (client_id, owner_id, phone, digits)
+        SELECT id, owner_id, $2::text, regexp_replace($2::text, '[^0-9]', '', 'g') FROM updated
+        ON CONFLICT DO NOTHING
+    )
+    SELECT * FROM updated
+"""
+
+# Те саме фото (той самий ключ за хешем) повторно не додається
+APPEND_PHOTO_SQL = f"""
+    UPDATE clients
+    SET photo_url = CASE
+            WHEN COALESCE(photo_url, '[]'::jsonb) @> jsonb_build_array($2::text) THEN photo_url
+            ELSE COALESCE(photo_url, '[]'::jsonb) || jsonb_build_array($2::text)
+        END,
+        photo_variants = CASE
+            WHEN $3::jsonb IS NULL OR photo_variants @> jsonb_build_array($3::jsonb) THEN photo_variants
+            ELSE photo_variants || jsonb_build_array($3::jsonb)
+        END
+    WHERE id = $1 AND ($4::bigint IS NULL OR owner_id = $4)
+    RETURNING {CLIENT_COLUMNS}
+"""
+
+SET_COMMENT_SQL = f"""
+    UPDATE clients SET comment = $2
+    WHERE id = $1 AND ($3::bigint IS NULL OR owner_id = $3)
+    RETURNING {CLIENT_COLUMNS}
+"""
+
+# Новий оператор реєструється окремою командою; існуючий повертається без запису
+RESOLVE_OWNER_SQL = """
+    WITH inserted AS (
+        INSERT INTO operators (id, owner_id) VALUES ($1, $1)
+        ON CONFLICT (id) DO NOTHING
+        RETURNING owner_id
+    )
+    SELECT owner_id FROM inserted
+    UNION ALL
+    SELECT owner_id FROM operators WHERE id = $1
+    LIMIT 1
+"""
+
+def _updated_client(db_id: int, record) -> Optional[Dict[str, Any]]:
+    """Оновлює кеш свіжим рядком з RETURNING і повертає клієнта."""
+    if not record:
+        client_cache.invalidate(db_id)
+        return None
+    client = _record_to_client(record)
+    mark_written(client_id=db_id, owner_id=client['owner_id'])
+    _cache_client(client)
+    return client
+
+# Запити гарячого шляху. Кеш запитів asyncpg (statement_cache_size) готує кожен
+# один раз на з'єднання пулу; назви використовуються як мітки метрик (див. _query_label)
+HOT_STATEMENTS = {
+    'client_by_id': f"SELECT {CLIENT_COLUMNS} FROM clients WHERE id = $1",
+    'search_clients': SEARCH_CLIENTS_SQL,
+    'search_clients_before': SEARCH_CLIENTS_BEFORE_SQL,
+    'append_phone': APPEND_PHONE_SQL,
+    'append_photo': APPEND_PHOTO_SQL,
+    'set_comment': SET_COMMENT_SQL,
+    'resolve_owner': RESOLVE_OWNER_SQL,
+}
+_HOT_STATEMENT_NAMES = {query: name for name, query in HOT_STATEMENTS.items()}
 
-async def delete_client(db_id: int) -> bool:
-    """Видаляє клієнта за внутрішнім ID."""
+async def append_client_phone(db_id: int, phone: str, owner_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Атомарно додає номер (без дублікатів) і повертає оновленого клієнта або None."""
     if not db_pool:
         raise Exception("Database pool is not initialized.")
     async with db_pool.acquire() as connection:
-        result = await connection.execute("DELETE FROM clients WHERE id = $1", db_id)
-        return result == 'DELETE 1'
+        record = await connection.fetchrow(HOT_STATEMENTS['append_phone'], db_id, phone, owner_id)
+    return _updated_client(db_id, record)
+
+async def append_client_photo(db_id: int, photo_url: str,
+                              variants: Optional[Dict[str, str]] = None,
+                              owner_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """
+    Атомарно додає URL фото (без дублікатів) та, за наявності, його варіанти
+    ({'original', 'preview', 'thumb'} -> URL). Повертає оновленого клієнта або None.
+    """
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    async with db_pool.acquire() as connection:
+        record = await connection.fetchrow(HOT_STATEMENTS['append_photo'], db_id, photo_url, variants, owner_id)
+    return _updated_client(db_id, record)
+
+async def set_client_comment(db_id: int, comment: str, owner_id: Optional[int] = None) -> Optional[Dict[str, Any]]:
+    """Змінює коментар і повертає оновленого клієнта або None."""
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    async with db_pool.acquire() as connection:
+        record = await connection.fetchrow(HOT_STATEMENTS['set_comment'], db_id, comment, owner_id)
+    return _updated_client(db_id, record)
+
+async def delete_client(db_id: int, owner_id: Optional[int] = None) -> bool:
+    """Видаляє клієнта за внутрішнім ID (з owner_id — лише клієнта цієї команди)."""
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    async with db_pool.acquire() as connection:
+        # Видалення рядка та запис його фото в orphaned_objects — одна транзакція
+        deleted = await connection.fetchval("""
+            WITH deleted AS (
+                DELETE FROM clients
+                WHERE id = $1 AND ($2::bigint IS NULL OR owner_id = $2)
+                RETURNING photo_url, photo_variants
+            ), urls AS (
+                SELECT url FROM deleted, jsonb_array_elements_text(
+                    CASE WHEN jsonb_typeof(photo_url) = 'array' THEN photo_url ELSE '[]'::jsonb END
+                ) AS url
+                UNION
+                SELECT variant.value FROM deleted,
+                    jsonb_array_elements(photo_variants) AS item,
+                    jsonb_each_text(item) AS variant
+            ), orphaned AS (
+                INSERT INTO orphaned_objects (url)
+                SELECT url FROM urls
+                ON CONFLICT DO NOTHING
+            )
+            SELECT count(*) FROM deleted
+        """, db_id, owner_id)
+    if deleted != 1:
+        return False
+    client_cache.invalidate(db_id)
+    mark_written(client_id=db_id, owner_id=owner_id)
+    face_index.index.remove(db_id)
+    return True
+
+# --- ПОШУК ЗА ОБЛИЧЧЯМ ---
+
+async def update_face_encoding(db_id: int, face_encoding_array: List[float]) -> bool:
+    """Оновлює кодування обличчя клієнта (float32) та in-memory індекс."""
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    embedding = encode_embedding(face_encoding_array)
+    async with db_pool.acquire() as connection:
+        async with connection.transaction():
+            owner_id = await connection.fetchval(
+                "UPDATE clients SET face_embedding = $2, face_encoding = NULL WHERE id = $1 RETURNING owner_id",
+                db_id, embedding
+            )
+            if owner_id is not None:
+                await _sync_face_vector(connection, db_id, face_encoding_array)
+    if owner_id is None:
+        return False
+    mark_written(client_id=db_id, owner_id=owner_id)
+    face_index.index.upsert(db_id, embedding, owner_id)
+    return True
+
+async def find_clients_by_face(owner_id: int, face_encoding_array: List[float], k: int = 5,
+                               max_distance: float = face_index.DEFAULT_MAX_DISTANCE) -> List[Dict[str, Any]]:
+    """Top-k найближчих клієнтів команди за кодуванням обличчя (з полем 'distance')."""
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+
+    async with read_pool_for(owner_id=owner_id).acquire() as connection:
+        if settings.FACE_INDEX_BACKEND == "pgvector":
+            # HNSW фільтрує owner_id після обходу графа: для малих команд
+            # варто ввімкнути hnsw.iterative_scan (pgvector >= 0.8)
+            records = await connection.fetch(f"""
+                SELECT * FROM (
+                    SELECT {CLIENT_COLUMNS}, (face_vector <-> $1::vector)::float8 AS distance
+                    FROM clients
+                    WHERE owner_id = $4 AND face_vector IS NOT NULL
+                    ORDER BY face_vector <-> $1::vector
+                    LIMIT $2
+                ) AS nearest
+                WHERE distance <= $3
+                ORDER BY distance
+            """, to_pgvector_literal(face_encoding_array), k, max_distance, owner_id)
+            return [_record_to_client(record) for record in records]
+
+        matches = face_index.index.search(
+            face_encoding_array, k=k, max_distance=max_distance, owner_id=owner_id
+        )
+        if not matches:
+            return []
+        distances = dict(matches)
+        records = await connection.fetch(
+            f"SELECT {CLIENT_COLUMNS} FROM clients WHERE id = ANY($1::int[])", list(distances)
+        )
+
+    clients = [{**_record_to_client(record), 'distance': distances[record['id']]} for record in records]
+    clients.sort(key=lambda client: client['distance'])
+    return clients
         
 async def get_all_encodings():
-    """Залишено як заглушка."""
+    """Залишено як заглушка. Для пошуку використовуйте find_clients_by_face."""
     if not db_pool:
         raise Exception("Database pool is not initialized.")
-    async with db_pool.acquire() as connection:
-        records = await connection.fetch("SELECT id, telegram_id, phone, comment, face_encoding, photo_url FROM clients")
+    # Повна вибірка таблиці не повинна забирати з'єднання в записів
+    async with read_pool.acquire() as connection:
+        records = await connection.fetch("SELECT id, telegram_id, phone, comment, face_embedding, photo_url FROM clients")
         
         encodings = []
         for record in records:
             encodings.append({
                 'db_id': record['id'],
                 'telegram_id': record['telegram_id'],
-                'phone': json.loads(record['phone']),
+                'phone': record['phone'],
                 'comment': record['comment'],
-                'photo_url': json.loads(record['photo_url']),
-                'encoding': json.loads(record['face_encoding'])
+                'photo_url': record['photo_url'],
+                'encoding': decode_embedding(record['face_embedding'])
             })
         return encodings
+
+# --- ЧЕРГА ОБРОБКИ ФОТО ---
+
+async def enqueue_photo_job(client_id: int, file_id: str, owner_id: Optional[int] = None) -> Optional[int]:
+    """Ставить фото (Telegram file_id) у чергу. Повертає ID задачі або None, якщо клієнта немає."""
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    async with db_pool.acquire() as connection:
+        return await connection.fetchval("""
+            INSERT INTO photo_jobs (client_id, file_id)
+            SELECT $1, $2 WHERE EXISTS (
+                SELECT 1 FROM clients WHERE id = $1 AND ($3::bigint IS NULL OR owner_id = $3)
+            )
+            RETURNING id
+        """, client_id, file_id, owner_id)
+
+async def claim_photo_jobs(limit: int, lease_seconds: float) -> List[Dict[str, Any]]:
+    """
+    Забирає готові задачі (FOR UPDATE SKIP LOCKED). Задача в статусі running
+    повертається в роботу, якщо воркер не завершив її за lease_seconds.
+    """
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    async with db_pool.acquire() as connection:
+        records = await connection.fetch("""
+            UPDATE photo_jobs
+            SET status = 'running',
+                attempts = attempts + 1,
+                run_at = now() + make_interval(secs => $2),
+                updated_at = now()
+            WHERE id IN (
+                SELECT id FROM photo_jobs
+                WHERE status IN ('pending', 'running') AND run_at <= now()
+                ORDER BY run_at
+                LIMIT $1
+                FOR UPDATE SKIP LOCKED
+            )
+            RETURNING id, client_id, file_id, attempts
+        """, limit, lease_seconds)
+        return [dict(record) for record in records]
+
+async def complete_photo_job(job_id: int):
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    async with db_pool.acquire() as connection:
+        await connection.execute("""
+            UPDATE photo_jobs SET status = 'done', last_error = NULL, updated_at = now()
+            WHERE id = $1
+        """, job_id)
+
+async def fail_photo_job(job_id: int, error: str, max_attempts: int, retry_delay: float) -> str:
+    """Планує повтор із затримкою або переводить задачу в dead. Повертає новий статус."""
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    async with db_pool.acquire() as connection:
+        return await connection.fetchval("""
+            UPDATE photo_jobs
+            SET status = CASE WHEN attempts >= $3 THEN 'dead' ELSE 'pending' END,
+                run_at = now() + make_interval(secs => $4),
+                last_error = $2,
+                updated_at = now()
+            WHERE id = $1
+            RETURNING status
+        """, job_id, error, max_attempts, retry_delay)
+
+# --- КЕШ TELEGRAM FILE_ID ---
+
+async def get_photo_file_ids(photo_urls: List[str]) -> Dict[str, str]:
+    """Повертає відомі file_id для переданих URL фото."""
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    if not photo_urls:
+        return {}
+    async with db_pool.acquire() as connection:
+        records = await connection.fetch(
+            "SELECT photo_url, file_id FROM telegram_photo_cache WHERE photo_url = ANY($1::text[])",
+            photo_urls
+        )
+    return {record['photo_url']: record['file_id'] for record in records}
+
+async def save_photo_file_ids(file_ids: Dict[str, str]):
+    """Зберігає (або оновлює) file_id для URL фото одним запитом."""
+    if not db_pool:
+        raise Exception("Database pool is not initialized.")
+    if not file_ids:
+        return
+    async with db_pool.acquire() as connection:
+        await connection.execute("""
+            INSERT INTO telegram_photo_cache (photo_url, file_id)
+            SELECT * FROM unnest($1::text[], $2::text[])
+            ON CONFLICT (photo_url) DO UPDATE SET file_id = EXCLUDED.file_id, updated_at = now()
+        """, list(file_ids.keys()), list(file_ids.values()))
+
+
+if __name__ == "__main__":
+    # Крок розгортання перед запуском бота з DB_AUTO_MIGRATE=0
+    asyncio.run(migrate())
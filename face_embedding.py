@@ -0,0 +1,221 @@
+import asyncio
+import hashlib
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from io import BytesIO
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple, Union
+
+from config import settings
+from face_index import EMBEDDING_DIM
+
+logging.basicConfig(level=logging.INFO)
+
+# Джерело зображення: готові байти або корутина, що їх завантажує (напр. з Telegram)
+ImageSource = Union[bytes, Callable[[], Awaitable[bytes]]]
+ResultCallback = Callable[[int, List[float]], Awaitable[None]]
+
+
+# --- ЕНКОДЕРИ ---
+
+class StubEncoder:
+    """Детермінований енкодер для тестів: однакові байти дають однакове кодування."""
+    name = "stub"
+
+    def encode(self, image: bytes) -> Optional[List[float]]:
+        if not image:
+            return None
+        values: List[float] = []
+        counter = 0
+        while len(values) < EMBEDDING_DIM:
+            block = hashlib.sha256(image + counter.to_bytes(4, 'big')).digest()
+            values.extend((byte - 127.5) / 1275.0 for byte in block)
+            counter += 1
+        return values[:EMBEDDING_DIM]
+
+
+class FaceRecognitionEncoder:
+    """Енкодер на основі face_recognition/dlib (не входить до Docker-образу)."""
+    name = "face_recognition"
+
+    def __init__(self):
+        import face_recognition
+        self._face_recognition = face_recognition
+
+    def encode(self, image: bytes) -> Optional[List[float]]:
+        picture = self._face_recognition.load_image_file(BytesIO(image))
+        encodings = self._face_recognition.face_encodings(picture)
+        return encodings[0].tolist() if encodings else None
+
+
+# Реєстр енкодерів. Власні енкодери реєструйте на рівні модуля,
+# щоб вони були доступні й у дочірніх процесах пулу.
+ENCODERS: Dict[str, Callable[[], object]] = {
+    StubEncoder.name: StubEncoder,
+    FaceRecognitionEncoder.name: FaceRecognitionEncoder,
+}
+
+def register_encoder(name: str, factory: Callable[[], object]):
+    """Додає енкодер до реєстру (factory() повертає об'єкт з методом encode(bytes))."""
+    ENCODERS[name] = factory
+
+
+# Енкодер, створений один раз у кожному процесі-воркері
+_worker_encoder = None
+
+def _encode_batch(encoder_name: str, images: List[bytes]) -> List[Optional[List[float]]]:
+    """Виконується у процесі-воркері: кодує пакет зображень."""
+    global _worker_encoder
+    if _worker_encoder is None or _worker_encoder.name != encoder_name:
+        _worker_encoder = ENCODERS[encoder_name]()
+
+    results = []
+    for image in images:
+        try:
+            results.append(_worker_encoder.encode(image) if image else None)
+        except Exception as e:
+            logging.error(f"Face encoding failed: {e}")
+            results.append(None)
+    return results
+
+
+async def _store_encoding(client_id: int, encoding: List[float]):
+    """Типовий обробник результату: запис у clients та індекс облич."""
+    import database as db
+    await db.update_face_encoding(client_id, encoding)
+
+
+def telegram_photo_loader(bot, file_id: str) -> Callable[[], Awaitable[bytes]]:
+    """Повертає корутину, яка завантажить фото з Telegram вже всередині пайплайна."""
+    async def load() -> bytes:
+        photo_file = await bot.get_file(file_id)
+        file_io = await bot.download_file(photo_file.file_path)
+        return file_io.getvalue()
+    return load
+
+
+# --- ПАЙПЛАЙН ---
+
+class EmbeddingPipeline:
+    """
+    Збирає фото, що надходять майже одночасно, у пакети та кодує їх
+    у ProcessPoolExecutor, не блокуючи цикл подій aiogram.
+    """
+
+    def __init__(self, encoder_name: str, workers: int = 1, batch_size: int = 8,
+                 batch_window: float = 0.2, on_result: ResultCallback = _store_encoding):
+        if encoder_name not in ENCODERS:
+            raise ValueError(f"Unknown face encoder: {encoder_name}")
+        self.encoder_name = encoder_name
+        self.workers = workers
+        self.batch_size = batch_size
+        self.batch_window = batch_window
+        self._on_result = on_result
+        self._queue: "asyncio.Queue[Tuple[int, ImageSource]]" = asyncio.Queue()
+        self._executor: Optional[ProcessPoolExecutor] = None
+        self._collector: Optional[asyncio.Task] = None
+        self._batches: set = set()
+        self._slots = asyncio.Semaphore(workers)
+
+    async def start(self):
+        self._executor = ProcessPoolExecutor(max_workers=self.workers)
+        self._collector = asyncio.create_task(self._collect())
+        logging.info(f"Face embedding pipeline started (encoder={self.encoder_name}, workers={self.workers}).")
+
+    def submit(self, client_id: int, image: ImageSource):
+        """Ставить фото в чергу і одразу повертає керування обробнику."""
+        self._queue.put_nowait((client_id, image))
+
+    async def stop(self, timeout: float = 30.0):
+        """Дочікується обробки черги та зупиняє воркери."""
+        if self._collector is None:
+            return
+        try:
+            await asyncio.wait_for(self._queue.join(), timeout)
+        except asyncio.TimeoutError:
+            logging.warning(f"Face pipeline stopped with {self._queue.qsize()} photos pending.")
+        self._collector.cancel()
+        if self._batches:
+            await asyncio.wait(self._batches, timeout=timeout)
+        self._executor.shutdown(wait=False)
+        self._collector = None
+
+    async def _collect(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.batch_window
+            while len(batch) < self.batch_size:
+                remaining = deadline - loop.time()
+                if remaining <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), remaining))
+                except asyncio.TimeoutError:
+                    break
+
+            # Не більше пакетів одночасно, ніж процесів у пулі
+            await self._slots.acquire()
+            task = asyncio.create_task(self._process(batch))
+            self._batches.add(task)
+            task.add_done_callback(self._batch_done)
+
+    def _batch_done(self, task: asyncio.Task):
+        self._batches.discard(task)
+        self._slots.release()
+
+    async def _load(self, image: ImageSource) -> Optional[bytes]:
+        if isinstance(image, (bytes, bytearray)):
+            return bytes(image)
+        try:
+            return await image()
+        except Exception as e:
+            logging.error(f"Failed to load photo for face encoding: {e}")
+            return None
+
+    async def _process(self, batch: List[Tuple[int, ImageSource]]):
+        try:
+            images = await asyncio.gather(*(self._load(image) for _, image in batch))
+            loop = asyncio.get_running_loop()
+            encodings = await loop.run_in_executor(
+                self._executor, _encode_batch, self.encoder_name, list(images)
+            )
+            for (client_id, _), encoding in zip(batch, encodings):
+                if not encoding:
+                    continue
+                try:
+                    await self._on_result(client_id, encoding)
+                except Exception as e:
+                    logging.error(f"Failed to store face encoding for client {client_id}: {e}")
+        except Exception as e:
+            logging.error(f"Face embedding batch failed: {e}")
+        finally:
+            for _ in batch:
+                self._queue.task_done()
+
+
+# Глобальний пайплайн процесу (None, якщо FACE_ENCODER не задано)
+pipeline: Optional[EmbeddingPipeline] = None
+
+async def start_pipeline():
+    """Запускає пайплайн згідно з налаштуваннями."""
+    global pipeline
+    if pipeline or not settings.FACE_ENCODER:
+        return
+    pipeline = EmbeddingPipeline(
+        settings.FACE_ENCODER,
+        workers=settings.FACE_ENCODER_WORKERS,
+        batch_size=settings.FACE_BATCH_SIZE,
+        batch_window=settings.FACE_BATCH_WINDOW_MS / 1000,
+    )
+    await pipeline.start()
+
+async def stop_pipeline():
+    global pipeline
+    if pipeline:
+        await pipeline.stop()
+        pipeline = None
+
+def submit(client_id: int, image: ImageSource):
+    """Надсилає фото на кодування; без налаштованого енкодера нічого не робить."""
+    if pipeline:
+        pipeline.submit(client_id, image)
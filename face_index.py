@@ -0,0 +1,190 @@
+import logging
+import sys
+from array import array
+from typing import Dict, Iterable, List, Optional, Sequence, Tuple, Union
+
+# numpy потрібен лише in-memory індексу: з FACE_INDEX_BACKEND=pgvector модуль
+# використовується тільки для серіалізації, тож імпорт необов'язковий
+# (Settings.validate не дає запустити бот з memory без numpy).
+try:
+    import numpy as np
+except ImportError:
+    np = None
+
+logging.basicConfig(level=logging.INFO)
+
+# Розмірність кодувань face_recognition/dlib
+EMBEDDING_DIM = 128
+
+# Поріг відстані, який face_recognition використовує за замовчуванням
+DEFAULT_MAX_DISTANCE = 0.6
+
+Embedding = Union[bytes, Sequence[float]]
+
+
+# --- СЕРІАЛІЗАЦІЯ (float32 little-endian, без numpy) ---
+
+def encode_embedding(values: Sequence[float]) -> Optional[bytes]:
+    """Пакує кодування обличчя у компактний float32 (4 байти на значення)."""
+    if not values:
+        return None
+    packed = array('f', values)
+    if sys.byteorder == 'big':
+        packed.byteswap()
+    return packed.tobytes()
+
+
+def decode_embedding(data: Optional[bytes]) -> List[float]:
+    """Розпаковує float32-кодування у список чисел."""
+    if not data:
+        return []
+    unpacked = array('f')
+    unpacked.frombytes(data)
+    if sys.byteorder == 'big':
+        unpacked.byteswap()
+    return unpacked.tolist()
+
+
+def to_pgvector_literal(values: Sequence[float]) -> str:
+    """Текстове представлення вектора для pgvector ('[0.1,0.2,...]')."""
+    return '[' + ','.join(repr(float(v)) for v in values) + ']'
+
+
+# --- IN-MEMORY ІНДЕКС ---
+
+class FaceIndex:
+    """
+    Матриця кодувань у пам'яті процесу. Оновлюється інкрементально
+    (upsert/remove) і шукає top-k сусідів одним векторизованим обчисленням.
+    """
+
+    def __init__(self, dim: int = EMBEDDING_DIM, initial_capacity: int = 1024):
+        self.dim = dim
+        self._count = 0
+        self._row_by_id: Dict[int, int] = {}
+        if np is not None:
+            self._matrix = np.zeros((initial_capacity, dim), dtype=np.float32)
+            self._ids = np.zeros(initial_capacity, dtype=np.int64)
+            self._owners = np.zeros(initial_capacity, dtype=np.int64)
+        else:
+            self._matrix = None
+            self._ids = None
+            self._owners = None
+
+    @property
+    def available(self) -> bool:
+        return np is not None
+
+    def __len__(self) -> int:
+        return self._count
+
+    def _as_vector(self, embedding: Embedding):
+        if isinstance(embedding, (bytes, bytearray, memoryview)):
+            vector = np.frombuffer(embedding, dtype='<f4')
+        else:
+            vector = np.asarray(embedding, dtype=np.float32)
+        if vector.shape != (self.dim,):
+            raise ValueError(f"Expected embedding of size {self.dim}, got {vector.shape}")
+        return vector
+
+    def _ensure_capacity(self, size: int):
+        capacity = self._matrix.shape[0]
+        if size <= capacity:
+            return
+        new_capacity = max(size, capacity * 2)
+        matrix = np.zeros((new_capacity, self.dim), dtype=np.float32)
+        matrix[:self._count] = self._matrix[:self._count]
+        ids = np.zeros(new_capacity, dtype=np.int64)
+        ids[:self._count] = self._ids[:self._count]
+        owners = np.zeros(new_capacity, dtype=np.int64)
+        owners[:self._count] = self._owners[:self._count]
+        self._matrix, self._ids, self._owners = matrix, ids, owners
+
+    def clear(self):
+        self._count = 0
+        self._row_by_id.clear()
+
+    def load(self, rows: Iterable[Tuple[int, int, bytes]]):
+        """Повністю перебудовує індекс з трійок (client_id, owner_id, float32-байти)."""
+        if not self.available:
+            return
+        self.clear()
+        for client_id, owner_id, data in rows:
+            if data:
+                self.upsert(client_id, data, owner_id)
+        logging.info(f"Face index loaded: {self._count} embeddings.")
+
+    def upsert(self, client_id: int, embedding: Optional[Embedding], owner_id: int = 0):
+        """Додає або замінює кодування клієнта; порожнє кодування видаляє його з індексу."""
+        if not self.available:
+            return
+        if embedding is None or len(embedding) == 0:
+            self.remove(client_id)
+            return
+        vector = self._as_vector(embedding)
+        row = self._row_by_id.get(client_id)
+        if row is None:
+            self._ensure_capacity(self._count + 1)
+            row = self._count
+            self._count += 1
+            self._row_by_id[client_id] = row
+            self._ids[row] = client_id
+        self._matrix[row] = vector
+        self._owners[row] = owner_id
+
+    def remove(self, client_id: int):
+        """Видаляє кодування, переносячи останній рядок на місце видаленого."""
+        if not self.available:
+            return
+        row = self._row_by_id.pop(client_id, None)
+        if row is None:
+            return
+        last = self._count - 1
+        if row != last:
+            moved_id = int(self._ids[last])
+            self._matrix[row] = self._matrix[last]
+            self._ids[row] = moved_id
+            self._owners[row] = self._owners[last]
+            self._row_by_id[moved_id] = row
+        self._count = last
+
+    def search(self, embedding: Embedding, k: int = 5,
+               max_distance: Optional[float] = DEFAULT_MAX_DISTANCE,
+               owner_id: Optional[int] = None) -> List[Tuple[int, float]]:
+        """
+        Повертає до k пар (client_id, евклідова відстань), від найближчого.
+        З owner_id відстані рахуються лише для клієнтів цієї команди.
+        """
+        if not self.available:
+            raise RuntimeError("numpy is not installed: in-memory face index is unavailable.")
+        if self._count == 0 or k <= 0:
+            return []
+
+        if owner_id is None:
+            rows = np.arange(self._count)
+            matrix = self._matrix[:self._count]
+        else:
+            rows = np.flatnonzero(self._owners[:self._count] == owner_id)
+            if rows.size == 0:
+                return []
+            matrix = self._matrix[rows]
+
+        query = self._as_vector(embedding)
+        diff = matrix - query
+        distances = np.sqrt(np.einsum('ij,ij->i', diff, diff))
+
+        k = min(k, rows.size)
+        candidates = np.argpartition(distances, k - 1)[:k]
+        candidates = candidates[np.argsort(distances[candidates])]
+
+        results = []
+        for candidate in candidates:
+            distance = float(distances[candidate])
+            if max_distance is not None and distance > max_distance:
+                break
+            results.append((int(self._ids[rows[candidate]]), distance))
+        return results
+
+
+# Глобальний індекс процесу (наповнюється з БД у database.init_db)
+index = FaceIndex()
@@ -0,0 +1,42 @@
+import time
+from typing import Dict, Tuple
+
+from aiohttp import web
+
+# Без цих компонентів бот не обслуговує оновлення. Spaces потрібен лише для
+# фото, тож його стан показується, але на готовність не впливає.
+REQUIRED_COMPONENTS = ('database', 'dispatcher')
+
+_started_at = time.monotonic()
+# компонент -> (готовий, подробиці: остання помилка чи стан)
+_components: Dict[str, Tuple[bool, str]] = {}
+
+
+def set_status(component: str, ready: bool, detail: str = ''):
+    _components[component] = (ready, detail)
+
+
+def is_ready() -> bool:
+    return all(_components.get(name, (False, ''))[0] for name in REQUIRED_COMPONENTS)
+
+
+async def handle_healthz(request: web.Request) -> web.Response:
+    """Liveness: процес живий і цикл подій встигає відповідати."""
+    return web.json_response({'status': 'ok', 'uptime': round(time.monotonic() - _started_at, 1)})
+
+
+async def handle_readyz(request: web.Request) -> web.Response:
+    """Readiness: 200, коли БД підключена і бот приймає оновлення; інакше 503 з причиною."""
+    components = {name: {'ready': False, 'detail': 'pending'} for name in REQUIRED_COMPONENTS}
+    components.update({
+        name: {'ready': ready, 'detail': detail} for name, (ready, detail) in _components.items()
+    })
+    ready = is_ready()
+    return web.json_response(
+        {'status': 'ready' if ready else 'not_ready', 'components': components},
+        status=200 if ready else 503,
+    )
+
+
+def routes():
+    return [web.get('/healthz', handle_healthz), web.get('/readyz', handle_readyz)]
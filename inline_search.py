@@ -0,0 +1,108 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional, Tuple
+
+from aiogram import Router
+from aiogram.types import InlineQuery, InlineQueryResultArticle, InputTextMessageContent
+
+from config import settings
+import database as db
+import metrics
+from cache import LRUTTLCache
+from client_fsm import format_client_info
+
+logging.basicConfig(level=logging.INFO)
+
+# Inline-режим потрібно ввімкнути для бота в @BotFather (/setinline)
+router = Router()
+
+MIN_QUERY_LENGTH = 3
+
+# Відповіді за (owner_id, запит, offset). Зміни клієнтів стають видимі
+# в inline-пошуку не пізніше ніж через INLINE_CACHE_TTL.
+result_cache = LRUTTLCache(maxsize=settings.INLINE_CACHE_SIZE, ttl=settings.INLINE_CACHE_TTL)
+metrics.watch_cache("inline", result_cache)
+
+# Останній inline-запит кожного користувача (для debounce)
+_latest_query: Dict[int, str] = {}
+
+
+def _thumbnail_url(client: Dict[str, Any]) -> Optional[str]:
+    for variant in client.get('photo_variants') or []:
+        if variant.get('thumb'):
+            return variant['thumb']
+    return None
+
+
+def _client_card(client: Dict[str, Any]) -> InlineQueryResultArticle:
+    phones = ", ".join(client['phone']) if client['phone'] else "Номер не вказано"
+    return InlineQueryResultArticle(
+        id=str(client['id']),
+        title=f"ID:{client['id']} · {phones}",
+        description=(client['comment'] or '')[:100],
+        thumbnail_url=_thumbnail_url(client),
+        input_message_content=InputTextMessageContent(
+            message_text=format_client_info(client), parse_mode="Markdown"
+        ),
+    )
+
+
+async def _search_page(owner_id: int, query: str, offset: str) -> Tuple[List[InlineQueryResultArticle], str]:
+    key = (owner_id, query.lower(), offset)
+    cached = result_cache.get(key)
+    if cached is not None:
+        return cached
+
+    clients, next_cursor = await db.search_clients(
+        owner_id, query,
+        limit=settings.INLINE_PAGE_SIZE,
+        after=db.decode_search_cursor(offset) if offset else None,
+    )
+    page = (
+        [_client_card(client) for client in clients],
+        db.encode_search_cursor(next_cursor) if next_cursor else "",
+    )
+    result_cache.set(key, page)
+    return page
+
+
+async def _is_superseded(query: InlineQuery) -> bool:
+    """
+    Debounce: чекає INLINE_DEBOUNCE і повідомляє, чи користувач уже надрукував
+    новіший запит (тоді Telegram однаково відкине відповідь на цей).
+    """
+    user_id = query.from_user.id
+    _latest_query[user_id] = query.id
+    await asyncio.sleep(settings.INLINE_DEBOUNCE)
+    if _latest_query.get(user_id) != query.id:
+        return True
+    del _latest_query[user_id]
+    return False
+
+
+@router.inline_query()
+async def inline_search(query: InlineQuery):
+    """Пошук клієнтів просто з поля введення: @bot <номер або слово з коментаря>."""
+    text = query.query.strip()
+    if len(text) < MIN_QUERY_LENGTH:
+        await query.answer([], cache_time=settings.INLINE_CACHE_TIME, is_personal=True)
+        return
+
+    # Гортання сторінок (непорожній offset) — не набір тексту, тому без затримки
+    if not query.offset and await _is_superseded(query):
+        return
+
+    owner_id = await db.resolve_owner(query.from_user.id)
+    try:
+        results, next_offset = await _search_page(owner_id, text, query.offset)
+    except Exception as e:
+        logging.error(f"Inline search failed for '{text}': {e}")
+        results, next_offset = [], ""
+
+    await query.answer(
+        results,
+        cache_time=settings.INLINE_CACHE_TIME,
+        # Результати залежать від команди оператора: не ділимося кешем Telegram між користувачами
+        is_personal=True,
+        next_offset=next_offset,
+    )
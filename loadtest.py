@@ -0,0 +1,364 @@
+"""
+Навантажувальний тест диспетчера: синтетичні оновлення проходять повний шлях
+dp.feed_update -> фільтри -> FSM -> обробники -> PostgreSQL (DATABASE_URL),
+а фонова черга фото завантажує їх у S3 (SPACES_ENDPOINT_URL, напр. локальний MinIO).
+Telegram замінено фейковою сесією бота, тож мережа до api.telegram.org не потрібна.
+
+    python loadtest.py --users 50 --concurrency 20 --iterations 3 --json report.json
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import logging
+import math
+import random
+import time
+from collections import defaultdict
+from datetime import datetime, timezone
+from io import BytesIO
+from typing import Any, AsyncGenerator, Dict, List, Optional, Tuple
+
+from aiogram import BaseMiddleware, Bot, Dispatcher
+from aiogram.client.session.base import BaseSession
+from aiogram.fsm.storage.memory import DisabledEventIsolation, MemoryStorage
+from aiogram.methods import GetFile, SendMediaGroup, TelegramMethod
+from aiogram.types import File, Message, Update
+
+from config import settings
+import database as db
+import photo_jobs
+import bulk_io
+import inline_search
+import client_fsm as cfsm
+from pg_storage import PostgresStorage, UpdateScope
+
+try:
+    from PIL import Image
+except ImportError:
+    Image = None
+
+logging.basicConfig(level=logging.INFO)
+# Журнал aiogram про кожне оновлення спотворює заміри
+logging.getLogger('aiogram.event').setLevel(logging.WARNING)
+
+# Діапазон ID синтетичних операторів (не перетинається з реальними Telegram ID)
+USER_ID_BASE = 9_000_000_000
+
+
+def _base_jpeg() -> bytes:
+    if Image is None:
+        # Лише сигнатура JPEG: без Pillow ingest_photo зберігає оригінал без варіантів
+        return b'\xff\xd8\xff\xe0' + bytes(2048)
+    buffer = BytesIO()
+    Image.new('RGB', (800, 600), (120, 140, 160)).save(buffer, format='JPEG')
+    return buffer.getvalue()
+
+
+class FakeSession(BaseSession):
+    """
+    Сесія бота без мережі: відповідає на методи Bot API мінімальними валідними
+    об'єктами, запам'ятовує останні inline-кнопки в кожному чаті та віддає
+    синтетичний JPEG замість файлів Telegram.
+    """
+
+    def __init__(self, api_latency: float = 0.0):
+        super().__init__()
+        self.api_latency = api_latency
+        self.calls: Dict[str, int] = defaultdict(int)
+        self.last_buttons: Dict[int, List[str]] = {}
+        self._message_ids = itertools.count(1)
+        self._jpeg = _base_jpeg()
+
+    async def close(self):
+        pass
+
+    def _message(self, chat_id: Any, **fields) -> Dict[str, Any]:
+        return {
+            'message_id': next(self._message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id if isinstance(chat_id, int) else 0, 'type': 'private'},
+            **fields,
+        }
+
+    async def make_request(self, bot: Bot, method: TelegramMethod, timeout: Optional[int] = None):
+        self.calls[type(method).__name__] += 1
+        if self.api_latency:
+            await asyncio.sleep(self.api_latency)
+
+        markup = getattr(method, 'reply_markup', None)
+        chat_id = getattr(method, 'chat_id', None)
+        if chat_id is not None and getattr(markup, 'inline_keyboard', None):
+            self.last_buttons[chat_id] = [
+                button.callback_data for row in markup.inline_keyboard for button in row if button.callback_data
+            ]
+
+        if isinstance(method, GetFile):
+            result = {'file_id': method.file_id, 'file_unique_id': method.file_id,
+                      'file_path': f"photos/{method.file_id}.jpg"}
+            return File.model_validate(result, context={'bot': bot})
+        if isinstance(method, SendMediaGroup):
+            return [
+                Message.model_validate(self._message(method.chat_id, photo=[{
+                    'file_id': f"sent-{index}", 'file_unique_id': f"sent-{index}", 'width': 800, 'height': 600,
+                }]), context={'bot': bot})
+                for index, _ in enumerate(method.media)
+            ]
+        if method.__returning__ is bool or chat_id is None:
+            return True
+        return Message.model_validate(
+            self._message(chat_id, text=getattr(method, 'text', None)), context={'bot': bot}
+        )
+
+    async def stream_content(self, url: str, headers: Optional[Dict[str, Any]] = None, timeout: int = 30,
+                             chunk_size: int = 65536, raise_for_status: bool = True) -> AsyncGenerator[bytes, None]:
+        # Кінцівка після маркера кінця JPEG дає кожному файлу унікальний хеш вмісту
+        data = self._jpeg + url.encode()
+        for start in range(0, len(data), chunk_size):
+            yield data[start:start + chunk_size]
+
+
+class LatencyRecorder(BaseMiddleware):
+    """Inner-middleware: сирі тривалості обробників за (обробник, FSM-стан)."""
+
+    def __init__(self):
+        self.samples: Dict[Tuple[str, str], List[float]] = defaultdict(list)
+
+    async def __call__(self, handler, event, data):
+        callback = getattr(data.get('handler'), 'callback', None)
+        key = (callback.__name__ if callback else 'unknown', data.get('raw_state') or '-')
+        started = time.perf_counter()
+        try:
+            return await handler(event, data)
+        finally:
+            self.samples[key].append(time.perf_counter() - started)
+
+
+# --- СИНТЕТИЧНІ ОНОВЛЕННЯ ---
+
+class VirtualOperator:
+    """Один оператор: послідовно проходить сценарії ClientForm у власному чаті."""
+
+    _update_ids = itertools.count(1)
+
+    def __init__(self, index: int, bot: Bot, dp: Dispatcher, session: FakeSession,
+                 step_samples: Dict[str, List[float]]):
+        self.user_id = USER_ID_BASE + index
+        self.bot = bot
+        self.dp = dp
+        self.session = session
+        self.step_samples = step_samples
+        self._photos = itertools.count(1)
+        self._phones = itertools.count(1)
+
+    def _user(self) -> Dict[str, Any]:
+        return {'id': self.user_id, 'is_bot': False, 'first_name': 'Load', 'language_code': 'uk'}
+
+    def _message(self, **fields) -> Dict[str, Any]:
+        return {
+            'message_id': next(self._update_ids),
+            'date': int(time.time()),
+            'chat': {'id': self.user_id, 'type': 'private'},
+            'from': self._user(),
+            **fields,
+        }
+
+    async def _feed(self, step: str, payload: Dict[str, Any]):
+        update = Update.model_validate(
+            {'update_id': next(self._update_ids), **payload}, context={'bot': self.bot}
+        )
+        started = time.perf_counter()
+        await self.dp.feed_update(self.bot, update)
+        self.step_samples[step].append(time.perf_counter() - started)
+
+    async def send_text(self, step: str, text: str):
+        await self._feed(step, {'message': self._message(text=text)})
+
+    async def send_photo(self, step: str):
+        file_id = f"lt-{self.user_id}-{next(self._photos)}"
+        photo = [{'file_id': file_id, 'file_unique_id': file_id, 'width': 800, 'height': 600}]
+        await self._feed(step, {'message': self._message(photo=photo)})
+
+    async def press(self, step: str, data: str):
+        await self._feed(step, {'callback_query': {
+            'id': str(next(self._update_ids)),
+            'from': self._user(),
+            'chat_instance': str(self.user_id),
+            'data': data,
+            'message': self._message(text="..."),
+        }})
+
+    def _new_phone(self) -> str:
+        # Унікальний у межах оператора номер: пошук за ним знаходить одного клієнта
+        suffix = (self.user_id * 1000 + next(self._phones)) % 10_000_000
+        return f"+380 67 {suffix:07d}"
+
+    def _button(self, prefix: str) -> Optional[str]:
+        for data in self.session.last_buttons.get(self.user_id, []):
+            if data.startswith(prefix):
+                return data
+        return None
+
+    # --- сценарії ---
+
+    async def add_client(self, with_photo: bool) -> str:
+        phone = self._new_phone()
+        await self.send_text('add.start', "➕ Новий клієнт")
+        if with_photo:
+            await self.send_photo('add.photo')
+        else:
+            await self.send_text('add.skip_photo', "Пропустити фото ⏭️")
+        comment = random.choice(("постійний клієнт", "VIP, любить каву", "дзвонити після 18:00"))
+        await self.send_text('add.phone_and_comment', f"{phone}, {comment}")
+        return phone
+
+    async def open_client(self, phone: str) -> bool:
+        """Пошук за унікальним номером: єдиний результат показує клавіатуру редагування."""
+        self.session.last_buttons.pop(self.user_id, None)
+        await self.send_text('search.start', "🔍 Пошук клієнта")
+        await self.send_text('search.query', phone)
+        return self._button("edit_phone_") is not None
+
+    async def edit(self, action: str, phone: str):
+        if not await self.open_client(phone):
+            return
+        await self.press(f'edit.{action}.select', self._button(f"edit_{action}_"))
+        if action == 'phone':
+            await self.send_text('edit.phone.input', self._new_phone())
+        elif action == 'comment':
+            await self.send_text('edit.comment.input', "оновлений коментар")
+        else:
+            await self.send_photo('edit.photo.input')
+
+    async def delete(self, phone: str):
+        if await self.open_client(phone):
+            await self.press('delete', self._button("delete_client_"))
+
+    async def run(self, iterations: int):
+        for _ in range(iterations):
+            photo_phone = await self.add_client(with_photo=True)
+            skip_phone = await self.add_client(with_photo=False)
+            await self.edit('phone', skip_phone)
+            await self.edit('comment', skip_phone)
+            await self.edit('photo', photo_phone)
+            await self.delete(skip_phone)
+
+
+# --- ЗВІТ ---
+
+def _percentile(sorted_values: List[float], fraction: float) -> float:
+    # Метод найближчого рангу
+    index = max(0, math.ceil(fraction * len(sorted_values)) - 1)
+    return sorted_values[index]
+
+
+def _summary(samples: List[float]) -> Dict[str, float]:
+    values = sorted(samples)
+    return {
+        'count': len(values),
+        'mean_ms': sum(values) / len(values) * 1000,
+        'p50_ms': _percentile(values, 0.50) * 1000,
+        'p95_ms': _percentile(values, 0.95) * 1000,
+        'p99_ms': _percentile(values, 0.99) * 1000,
+    }
+
+
+def _print_table(title: str, rows: Dict[str, Dict[str, float]]):
+    print(f"\n{title}")
+    print(f"{'':48} {'count':>7} {'mean':>9} {'p50':>9} {'p95':>9} {'p99':>9}")
+    for name, stats in sorted(rows.items()):
+        print(f"{name[:48]:48} {stats['count']:>7} {stats['mean_ms']:>8.1f}ms "
+              f"{stats['p50_ms']:>7.1f}ms {stats['p95_ms']:>7.1f}ms {stats['p99_ms']:>7.1f}ms")
+
+
+async def _cleanup(user_ids: List[int]):
+    async with db.db_pool.acquire() as connection:
+        await connection.execute("DELETE FROM clients WHERE owner_id = ANY($1::bigint[])", user_ids)
+        await connection.execute("DELETE FROM operators WHERE id = ANY($1::bigint[])", user_ids)
+    db.client_cache.clear()
+    db.operator_cache.clear()
+
+
+async def run_load_test(users: int, concurrency: int, iterations: int,
+                        api_latency: float = 0.0, photo_worker: bool = True) -> Dict[str, Any]:
+    await db.init_db()
+    session = FakeSession(api_latency=api_latency)
+    bot = Bot(token="123456:LOADTEST", session=session)
+
+    # Той самий набір роутерів, що й у main.py
+    if settings.FSM_STORAGE == "postgres":
+        storage, events_isolation = PostgresStorage(state_ttl=settings.FSM_STATE_TTL), UpdateScope()
+    else:
+        storage, events_isolation = MemoryStorage(), DisabledEventIsolation()
+    dp = Dispatcher(storage=storage, events_isolation=events_isolation)
+    dp.include_router(bulk_io.router)
+    dp.include_router(inline_search.router)
+    dp.include_router(cfsm.router)
+    recorder = LatencyRecorder()
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(recorder)
+
+    if photo_worker:
+        photo_jobs.start_worker(bot)
+
+    step_samples: Dict[str, List[float]] = defaultdict(list)
+    operators = [VirtualOperator(index, bot, dp, session, step_samples) for index in range(users)]
+    slots = asyncio.Semaphore(concurrency)
+
+    async def run_operator(operator: VirtualOperator):
+        async with slots:
+            await operator.run(iterations)
+
+    started = time.perf_counter()
+    try:
+        await asyncio.gather(*(run_operator(operator) for operator in operators))
+        elapsed = time.perf_counter() - started
+    finally:
+        await photo_jobs.stop_worker()
+        await _cleanup([operator.user_id for operator in operators])
+        await storage.close()
+        await db.close_db()
+
+    total_updates = sum(len(samples) for samples in step_samples.values())
+    return {
+        'started_at': datetime.now(timezone.utc).isoformat(),
+        'users': users,
+        'concurrency': concurrency,
+        'iterations': iterations,
+        'elapsed_s': elapsed,
+        'updates': total_updates,
+        'updates_per_s': total_updates / elapsed if elapsed else 0.0,
+        'api_calls': dict(session.calls),
+        'steps': {step: _summary(samples) for step, samples in step_samples.items()},
+        'handlers': {
+            f"{handler} [{state}]": _summary(samples) for (handler, state), samples in recorder.samples.items()
+        },
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Навантажувальний тест обробників бота.")
+    parser.add_argument('--users', type=int, default=20, help="Кількість віртуальних операторів")
+    parser.add_argument('--concurrency', type=int, default=10, help="Скільки операторів працюють одночасно")
+    parser.add_argument('--iterations', type=int, default=1, help="Повтори повного набору сценаріїв на оператора")
+    parser.add_argument('--api-latency', type=float, default=0.0, help="Імітована затримка Bot API, с")
+    parser.add_argument('--no-photo-worker', action='store_true', help="Не запускати фонове завантаження фото")
+    parser.add_argument('--json', help="Зберегти звіт у JSON-файл")
+    args = parser.parse_args()
+
+    report = asyncio.run(run_load_test(
+        args.users, args.concurrency, args.iterations,
+        api_latency=args.api_latency, photo_worker=not args.no_photo_worker,
+    ))
+
+    print(f"Updates: {report['updates']} in {report['elapsed_s']:.2f}s "
+          f"-> {report['updates_per_s']:.1f} updates/s")
+    _print_table("Кроки сценаріїв (повний feed_update):", report['steps'])
+    _print_table("Обробники [FSM-стан]:", report['handlers'])
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,23 +1,43 @@
 import asyncio
 import logging
+from typing import Tuple
 # ВАЖЛИВО: ДОДАНО F до імпортів!
 from aiogram import Bot, Dispatcher, types, F 
 from aiogram.filters import Command, StateFilter 
 from aiogram.fsm.context import FSMContext
 from aiogram.fsm.state import default_state 
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage
+from aiogram.fsm.storage.memory import DisabledEventIsolation, MemoryStorage
 from aiogram.types import ReplyKeyboardMarkup, KeyboardButton 
 
 from config import settings
 import database as db
 import s3_storage 
+import face_embedding
+import photo_jobs
+import storage_gc
+import bulk_io
+import inline_search
 import client_fsm as cfsm 
+import webhook
+import metrics
+import health
+import send_scheduler
+from pg_storage import PostgresStorage, UpdateScope
 
 logging.basicConfig(level=logging.INFO)
 # ... (решта коду без змін)
 
 
-bot = Bot(token=settings.BOT_TOKEN)
-dp = Dispatcher()
+def create_storage() -> Tuple[BaseStorage, BaseEventIsolation]:
+    """FSM-сховище та ізоляція подій згідно з налаштуваннями."""
+    if settings.FSM_STORAGE == "postgres":
+        return PostgresStorage(state_ttl=settings.FSM_STATE_TTL), UpdateScope()
+    return MemoryStorage(), DisabledEventIsolation()
+
+
+storage, events_isolation = create_storage()
+dp = Dispatcher(storage=storage, events_isolation=events_isolation)
 
 # --- Створення Клавіатури Меню ---
 MENU_KEYBOARD = ReplyKeyboardMarkup(
@@ -54,24 +74,138 @@ async def cmd_cancel(message: types.Message, state: FSMContext):
     )
 
 
+@dp.message(Command("assign_operator"), StateFilter(default_state))
+async def cmd_assign_operator(message: types.Message):
+    """
+    /assign_operator <operator_id> <owner_id> — переводить оператора до команди.
+    Оператори однієї команди бачать і редагують спільних клієнтів.
+    """
+    if message.from_user.id not in settings.ADMIN_IDS:
+        await message.answer("⛔ Команда доступна лише адміністраторам.")
+        return
+    try:
+        _, operator_id, owner_id = message.text.split()
+        operator_id, owner_id = int(operator_id), int(owner_id)
+    except ValueError:
+        await message.answer("Використання: /assign_operator <ID оператора> <ID команди>")
+        return
+
+    await db.assign_operator(operator_id, owner_id)
+    await message.answer(f"✅ Оператора {operator_id} переведено до команди {owner_id}.")
+
+
+@dp.startup()
+async def on_startup():
+    health.set_status('dispatcher', True)
+
+
+@dp.shutdown()
+async def on_shutdown():
+    health.set_status('dispatcher', False, 'shutting down')
+
+
+async def init_database():
+    """init_db з повторними спробами; поки БД недоступна, /readyz показує останню помилку."""
+    attempts = max(1, settings.DB_CONNECT_RETRIES)
+    delay = 1
+    for attempt in range(1, attempts + 1):
+        try:
+            await db.init_db()
+            health.set_status('database', True)
+            return
+        except Exception as e:
+            health.set_status('database', False, f"attempt {attempt}/{attempts}: {e}")
+            if attempt == attempts:
+                raise
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, 30)
+
+
+async def init_storage():
+    """Клієнт Spaces. Без нього бот працює, лише фото не завантажуються."""
+    try:
+        await s3_storage.init_client()
+        health.set_status('storage', True)
+    except Exception as e:
+        logging.error(f"Spaces is unavailable at startup: {e}")
+        health.set_status('storage', False, str(e))
+
+
 async def main():
     """Головна функція запуску бота."""
-    # 1. Ініціалізація БД
+    settings.validate()
+    bot = Bot(token=settings.BOT_TOKEN)
+
+    # 1. Метрики та health-проби стартують першими: повільний або невдалий
+    # запуск видно ззовні ще до підключення до БД
+    metrics_runner = None
+    if settings.METRICS_PORT > 0:
+        metrics_runner = await metrics.start_server(
+            settings.METRICS_HOST, settings.METRICS_PORT, routes=health.routes()
+        )
+
+    # Spaces підключається паралельно з БД і не затримує старт: він потрібен
+    # лише фоновій черзі фото, яка повторює невдалі задачі
+    storage_task = asyncio.create_task(init_storage())
     try:
-        await db.init_db() 
-        # Якщо використовуєте s3_storage, його ініціалізацію можна додати тут
-        # s3_storage.init_client() 
+        await init_database()
     except Exception:
         logging.error("Критична помилка: Не вдалося підключитися до бази даних. Бот не запускається.")
+        storage_task.cancel()
+        await asyncio.gather(storage_task, return_exceptions=True)
+        await s3_storage.close_async_client()
+        await bot.session.close()
+        if metrics_runner:
+            await metrics_runner.cleanup()
         return
         
     # 2. ВКЛЮЧАЄМО РОУТЕРИ
+    # Команди масового імпорту/експорту (перед FSM, щоб стани їх не перехоплювали)
+    dp.include_router(bulk_io.router)
+    # Inline-пошук клієнтів (@bot запит)
+    dp.include_router(inline_search.router)
     # Роутер з FSM логікою клієнтів
     dp.include_router(cfsm.router) 
     
-    # 3. Запуск
+    if isinstance(dp.storage, PostgresStorage):
+        dp.storage.start()
+
+    # Черга вихідних повідомлень. Реєструється до таймінгу Bot API, щоб
+    # crm_telegram_api_seconds міряв сам виклик, а не очікування в черзі
+    send_scheduler.setup(bot)
+    # Таймінг обробників та Bot API
+    metrics.setup_dispatcher(dp, bot)
+
+    # 3. Фонове обчислення кодувань облич (у пулі процесів)
+    await face_embedding.start_pipeline()
+    photo_jobs.start_worker(bot)
+    sweeper = storage_gc.OrphanSweeper(settings.STORAGE_GC_INTERVAL, settings.STORAGE_GC_GRACE)
+    if settings.STORAGE_GC_INTERVAL > 0:
+        sweeper.start()
+
+    async def shutdown():
+        storage_task.cancel()
+        await photo_jobs.stop_worker()
+        await sweeper.stop()
+        await face_embedding.stop_pipeline()
+        await dp.storage.close()
+        await s3_storage.close_async_client()
+        await db.close_db()
+        if metrics_runner:
+            await metrics_runner.cleanup()
+
+    # 4. Запуск
+    if settings.BOT_MODE == "webhook":
+        logging.info("Starting bot in webhook mode...")
+        await webhook.run_webhook(bot, dp, on_shutdown=shutdown)
+        return
+
     logging.info("Starting bot polling...")
-    await dp.start_polling(bot)
+    try:
+        await bot.delete_webhook()
+        await dp.start_polling(bot)
+    finally:
+        await shutdown()
 
 if __name__ == "__main__":
     asyncio.run(main())
@@ -0,0 +1,308 @@
+import bisect
+import logging
+import threading
+import time
+from contextlib import contextmanager
+from typing import Any, Awaitable, Callable, Dict, List, Sequence, Tuple
+
+from aiohttp import web
+from aiogram import BaseMiddleware
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.types import TelegramObject, Update
+
+from config import settings
+
+logging.basicConfig(level=logging.INFO)
+
+# Межі кошиків (секунди): від швидких запитів за індексом до довгих завантажень
+DEFAULT_BUCKETS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+_registry: List[Any] = []
+
+
+def _escape(value: str) -> str:
+    return str(value).replace('\\', '\\\\').replace('\n', '\\n').replace('"', '\\"')
+
+
+def _format_labels(pairs: Sequence[Tuple[str, str]]) -> str:
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{_escape(value)}"' for name, value in pairs) + '}'
+
+
+class Histogram:
+    """
+    Гістограма у форматі Prometheus (кумулятивні кошики, _sum та _count)
+    з обов'язковими мітками. Потокобезпечна: S3-хуки boto3 виконуються в потоках.
+    """
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = (),
+                 buckets: Sequence[float] = DEFAULT_BUCKETS, log_slow: bool = True):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self.log_slow = log_slow
+        self._series: Dict[Tuple[str, ...], List] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def observe(self, seconds: float, **labels: Any):
+        key = tuple(str(labels.get(name, '')) for name in self.labelnames)
+        index = bisect.bisect_left(self.buckets, seconds)
+        with self._lock:
+            series = self._series.get(key)
+            if series is None:
+                # [лічильники кошиків (+Inf останній), сума, кількість]
+                series = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            series[0][index] += 1
+            series[1] += seconds
+            series[2] += 1
+
+        threshold = settings.METRICS_SLOW_THRESHOLD
+        if self.log_slow and threshold > 0 and seconds >= threshold:
+            logging.warning(f"SLOW {self.name} {labels}: {seconds:.3f}s")
+
+    @contextmanager
+    def time(self, **labels: Any):
+        """Вимірює тривалість блоку with (працює і всередині корутин)."""
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} histogram"]
+        with self._lock:
+            series = [(key, list(counts), total, count) for key, (counts, total, count) in self._series.items()]
+        for key, counts, total, count in sorted(series):
+            pairs = list(zip(self.labelnames, key))
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets + (float('inf'),), counts):
+                cumulative += bucket_count
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f"{self.name}_bucket{_format_labels(pairs + [('le', le)])} {cumulative}")
+            lines.append(f"{self.name}_sum{_format_labels(pairs)} {total}")
+            lines.append(f"{self.name}_count{_format_labels(pairs)} {count}")
+        return lines
+
+
+class Gauge:
+    """Поточне значення (глибина черги тощо) з необов'язковими мітками."""
+
+    metric_type = "gauge"
+
+    def __init__(self, name: str, documentation: str, labelnames: Sequence[str] = ()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values: Dict[Tuple[str, ...], float] = {}
+        self._lock = threading.Lock()
+        _registry.append(self)
+
+    def _key(self, labels: Dict[str, Any]) -> Tuple[str, ...]:
+        return tuple(str(labels.get(name, '')) for name in self.labelnames)
+
+    def set(self, value: float, **labels: Any):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+    def inc(self, amount: float = 1, **labels: Any):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def dec(self, amount: float = 1, **labels: Any):
+        self.inc(-amount, **labels)
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.metric_type}"]
+        with self._lock:
+            values = sorted(self._values.items())
+        for key, value in values:
+            lines.append(f"{self.name}{_format_labels(list(zip(self.labelnames, key)))} {value}")
+        return lines
+
+
+class Counter(Gauge):
+    """Монотонний лічильник подій (лише inc)."""
+
+    metric_type = "counter"
+
+
+_collectors: List[Callable[[], None]] = []
+
+
+def register_collector(collector: Callable[[], None]):
+    """
+    Функція, що оновлює метрики безпосередньо перед кожним /metrics: для
+    лічильників, які вже ведуться деінде (статистика кешів), без хуків у гарячому шляху.
+    """
+    _collectors.append(collector)
+
+
+def render_metrics() -> str:
+    for collector in _collectors:
+        try:
+            collector()
+        except Exception as e:
+            logging.error(f"Metrics collector {collector.__qualname__} failed: {e}")
+    lines = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return '\n'.join(lines) + '\n'
+
+
+UPDATE_LATENCY = Histogram(
+    "crm_update_seconds", "Повна обробка оновлення (фільтри, FSM-сховище, обробник).", ["event_type"]
+)
+HANDLER_LATENCY = Histogram(
+    "crm_handler_seconds", "Час виконання обробника.", ["handler", "state"]
+)
+DB_QUERY_LATENCY = Histogram(
+    "crm_db_query_seconds", "Час виконання SQL-запиту.", ["query"]
+)
+DB_POOL_WAIT = Histogram(
+    "crm_db_pool_wait_seconds", "Очікування вільного з'єднання в пулі asyncpg.", ["pool"]
+)
+S3_LATENCY = Histogram(
+    "crm_s3_seconds", "Виклики S3 API (разом із повторами botocore).", ["operation", "outcome"]
+)
+PHOTO_JOB_STAGE = Histogram(
+    "crm_photo_job_stage_seconds", "Етапи обробки фото: download (Telegram), ingest (варіанти + Spaces), attach (БД).",
+    ["stage"]
+)
+TELEGRAM_API_LATENCY = Histogram(
+    "crm_telegram_api_seconds", "Виклики методів Telegram Bot API.", ["method"]
+)
+SEND_QUEUE_WAIT = Histogram(
+    "crm_send_queue_wait_seconds", "Очікування вихідного повідомлення в черзі планувальника.", ["method"],
+    # Очікування в черзі — штатне пригальмовування, а не повільна операція
+    log_slow=False
+)
+SEND_QUEUE_DEPTH = Gauge(
+    "crm_send_queue_depth", "Вихідні повідомлення, що чекають на відправку."
+)
+SEND_QUEUE_CHATS = Gauge(
+    "crm_send_queue_chats", "Чати з непорожньою чергою вихідних повідомлень."
+)
+CACHE_ENTRIES = Gauge(
+    "crm_cache_entries", "Записи в кеші процесу.", ["cache"]
+)
+CACHE_EVENTS = Counter(
+    "crm_cache_events_total", "Звернення до кешу процесу: hit, miss, eviction (витіснення за розміром).",
+    ["cache", "event"]
+)
+
+
+SEND_EVENTS = Counter(
+    "crm_send_events_total", "Події планувальника: coalesced (об'єднані повідомлення), retry_after (отримані 429).",
+    ["event"]
+)
+
+
+# --- КЕШІ ПРОЦЕСУ ---
+
+def watch_cache(name: str, cache):
+    """Експортує статистику LRUTTLCache (cache.stats()) під міткою cache=name."""
+    def collect():
+        stats = cache.stats()
+        CACHE_ENTRIES.set(stats['size'], cache=name)
+        for event, key in (('hit', 'hits'), ('miss', 'misses'), ('eviction', 'evictions')):
+            CACHE_EVENTS.set(stats[key], cache=name, event=event)
+    register_collector(collect)
+
+
+# --- AIOGRAM ---
+
+class UpdateTimingMiddleware(BaseMiddleware):
+    """Outer-middleware на dp.update: повний час оновлення за типом події."""
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: Update, data: Dict[str, Any]) -> Any:
+        with UPDATE_LATENCY.time(event_type=event.event_type):
+            return await handler(event, data)
+
+
+class HandlerTimingMiddleware(BaseMiddleware):
+    """
+    Inner-middleware: викликається лише для обробника, що спрацював, тож знає
+    його модуль/назву та FSM-стан, у якому він виконувався.
+    """
+
+    async def __call__(self, handler: Callable[[TelegramObject, Dict[str, Any]], Awaitable[Any]],
+                       event: TelegramObject, data: Dict[str, Any]) -> Any:
+        handler_object = data.get('handler')
+        callback = getattr(handler_object, 'callback', None)
+        name = f"{callback.__module__}.{callback.__qualname__}" if callback else "unknown"
+        with HANDLER_LATENCY.time(handler=name, state=data.get('raw_state') or ''):
+            return await handler(event, data)
+
+
+class RequestTimingMiddleware(BaseRequestMiddleware):
+    """Middleware сесії бота: час кожного виклику Bot API (sendMessage, getFile, ...)."""
+
+    async def __call__(self, make_request, bot, method):
+        with TELEGRAM_API_LATENCY.time(method=type(method).__name__):
+            return await make_request(bot, method)
+
+
+def setup_dispatcher(dp, bot):
+    """Підключає таймінг оновлень, обробників і викликів Bot API."""
+    dp.update.outer_middleware(UpdateTimingMiddleware())
+    # Inner-middleware диспетчера поширюються на всі вкладені роутери
+    handler_timing = HandlerTimingMiddleware()
+    for observer in (dp.message, dp.callback_query, dp.inline_query):
+        observer.middleware(handler_timing)
+    bot.session.middleware(RequestTimingMiddleware())
+
+
+# --- S3 (хуки подій botocore; працюють і для boto3, і для aiobotocore) ---
+
+def _before_s3_call(model=None, context=None, **kwargs):
+    if context is not None:
+        # after-call-error не отримує model, тому назву операції зберігаємо тут
+        context['crm_operation'] = model.name if model else ''
+        context['crm_started'] = time.perf_counter()
+
+
+def _after_s3_call(context=None, exception=None, **kwargs):
+    started = (context or {}).get('crm_started')
+    if started is not None:
+        S3_LATENCY.observe(
+            time.perf_counter() - started,
+            operation=context['crm_operation'],
+            outcome='error' if exception is not None else 'ok',
+        )
+
+
+def instrument_s3_client(client):
+    events = client.meta.events
+    events.register('before-call.s3', _before_s3_call)
+    events.register('after-call.s3', _after_s3_call)
+    events.register('after-call-error.s3', _after_s3_call)
+    return client
+
+
+# --- HTTP-ЕНДПОІНТ ---
+
+async def handle_metrics(request: web.Request) -> web.Response:
+    return web.Response(body=render_metrics().encode(), headers={"Content-Type": CONTENT_TYPE})
+
+
+async def start_server(host: str, port: int, routes: Sequence[web.RouteDef] = ()) -> web.AppRunner:
+    """
+    Окремий локальний HTTP-сервер з /metrics (не публікується разом з webhook)
+    та додатковими службовими маршрутами (health-проби).
+    """
+    app = web.Application()
+    app.router.add_get("/metrics", handle_metrics)
+    app.add_routes(routes)
+    runner = web.AppRunner(app)
+    await runner.setup()
+    await web.TCPSite(runner, host=host, port=port).start()
+    logging.info(f"Metrics endpoint listening on {host}:{port}/metrics")
+    return runner
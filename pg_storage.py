@@ -0,0 +1,172 @@
+import asyncio
+import copy
+import logging
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from typing import Any, AsyncGenerator, Dict, Optional, Set, Tuple
+
+from aiogram.fsm.state import State
+from aiogram.fsm.storage.base import BaseEventIsolation, BaseStorage, StateType, StorageKey
+
+import database as db
+
+logging.basicConfig(level=logging.INFO)
+
+# Буфер поточного оновлення (див. UpdateScope)
+_update_buffer: ContextVar[Optional['_UpdateBuffer']] = ContextVar('fsm_update_buffer', default=None)
+
+
+def _state_name(state: StateType) -> Optional[str]:
+    return state.state if isinstance(state, State) else state
+
+
+def _storage_key(key: StorageKey) -> str:
+    """Рядковий ключ розмови: бот, чат, користувач, тема та destiny."""
+    parts = [
+        key.bot_id, key.chat_id, key.user_id,
+        getattr(key, 'thread_id', None),
+        getattr(key, 'business_connection_id', None),
+        key.destiny,
+    ]
+    return ":".join('' if part is None else str(part) for part in parts)
+
+
+class _UpdateBuffer:
+    """
+    Стан розмов у межах одного оновлення: ключ -> {'state': ..., 'data': ...}
+    (лише прочитані або записані поля) та ще не збережені зміни.
+    """
+
+    def __init__(self):
+        self.entries: Dict[str, Dict[str, Any]] = {}
+        # ключ -> (сховище, змінені поля)
+        self.dirty: Dict[str, Tuple['PostgresStorage', Set[str]]] = {}
+
+    async def flush(self):
+        for key, (storage, fields) in self.dirty.items():
+            await storage._write(key, self.entries[key], fields)
+        self.dirty.clear()
+
+
+class UpdateScope(BaseEventIsolation):
+    """
+    Ізоляція подій для Dispatcher: FSMContextMiddleware обгортає нею читання
+    стану та обробник оновлення. Усе оновлення PostgresStorage читає розмову
+    з БД щонайбільше раз, а зміни стану й даних зберігає одним запитом після
+    обробника. Між оновленнями стан завжди читається з БД: наступне оновлення
+    користувача може обробити інша репліка.
+    """
+
+    @asynccontextmanager
+    async def lock(self, key: StorageKey) -> AsyncGenerator[None, None]:
+        buffer = _UpdateBuffer()
+        token = _update_buffer.set(buffer)
+        try:
+            yield
+        finally:
+            _update_buffer.reset(token)
+            await buffer.flush()
+
+    async def close(self) -> None:
+        pass
+
+
+class PostgresStorage(BaseStorage):
+    """
+    FSM-сховище в PostgreSQL на спільному пулі asyncpg (db.db_pool).
+    Дозволяє кільком процесам бота обслуговувати тих самих користувачів.
+    Стан і дані зберігаються в одному рядку fsm_storage; у межах одного
+    оновлення (див. UpdateScope) повторні читання не звертаються до БД,
+    а зміни записуються разом після обробника.
+    """
+
+    def __init__(self, state_ttl: float = 86400.0, cleanup_interval: float = 600.0):
+        self.state_ttl = state_ttl
+        self.cleanup_interval = cleanup_interval
+        self._cleanup_task: Optional[asyncio.Task] = None
+
+    def start(self):
+        """Запускає фонове видалення покинутих розмов."""
+        if self._cleanup_task is None:
+            self._cleanup_task = asyncio.create_task(self._cleanup_loop())
+
+    async def close(self):
+        if self._cleanup_task:
+            self._cleanup_task.cancel()
+            self._cleanup_task = None
+
+    def _pool(self):
+        if not db.db_pool:
+            raise Exception("Database pool is not initialized.")
+        return db.db_pool
+
+    async def _load(self, key: str, field: str) -> Any:
+        buffer = _update_buffer.get()
+        entry = buffer.entries.get(key) if buffer is not None else None
+        if entry is not None and field in entry:
+            return entry[field]
+        async with self._pool().acquire() as connection:
+            record = await connection.fetchrow(
+                "SELECT state, data FROM fsm_storage WHERE key = $1", key
+            )
+        loaded = {'state': record['state'], 'data': record['data'] or {}} if record else {'state': None, 'data': {}}
+        if buffer is not None:
+            buffer.entries[key] = {**loaded, **(entry or {})}
+        return loaded[field]
+
+    async def _set(self, key: str, field: str, value: Any):
+        buffer = _update_buffer.get()
+        if buffer is None:
+            # Поза оновленням диспетчера (фонові задачі, тести) — запис одразу
+            await self._write(key, {field: value}, {field})
+            return
+        buffer.entries.setdefault(key, {})[field] = value
+        buffer.dirty.setdefault(key, (self, set()))[1].add(field)
+
+    async def _write(self, key: str, entry: Dict[str, Any], fields: Set[str]):
+        """
+        Зберігає змінені поля (fields) розмови одним запитом. Розмова без стану
+        й даних (state.clear()) не потребує рядка: він видаляється, якщо й
+        незмінене поле в БД порожнє.
+        """
+        state_changed, data_changed = 'state' in fields, 'data' in fields
+        async with self._pool().acquire() as connection:
+            if entry.get('state', ...) is None and entry.get('data', ...) == {}:
+                await connection.execute("""
+                    DELETE FROM fsm_storage
+                    WHERE key = $1 AND ($2 OR state IS NULL) AND ($3 OR data = '{}'::jsonb)
+                """, key, state_changed, data_changed)
+            else:
+                await connection.execute("""
+                    INSERT INTO fsm_storage (key, state, data) VALUES ($1, $2, COALESCE($3, '{}'::jsonb))
+                    ON CONFLICT (key) DO UPDATE SET
+                        state = CASE WHEN $4 THEN EXCLUDED.state ELSE fsm_storage.state END,
+                        data = CASE WHEN $5 THEN EXCLUDED.data ELSE fsm_storage.data END,
+                        updated_at = now()
+                """, key, entry.get('state'), entry.get('data') if data_changed else None,
+                    state_changed, data_changed)
+
+    async def set_state(self, key: StorageKey, state: StateType = None) -> None:
+        await self._set(_storage_key(key), 'state', _state_name(state))
+
+    async def get_state(self, key: StorageKey) -> Optional[str]:
+        return await self._load(_storage_key(key), 'state')
+
+    async def set_data(self, key: StorageKey, data: Dict[str, Any]) -> None:
+        await self._set(_storage_key(key), 'data', copy.deepcopy(data))
+
+    async def get_data(self, key: StorageKey) -> Dict[str, Any]:
+        return copy.deepcopy(await self._load(_storage_key(key), 'data'))
+
+    async def _cleanup_loop(self):
+        while True:
+            await asyncio.sleep(self.cleanup_interval)
+            try:
+                async with self._pool().acquire() as connection:
+                    result = await connection.execute("""
+                        DELETE FROM fsm_storage
+                        WHERE updated_at < now() - make_interval(secs => $1)
+                    """, self.state_ttl)
+                logging.info(f"FSM storage cleanup: {result}")
+            except Exception as e:
+                logging.error(f"FSM storage cleanup failed: {e}")
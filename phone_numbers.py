@@ -0,0 +1,95 @@
+import re
+from functools import lru_cache
+from typing import Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+from config import settings
+
+
+class CountryRule(NamedTuple):
+    calling_code: str           # Код країни без '+'
+    trunk_prefix: str           # Префікс міжміського набору всередині країни
+    nsn_lengths: Tuple[int, ...]  # Довжина національного номера (без коду та префікса)
+    legacy_prefix: str = ''     # Застарілий префікс перед trunk_prefix («8 0..» в Україні)
+
+
+# Правила країн, з яких найчастіше приходять клієнти. Номери інших країн
+# розпізнаються лише у міжнародному форматі (+... або 00...).
+COUNTRY_RULES: Dict[str, CountryRule] = {
+    'UA': CountryRule('380', '0', (9,), legacy_prefix='8'),
+    'PL': CountryRule('48', '', (9,)),
+    'MD': CountryRule('373', '0', (8,)),
+    'RO': CountryRule('40', '0', (9,)),
+    'DE': CountryRule('49', '0', (10, 11)),
+    'GB': CountryRule('44', '0', (10,)),
+    'US': CountryRule('1', '1', (10,)),
+}
+
+# E.164: не більше 15 цифр разом із кодом країни
+E164_MIN_DIGITS = 8
+E164_MAX_DIGITS = 15
+
+# Швидкий шлях: номер уже в канонічному вигляді
+_CANONICAL = re.compile(r'\+[1-9][0-9]{%d,%d}' % (E164_MIN_DIGITS - 1, E164_MAX_DIGITS - 1))
+_NON_DIGITS = re.compile(r'[^0-9+]')
+
+
+def _country_rule(country: Optional[str]) -> Optional[CountryRule]:
+    return COUNTRY_RULES.get((country or settings.DEFAULT_PHONE_COUNTRY).upper())
+
+
+def _international(digits: str) -> Optional[str]:
+    if E164_MIN_DIGITS <= len(digits) <= E164_MAX_DIGITS and digits[0] != '0':
+        return '+' + digits
+    return None
+
+
+@lru_cache(maxsize=8192)
+def _canonicalize(raw_number: str, country: Optional[str]) -> Optional[str]:
+    cleaned = _NON_DIGITS.sub('', raw_number)
+    if cleaned.startswith('+'):
+        return _international(cleaned.replace('+', ''))
+    digits = cleaned.replace('+', '')
+    if digits.startswith('00'):
+        return _international(digits[2:])
+
+    rule = _country_rule(country)
+    if rule is None:
+        return None
+    code, trunk = rule.calling_code, rule.trunk_prefix
+    legacy = rule.legacy_prefix + trunk
+    if (rule.legacy_prefix and digits.startswith(legacy)
+            and len(digits) - len(legacy) in rule.nsn_lengths):
+        # 80501234567 -> 0501234567
+        digits = digits[len(rule.legacy_prefix):]
+    for nsn_length in rule.nsn_lengths:
+        # 380501234567
+        if len(digits) == len(code) + nsn_length and digits.startswith(code):
+            return '+' + digits
+        # 0501234567
+        if trunk and len(digits) == len(trunk) + nsn_length and digits.startswith(trunk):
+            return '+' + code + digits[len(trunk):]
+        # 501234567
+        if len(digits) == nsn_length:
+            return '+' + code + digits
+    return None
+
+
+def canonicalize(raw_number: str, country: Optional[str] = None) -> Optional[str]:
+    """
+    Зводить номер до E.164 ('+380501234567'). Номер без коду країни
+    розбирається за правилами country (за замовчуванням DEFAULT_PHONE_COUNTRY).
+    Повертає None, якщо рядок не схожий на повний номер.
+    """
+    if _CANONICAL.fullmatch(raw_number):
+        return raw_number
+    return _canonicalize(raw_number, country)
+
+
+def canonicalize_many(raw_numbers: Iterable[str], country: Optional[str] = None) -> List[Optional[str]]:
+    """Пакетна версія canonicalize: результат у тому ж порядку, що й вхідні номери."""
+    return [canonicalize(raw_number, country) for raw_number in raw_numbers]
+
+
+def phone_key(number: str) -> str:
+    """Ключ пошуку (client_phones.digits): лише цифри канонічного номера."""
+    return number.lstrip('+')
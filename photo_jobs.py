@@ -0,0 +1,136 @@
+import asyncio
+import logging
+from typing import Any, Dict, List, Optional
+
+from aiogram import Bot
+
+from config import settings
+import database as db
+import s3_storage
+import storage_gc
+import face_embedding
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+
+
+class PhotoJobWorker:
+    """
+    Воркери черги photo_jobs: завантажують фото з Telegram у Spaces і додають
+    URL до клієнта. Невдалі спроби повторюються з експоненційною затримкою,
+    після max_attempts задача переходить у статус dead.
+    """
+
+    def __init__(self, bot: Bot, concurrency: int = 2, poll_interval: float = 2.0,
+                 max_attempts: int = 5, backoff: float = 5.0, max_backoff: float = 600.0,
+                 lease: float = 120.0):
+        self.bot = bot
+        self.concurrency = concurrency
+        self.poll_interval = poll_interval
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.lease = lease
+        self._wakeup = asyncio.Event()
+        self._tasks: List[asyncio.Task] = []
+
+    def start(self):
+        self._tasks = [asyncio.create_task(self._run()) for _ in range(self.concurrency)]
+        logging.info(f"Photo job workers started: {self.concurrency}.")
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def wake(self):
+        """Будить воркерів, щойно в цьому процесі з'явилася нова задача."""
+        self._wakeup.set()
+
+    async def _run(self):
+        while True:
+            try:
+                jobs = await db.claim_photo_jobs(1, self.lease)
+            except Exception as e:
+                logging.error(f"Failed to claim photo jobs: {e}")
+                jobs = []
+
+            if not jobs:
+                self._wakeup.clear()
+                try:
+                    await asyncio.wait_for(self._wakeup.wait(), self.poll_interval)
+                except asyncio.TimeoutError:
+                    pass
+                continue
+
+            for job in jobs:
+                try:
+                    await self._process(job)
+                except Exception as e:
+                    # Воркер не повинен зупинятися: задачу з простроченою орендою
+                    # підхопить наступний claim_photo_jobs
+                    logging.error(f"Photo job {job['id']} left leased after error: {e}")
+
+    async def _process(self, job: Dict[str, Any]):
+        try:
+            with metrics.PHOTO_JOB_STAGE.time(stage='download'):
+                data = await s3_storage.download_telegram_file(self.bot, job['file_id'])
+            with metrics.PHOTO_JOB_STAGE.time(stage='ingest'):
+                stored = await s3_storage.ingest_photo(data)
+            if not stored:
+                raise RuntimeError("upload to Spaces failed")
+            variants = stored.urls
+
+            # Якщо клієнта вже видалили, задача просто завершується
+            with metrics.PHOTO_JOB_STAGE.time(stage='attach'):
+                client = await db.append_client_photo(job['client_id'], variants['original'], variants)
+                if client and stored.reused:
+                    # Знайдений за хешем об'єкт міг саме видалятися GC до прив'язки
+                    await storage_gc.wait_for_sweeps(list(variants.values()))
+                    if not await s3_storage.ensure_photo_stored(data, variants):
+                        raise RuntimeError("restoring reused photo in Spaces failed")
+            if client:
+                face_embedding.submit(job['client_id'], data)
+                # Вхідний file_id дозволяє показувати це фото без звернення до Spaces
+                await db.save_photo_file_ids({variants['original']: job['file_id']})
+            await db.complete_photo_job(job['id'])
+        except Exception as e:
+            delay = min(self.backoff * 2 ** (job['attempts'] - 1), self.max_backoff)
+            try:
+                status = await db.fail_photo_job(job['id'], str(e), self.max_attempts, delay)
+            except Exception as fail_error:
+                logging.error(f"Photo job {job['id']} failed ({e}), and recording the failure failed too: {fail_error}")
+                return
+            logging.error(f"Photo job {job['id']} failed (attempt {job['attempts']}, now {status}): {e}")
+
+
+# Глобальний пул воркерів процесу
+worker: Optional[PhotoJobWorker] = None
+
+def start_worker(bot: Bot):
+    global worker
+    if worker:
+        return
+    worker = PhotoJobWorker(
+        bot,
+        concurrency=settings.PHOTO_JOB_WORKERS,
+        poll_interval=settings.PHOTO_JOB_POLL_INTERVAL,
+        max_attempts=settings.PHOTO_JOB_MAX_ATTEMPTS,
+        backoff=settings.PHOTO_JOB_BACKOFF,
+        lease=settings.PHOTO_JOB_LEASE,
+    )
+    worker.start()
+
+async def stop_worker():
+    global worker
+    if worker:
+        await worker.stop()
+        worker = None
+
+async def enqueue(client_id: int, file_id: str, owner_id: Optional[int] = None) -> Optional[int]:
+    """Ставить фото в чергу та будить локальних воркерів. None — клієнта не знайдено."""
+    job_id = await db.enqueue_photo_job(client_id, file_id, owner_id)
+    if job_id and worker:
+        worker.wake()
+    return job_id
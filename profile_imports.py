@@ -0,0 +1,115 @@
+"""
+Профіль часу імпорту (python -X importtime) для перевірки холодного старту в CI.
+
+    python profile_imports.py                      # звіт для main
+    python profile_imports.py --budget-ms 800 --json importtime.json
+
+Завершується з кодом 1, якщо імпорт перевищує --budget-ms або підтягує
+модулі з --forbid (за замовчуванням — SDK S3, які мають імпортуватися ліниво).
+"""
+import argparse
+import json
+import os
+import re
+import subprocess
+import sys
+from typing import Dict, List
+
+# Рядок stderr: "import time:       412 |       1650 |   asyncpg.pool"
+_LINE = re.compile(r'^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)')
+
+DEFAULT_FORBIDDEN = ('boto3', 'botocore', 'aiobotocore')
+
+# Заглушки обов'язкових змінних: імпорт не повинен їх перевіряти (див. Settings.validate)
+_PLACEHOLDER_ENV = {
+    'BOT_TOKEN': '123456:importtime',
+    'DATABASE_URL': 'postgresql://localhost/importtime',
+    'API_ID': '0',
+    'API_HASH': 'importtime',
+}
+
+
+def profile(module: str) -> List[Dict]:
+    """Імпортує module в окремому інтерпретаторі та повертає записи importtime."""
+    env = {**_PLACEHOLDER_ENV, **os.environ}
+    result = subprocess.run(
+        [sys.executable, '-X', 'importtime', '-c', f'import {module}'],
+        capture_output=True, text=True, env=env, cwd=os.path.dirname(os.path.abspath(__file__)),
+    )
+    if result.returncode != 0:
+        sys.stderr.write(result.stderr)
+        raise SystemExit(f"import {module} failed")
+
+    records = []
+    for line in result.stderr.splitlines():
+        match = _LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            records.append({
+                'module': name,
+                'self_ms': int(self_us) / 1000,
+                'cumulative_ms': int(cumulative_us) / 1000,
+                # Вкладеність: importtime зсуває залежні модулі на 2 пробіли
+                'depth': (len(indent) - 1) // 2,
+            })
+    return records
+
+
+def summarize(records: List[Dict], top: int) -> Dict:
+    # Верхній рівень (depth 0) — модулі, імпортовані безпосередньо; їх сума — весь імпорт
+    total_ms = sum(record['cumulative_ms'] for record in records if record['depth'] == 0)
+    packages: Dict[str, float] = {}
+    for record in records:
+        package = record['module'].split('.')[0]
+        packages[package] = packages.get(package, 0.0) + record['self_ms']
+    return {
+        'total_ms': total_ms,
+        'modules': len(records),
+        'top_cumulative': sorted(records, key=lambda r: r['cumulative_ms'], reverse=True)[:top],
+        'packages_self_ms': dict(sorted(packages.items(), key=lambda item: item[1], reverse=True)[:top]),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Профіль часу імпорту модулів бота.")
+    parser.add_argument('module', nargs='?', default='main')
+    parser.add_argument('--top', type=int, default=25)
+    parser.add_argument('--budget-ms', type=float, help="Максимальний сумарний час імпорту")
+    parser.add_argument('--forbid', default=','.join(DEFAULT_FORBIDDEN),
+                        help="Пакети, які не повинні імпортуватися (через кому, порожньо — без перевірки)")
+    parser.add_argument('--json', help="Зберегти звіт у JSON-файл")
+    args = parser.parse_args()
+
+    records = profile(args.module)
+    report = summarize(records, args.top)
+
+    forbidden = {name.strip() for name in args.forbid.split(',') if name.strip()}
+    report['forbidden_imported'] = sorted({
+        record['module'] for record in records if record['module'].split('.')[0] in forbidden
+    })
+
+    print(f"import {args.module}: {report['total_ms']:.1f}ms, {report['modules']} modules")
+    print(f"\n{'cumulative':>12} {'self':>9}  module")
+    for record in report['top_cumulative']:
+        print(f"{record['cumulative_ms']:>10.1f}ms {record['self_ms']:>7.1f}ms  "
+              f"{'  ' * record['depth']}{record['module']}")
+    print(f"\n{'self':>12}  package")
+    for package, self_ms in report['packages_self_ms'].items():
+        print(f"{self_ms:>10.1f}ms  {package}")
+
+    if args.json:
+        with open(args.json, 'w', encoding='utf-8') as file:
+            json.dump(report, file, ensure_ascii=False, indent=2)
+
+    failures = []
+    if report['forbidden_imported']:
+        failures.append(f"eagerly imported: {', '.join(report['forbidden_imported'])}")
+    if args.budget_ms is not None and report['total_ms'] > args.budget_ms:
+        failures.append(f"import time {report['total_ms']:.1f}ms exceeds budget {args.budget_ms:.1f}ms")
+    if failures:
+        print("\nFAIL: " + "; ".join(failures))
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -1,19 +1,153 @@
-import boto3
 from config import settings
 from io import BytesIO
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import AsyncExitStack
+from datetime import datetime
+from typing import AsyncIterator, Dict, List, NamedTuple, Optional, Tuple
+import hashlib
+import importlib
+import importlib.util
 import logging
 import os
+import threading
 import asyncio # КЛЮЧОВИЙ ІМПОРТ
 
+import metrics
+
+# Нативний async-клієнт S3 (необов'язковий: без нього працює шлях через boto3 у потоці).
+# boto3/aiobotocore імпортуються лише при першому зверненні до Spaces: їх імпорт
+# займає помітну частку холодного старту.
+HAS_ASYNC_CLIENT = importlib.util.find_spec('aiobotocore') is not None
+
+# Pillow потрібен для мініатюр; без нього зберігається лише оригінал
+try:
+    from PIL import Image, ImageOps
+except ImportError:
+    Image = None
+    ImageOps = None
+
 logging.basicConfig(level=logging.INFO)
 
-# Ініціалізація клієнта S3 для DigitalOcean Spaces
-s3_client = boto3.client(
-    's3',
-    endpoint_url=settings.SPACES_ENDPOINT_URL,
-    aws_access_key_id=settings.SPACES_ACCESS_KEY,
-    aws_secret_access_key=settings.SPACES_SECRET_KEY
+# Клієнт S3 для DigitalOcean Spaces (створюється в get_client)
+_client = None
+_client_lock = threading.Lock()
+
+TELEGRAM_CHUNK_SIZE = 64 * 1024
+
+# Сигнатури форматів, які надсилає Telegram
+_CONTENT_SIGNATURES = (
+    (b'\xff\xd8\xff', 'image/jpeg'),
+    (b'\x89PNG\r\n\x1a\n', 'image/png'),
+    (b'GIF87a', 'image/gif'),
+    (b'GIF89a', 'image/gif'),
 )
+_EXTENSIONS = {
+    'image/jpeg': '.jpg',
+    'image/png': '.png',
+    'image/gif': '.gif',
+    'image/webp': '.webp',
+}
+
+# Похідні зображення: назва -> максимальна сторона в пікселях
+PHOTO_VARIANTS = {
+    'thumb': settings.PHOTO_THUMB_SIZE,
+    'preview': settings.PHOTO_PREVIEW_SIZE,
+}
+
+_async_client = None
+_image_executor: Optional[ThreadPoolExecutor] = None
+_async_client_stack: Optional[AsyncExitStack] = None
+# Перші одночасні виклики get_async_client мають створити один клієнт, а не кілька
+_async_client_lock = asyncio.Lock()
+_upload_slots: Optional[asyncio.Semaphore] = None
+
+
+def detect_content_type(head: bytes) -> str:
+    """Визначає MIME-тип за першими байтами файлу."""
+    for signature, content_type in _CONTENT_SIGNATURES:
+        if head.startswith(signature):
+            return content_type
+    if head[:4] == b'RIFF' and head[8:12] == b'WEBP':
+        return 'image/webp'
+    return 'application/octet-stream'
+
+
+def _slots() -> asyncio.Semaphore:
+    """Обмежує кількість одночасних завантажень (створюється в робочому циклі подій)."""
+    global _upload_slots
+    if _upload_slots is None:
+        _upload_slots = asyncio.Semaphore(settings.SPACES_MAX_CONCURRENT_UPLOADS)
+    return _upload_slots
+
+
+def get_client():
+    """
+    Синхронний boto3-клієнт: boto3 імпортується, а клієнт створюється при
+    першому виклику. Потокобезпечний (викликається з asyncio.to_thread).
+    """
+    global _client
+    if _client is None:
+        with _client_lock:
+            if _client is None:
+                import boto3
+                client = boto3.client(
+                    's3',
+                    endpoint_url=settings.SPACES_ENDPOINT_URL,
+                    aws_access_key_id=settings.SPACES_ACCESS_KEY,
+                    aws_secret_access_key=settings.SPACES_SECRET_KEY
+                )
+                metrics.instrument_s3_client(client)
+                _client = client
+    return _client
+
+
+async def get_async_client():
+    """Повертає спільний aiobotocore-клієнт із пулом з'єднань."""
+    global _async_client, _async_client_stack
+    if _async_client is not None:
+        return _async_client
+    async with _async_client_lock:
+        if _async_client is None:
+            from aiobotocore.config import AioConfig
+            from aiobotocore.session import get_session
+
+            stack = AsyncExitStack()
+            client = await stack.enter_async_context(
+                get_session().create_client(
+                    's3',
+                    endpoint_url=settings.SPACES_ENDPOINT_URL,
+                    aws_access_key_id=settings.SPACES_ACCESS_KEY,
+                    aws_secret_access_key=settings.SPACES_SECRET_KEY,
+                    config=AioConfig(max_pool_connections=settings.SPACES_MAX_POOL_CONNECTIONS),
+                )
+            )
+            metrics.instrument_s3_client(client)
+            _async_client_stack, _async_client = stack, client
+    return _async_client
+
+
+async def init_client():
+    """
+    Готує клієнт Spaces заздалегідь і перевіряє доступ до бакета. Важкий
+    імпорт виконується в потоці, тож його можна запускати паралельно з init_db.
+    """
+    if HAS_ASYNC_CLIENT:
+        await asyncio.to_thread(importlib.import_module, 'aiobotocore.session')
+        client = await get_async_client()
+        await client.head_bucket(Bucket=settings.SPACES_BUCKET_NAME)
+    else:
+        client = await asyncio.to_thread(get_client)
+        await asyncio.to_thread(client.head_bucket, Bucket=settings.SPACES_BUCKET_NAME)
+    logging.info("INFO: Spaces client initialized.")
+
+
+async def close_async_client():
+    global _async_client, _async_client_stack
+    if _async_client_stack:
+        await _async_client_stack.aclose()
+    _async_client = None
+    _async_client_stack = None
+
 
 def get_photo_url(filename: str) -> str:
     """Формує публічну URL-адресу файлу."""
@@ -21,6 +155,50 @@ def get_photo_url(filename: str) -> str:
     return f"{endpoint}/{settings.SPACES_BUCKET_NAME}/{filename}"
 
 
+def key_from_url(url: str) -> Optional[str]:
+    """Зворотне до get_photo_url: ключ об'єкта або None для чужих URL."""
+    prefix = get_photo_url('')
+    return url[len(prefix):] if url.startswith(prefix) else None
+
+
+async def delete_objects(keys: List[str]) -> List[str]:
+    """Видаляє до 1000 об'єктів одним запитом. Повертає ключі, які вдалося видалити."""
+    if not keys:
+        return []
+    request = {
+        'Bucket': settings.SPACES_BUCKET_NAME,
+        'Delete': {'Objects': [{'Key': key} for key in keys], 'Quiet': True},
+    }
+    if HAS_ASYNC_CLIENT:
+        client = await get_async_client()
+        response = await client.delete_objects(**request)
+    else:
+        response = await asyncio.to_thread(get_client().delete_objects, **request)
+
+    failed = {error['Key'] for error in response.get('Errors', [])}
+    for error in response.get('Errors', []):
+        logging.error(f"Failed to delete {error['Key']} from Spaces: {error.get('Message')}")
+    return [key for key in keys if key not in failed]
+
+
+async def list_objects(prefix: str = '') -> AsyncIterator[Tuple[str, datetime]]:
+    """Посторінково перебирає об'єкти бакета: пари (ключ, LastModified)."""
+    params = {'Bucket': settings.SPACES_BUCKET_NAME, 'Prefix': prefix}
+    while True:
+        if HAS_ASYNC_CLIENT:
+            client = await get_async_client()
+            response = await client.list_objects_v2(**params)
+        else:
+            response = await asyncio.to_thread(get_client().list_objects_v2, **params)
+
+        for item in response.get('Contents', []):
+            yield item['Key'], item['LastModified']
+
+        if not response.get('IsTruncated'):
+            return
+        params['ContinuationToken'] = response['NextContinuationToken']
+
+
 async def upload_photo_to_spaces(file_data: BytesIO, filename: str) -> str:
     """
     Завантажує файл на DigitalOcean Spaces у неблокуючому режимі 
@@ -28,14 +206,16 @@ async def upload_photo_to_spaces(file_data: BytesIO, filename: str) -> str:
     """
     try:
         file_data.seek(0)
+        content_type = detect_content_type(file_data.read(16))
+        file_data.seek(0)
         
         # ВИКОРИСТАННЯ asyncio.to_thread для безпечного виклику блокуючого boto3
         await asyncio.to_thread(
-            s3_client.upload_fileobj,
+            get_client().upload_fileobj,
             file_data,
             settings.SPACES_BUCKET_NAME,
             filename,
-            ExtraArgs={'ACL': 'public-read', 'ContentType': 'image/jpeg'} 
+            ExtraArgs={'ACL': 'public-read', 'ContentType': content_type} 
         )
         
         logging.info(f"Successfully uploaded {filename} to Spaces.")
@@ -44,3 +224,150 @@ async def upload_photo_to_spaces(file_data: BytesIO, filename: str) -> str:
     except Exception as e:
         logging.error(f"Error uploading to Spaces: {e}")
         return None
+
+
+async def stream_telegram_file(bot, file_id: str) -> AsyncIterator[bytes]:
+    """Потік частин файлу з серверів Telegram без накопичення в BytesIO."""
+    telegram_file = await bot.get_file(file_id)
+    url = bot.session.api.file_url(bot.token, telegram_file.file_path)
+    async for chunk in bot.session.stream_content(
+        url=url, timeout=60, chunk_size=TELEGRAM_CHUNK_SIZE, raise_for_status=True
+    ):
+        yield chunk
+
+
+# --- ІНЖЕСТ: ДЕДУПЛІКАЦІЯ ЗА ХЕШЕМ ТА ПОХІДНІ ЗОБРАЖЕННЯ ---
+
+class StoredPhoto(NamedTuple):
+    urls: Dict[str, str]  # варіант -> URL (завжди містить 'original')
+    reused: bool          # фото вже було в бакеті, нічого не завантажувалося
+
+def _photo_key(content_hash: str, variant: str, extension: str) -> str:
+    """Ключ об'єкта за хешем вмісту: однакові фото мають однакові ключі."""
+    return f"photos/{content_hash[:2]}/{content_hash}/{variant}{extension}"
+
+
+def _render_variants(data: bytes) -> Dict[str, bytes]:
+    """Виконується в пулі потоків: створює JPEG-мініатюру та обмежене прев'ю."""
+    with Image.open(BytesIO(data)) as source:
+        image = ImageOps.exif_transpose(source).convert('RGB')
+
+    variants = {}
+    for name, max_side in PHOTO_VARIANTS.items():
+        resized = image.copy()
+        resized.thumbnail((max_side, max_side))
+        output = BytesIO()
+        resized.save(output, format='JPEG', quality=85, optimize=True)
+        variants[name] = output.getvalue()
+    return variants
+
+
+async def _render_variants_async(data: bytes) -> Dict[str, bytes]:
+    global _image_executor
+    if Image is None:
+        return {}
+    if _image_executor is None:
+        _image_executor = ThreadPoolExecutor(max_workers=settings.IMAGE_WORKERS)
+    loop = asyncio.get_running_loop()
+    try:
+        return await loop.run_in_executor(_image_executor, _render_variants, data)
+    except Exception as e:
+        logging.error(f"Failed to render photo variants: {e}")
+        return {}
+
+
+async def _object_exists(key: str) -> bool:
+    try:
+        if HAS_ASYNC_CLIENT:
+            client = await get_async_client()
+            await client.head_object(Bucket=settings.SPACES_BUCKET_NAME, Key=key)
+        else:
+            await asyncio.to_thread(get_client().head_object, Bucket=settings.SPACES_BUCKET_NAME, Key=key)
+        return True
+    except Exception:
+        return False
+
+
+async def _put_object(key: str, body: bytes, content_type: str):
+    async with _slots():
+        if HAS_ASYNC_CLIENT:
+            client = await get_async_client()
+            await client.put_object(
+                Bucket=settings.SPACES_BUCKET_NAME, Key=key, Body=body,
+                ACL='public-read', ContentType=content_type
+            )
+        else:
+            await asyncio.to_thread(
+                get_client().put_object, Bucket=settings.SPACES_BUCKET_NAME, Key=key, Body=body,
+                ACL='public-read', ContentType=content_type
+            )
+
+
+async def ingest_photo(data: bytes) -> Optional[StoredPhoto]:
+    """
+    Зберігає фото під ключем sha256 вмісту разом із мініатюрою та прев'ю.
+    Якщо таке фото вже є в бакеті, повторно нічого не завантажується
+    (reused=True: після прив'язки до клієнта варто викликати ensure_photo_stored).
+    Повертає StoredPhoto або None.
+    """
+    content_hash = hashlib.sha256(data).hexdigest()
+    content_type = detect_content_type(data[:16])
+    original_key = _photo_key(content_hash, 'original', _EXTENSIONS.get(content_type, ''))
+    variant_keys = {name: _photo_key(content_hash, name, '.jpg') for name in PHOTO_VARIANTS}
+
+    try:
+        if await _object_exists(original_key):
+            # Оригінал завантажується останнім, тож похідні (якщо були) вже існують
+            exists = await asyncio.gather(*(_object_exists(key) for key in variant_keys.values()))
+            urls = {name: get_photo_url(key) for (name, key), ok in zip(variant_keys.items(), exists) if ok}
+            urls['original'] = get_photo_url(original_key)
+            logging.info(f"Photo {content_hash} already stored, skipping upload.")
+            return StoredPhoto(urls, reused=True)
+
+        rendered = await _render_variants_async(data)
+        await asyncio.gather(*(
+            _put_object(variant_keys[name], body, 'image/jpeg') for name, body in rendered.items()
+        ))
+        await _put_object(original_key, data, content_type)
+    except Exception as e:
+        logging.error(f"Error ingesting photo to Spaces: {e}")
+        return None
+
+    urls = {name: get_photo_url(variant_keys[name]) for name in rendered}
+    urls['original'] = get_photo_url(original_key)
+    logging.info(f"Successfully ingested photo {content_hash} ({len(rendered)} variants).")
+    return StoredPhoto(urls, reused=False)
+
+
+async def ensure_photo_stored(data: bytes, urls: Dict[str, str]) -> bool:
+    """
+    Довантажує об'єкти фото, яких уже немає в бакеті: знайдене за хешем фото
+    могло бути в черзі GC і зникнути до того, як на нього послався клієнт.
+    Повертає True, якщо оригінал є в бакеті.
+    """
+    keys = {name: key_from_url(url) for name, url in urls.items()}
+    exists = await asyncio.gather(*(_object_exists(key) for key in keys.values()))
+    missing = [name for name, ok in zip(keys, exists) if not ok]
+    if not missing:
+        return True
+
+    logging.warning(f"Photo objects removed before reuse, uploading again: {', '.join(missing)}")
+    try:
+        rendered = await _render_variants_async(data) if any(name != 'original' for name in missing) else {}
+        await asyncio.gather(*(
+            _put_object(keys[name], rendered[name], 'image/jpeg') for name in missing if name in rendered
+        ))
+        if 'original' in missing:
+            await _put_object(keys['original'], data, detect_content_type(data[:16]))
+    except Exception as e:
+        logging.error(f"Error restoring photo in Spaces: {e}")
+        return False
+    return True
+
+
+async def download_telegram_file(bot, file_id: str) -> bytes:
+    """Завантажує файл з Telegram у пам'ять (для хешування та мініатюр)."""
+    buffer = bytearray()
+    async for chunk in stream_telegram_file(bot, file_id):
+        buffer.extend(chunk)
+    return bytes(buffer)
@@ -0,0 +1,234 @@
+import asyncio
+import logging
+import time
+from collections import deque
+from typing import Any, Deque, Dict, List, NamedTuple, Optional, Union
+
+from aiogram import Bot
+from aiogram.client.session.middlewares.base import BaseRequestMiddleware
+from aiogram.exceptions import TelegramRetryAfter
+from aiogram.methods import SendChatAction, SendMessage, TelegramMethod
+
+from config import settings
+import metrics
+
+logging.basicConfig(level=logging.INFO)
+
+# Ліміт Telegram на довжину тексту одного повідомлення
+MESSAGE_TEXT_LIMIT = 4096
+COALESCE_SEPARATOR = "\n\n"
+
+# Після стількох відер чатів неактивні (повні) відра прибираються
+MAX_IDLE_BUCKETS = 4096
+
+# Методи, що надсилають або змінюють повідомлення в чаті (на них діють ліміти Telegram)
+_SCHEDULED_PREFIXES = ('Send', 'Edit', 'Copy', 'Forward')
+
+ChatId = Union[int, str]
+
+
+class TokenBucket:
+    """Відро токенів: rate поповнень за секунду, не більше capacity (rate <= 0 — без обмежень)."""
+
+    def __init__(self, rate: float, capacity: float):
+        self.rate = rate
+        self.capacity = max(1.0, capacity)
+        self.tokens = self.capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0
+
+    def delay(self) -> float:
+        """Скільки чекати до наступного токена (0 — токен доступний зараз)."""
+        now = time.monotonic()
+        wait = max(0.0, self.blocked_until - now)
+        if self.rate <= 0:
+            return wait
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate)
+        return wait
+
+    def take(self):
+        if self.rate > 0:
+            self.tokens -= 1
+
+    def block(self, seconds: float):
+        """Flood control: жодних відправок протягом seconds (retry_after від Telegram)."""
+        self.blocked_until = max(self.blocked_until, time.monotonic() + seconds)
+
+    @property
+    def idle(self) -> bool:
+        return self.delay() == 0 and (self.rate <= 0 or self.tokens >= self.capacity)
+
+
+class _Pending(NamedTuple):
+    method: TelegramMethod
+    future: asyncio.Future
+    make_request: Any
+    bot: Bot
+    enqueued_at: float
+
+
+def _chat_of(method: TelegramMethod) -> Optional[ChatId]:
+    name = type(method).__name__
+    if isinstance(method, SendChatAction) or not name.startswith(_SCHEDULED_PREFIXES):
+        return None
+    return getattr(method, 'chat_id', None)
+
+
+def _mergeable(batch: List[_Pending], candidate: TelegramMethod) -> bool:
+    """
+    Чи можна дописати candidate до пакета текстових повідомлень: ті самі
+    параметри відправки, без entities, не більше однієї клавіатури на пакет
+    і загальна довжина в межах ліміту Telegram.
+    """
+    if type(candidate) is not SendMessage or candidate.entities:
+        return False
+    first = batch[0].method
+    for field in SendMessage.model_fields:
+        if field not in ('text', 'reply_markup') and getattr(first, field) != getattr(candidate, field):
+            return False
+    if candidate.reply_markup is not None and any(p.method.reply_markup is not None for p in batch):
+        return False
+    length = sum(len(p.method.text) for p in batch) + len(candidate.text)
+    return length + len(COALESCE_SEPARATOR) * len(batch) <= MESSAGE_TEXT_LIMIT
+
+
+def _merge(batch: List[_Pending]) -> TelegramMethod:
+    markup = next((p.method.reply_markup for p in batch if p.method.reply_markup is not None), None)
+    return batch[0].method.model_copy(update={
+        'text': COALESCE_SEPARATOR.join(p.method.text for p in batch),
+        'reply_markup': markup,
+    })
+
+
+class SendScheduler(BaseRequestMiddleware):
+    """
+    Middleware сесії бота: вихідні повідомлення кожного чату йдуть по черзі
+    через відро токенів чату та спільне відро бота, тож сплески відповідей
+    не впираються в 429. retry_after від Telegram блокує лише свій чат.
+    Кілька текстових повідомлень, що встигли накопичитися в черзі чату,
+    відправляються одним повідомленням (усі відправники отримують його Message).
+    Інші методи (getFile, answerCallbackQuery, ...) проходять без черги.
+    """
+
+    def __init__(self, global_rate: float, chat_rate: float, chat_burst: int,
+                 max_retries: int = 3, coalesce: bool = True):
+        self.chat_rate = chat_rate
+        self.chat_burst = chat_burst
+        self.max_retries = max_retries
+        self.coalesce = coalesce
+        self._global = TokenBucket(global_rate, global_rate)
+        self._buckets: Dict[ChatId, TokenBucket] = {}
+        self._queues: Dict[ChatId, Deque[_Pending]] = {}
+        self._workers: Dict[ChatId, asyncio.Task] = {}
+        self._depth = 0
+
+    async def __call__(self, make_request, bot: Bot, method: TelegramMethod):
+        chat_id = _chat_of(method)
+        if chat_id is None:
+            return await make_request(bot, method)
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues.get(chat_id)
+        if queue is None:
+            queue = self._queues[chat_id] = deque()
+            metrics.SEND_QUEUE_CHATS.set(len(self._queues))
+        queue.append(_Pending(method, future, make_request, bot, time.perf_counter()))
+        self._set_depth(1)
+        if chat_id not in self._workers:
+            self._workers[chat_id] = asyncio.create_task(self._drain(chat_id))
+        return await future
+
+    def _set_depth(self, delta: int):
+        self._depth += delta
+        metrics.SEND_QUEUE_DEPTH.set(self._depth)
+
+    def _bucket(self, chat_id: ChatId) -> TokenBucket:
+        bucket = self._buckets.get(chat_id)
+        if bucket is None:
+            if len(self._buckets) >= MAX_IDLE_BUCKETS:
+                self._prune_buckets()
+            bucket = self._buckets[chat_id] = TokenBucket(self.chat_rate, self.chat_burst)
+        return bucket
+
+    def _prune_buckets(self):
+        # Повне відро нічим не відрізняється від нового, тож його можна забути
+        for chat_id in [chat for chat, bucket in self._buckets.items()
+                        if chat not in self._workers and bucket.idle]:
+            del self._buckets[chat_id]
+
+    def _next_batch(self, queue: Deque[_Pending]) -> List[_Pending]:
+        batch = [queue.popleft()]
+        if self.coalesce and type(batch[0].method) is SendMessage and not batch[0].method.entities:
+            while queue and _mergeable(batch, queue[0].method):
+                batch.append(queue.popleft())
+        self._set_depth(-len(batch))
+        # Відправники, які вже не чекають (скасовані обробники), пропускаються
+        return [pending for pending in batch if not pending.future.done()]
+
+    async def _drain(self, chat_id: ChatId):
+        queue = self._queues[chat_id]
+        try:
+            while queue:
+                batch = self._next_batch(queue)
+                if not batch:
+                    continue
+                method = batch[0].method if len(batch) == 1 else _merge(batch)
+                if len(batch) > 1:
+                    metrics.SEND_EVENTS.inc(len(batch) - 1, event='coalesced')
+                try:
+                    result = await self._send(chat_id, batch, method)
+                except Exception as e:
+                    for pending in batch:
+                        if not pending.future.done():
+                            pending.future.set_exception(e)
+                else:
+                    for pending in batch:
+                        if not pending.future.done():
+                            pending.future.set_result(result)
+        finally:
+            del self._workers[chat_id]
+            if not queue:
+                del self._queues[chat_id]
+                metrics.SEND_QUEUE_CHATS.set(len(self._queues))
+
+    async def _acquire(self, chat_id: ChatId):
+        bucket = self._bucket(chat_id)
+        while True:
+            wait = max(bucket.delay(), self._global.delay())
+            if wait <= 0:
+                bucket.take()
+                self._global.take()
+                return
+            await asyncio.sleep(wait)
+
+    async def _send(self, chat_id: ChatId, batch: List[_Pending], method: TelegramMethod):
+        first = batch[0]
+        for attempt in range(self.max_retries + 1):
+            await self._acquire(chat_id)
+            if attempt == 0:
+                waited = time.perf_counter() - first.enqueued_at
+                metrics.SEND_QUEUE_WAIT.observe(waited, method=type(method).__name__)
+            try:
+                return await first.make_request(first.bot, method)
+            except TelegramRetryAfter as e:
+                metrics.SEND_EVENTS.inc(event='retry_after')
+                if attempt == self.max_retries:
+                    raise
+                logging.warning(f"Flood control for chat {chat_id}: retry in {e.retry_after}s")
+                self._bucket(chat_id).block(e.retry_after)
+
+
+def setup(bot: Bot) -> SendScheduler:
+    """Підключає планувальник до сесії бота з налаштувань SEND_*."""
+    scheduler = SendScheduler(
+        global_rate=settings.SEND_GLOBAL_RATE,
+        chat_rate=settings.SEND_CHAT_RATE,
+        chat_burst=settings.SEND_CHAT_BURST,
+        max_retries=settings.SEND_MAX_RETRIES,
+        coalesce=settings.SEND_COALESCE,
+    )
+    bot.session.middleware(scheduler)
+    return scheduler
@@ -0,0 +1,234 @@
+import argparse
+import asyncio
+import logging
+from datetime import datetime, timedelta, timezone
+from typing import List, Optional, Set
+
+import database as db
+import s3_storage
+
+logging.basicConfig(level=logging.INFO)
+
+# Ліміт S3 DeleteObjects на один запит
+DELETE_BATCH_SIZE = 1000
+
+# Скільки секунд захоплена прибиральником пачка вважається «у видаленні»:
+# після цього записи, які він не встиг звільнити (збій процесу), бере наступний прохід
+CLAIM_LEASE = 600.0
+
+# Варіанти з clients.photo_variants, за якими перевіряються посилання
+_VARIANT_NAMES = ('original',) + tuple(s3_storage.PHOTO_VARIANTS)
+
+
+async def sweep_once(grace_seconds: float = 300.0) -> int:
+    """
+    Видаляє з бакета одну пачку (до 1000) осиротілих об'єктів.
+    Об'єкти, на які знову посилається якийсь клієнт (однакове фото за хешем),
+    лише знімаються з черги. Повертає кількість оброблених записів.
+    """
+    if not db.db_pool:
+        raise Exception("Database pool is not initialized.")
+
+    variant_checks = "\n".join(
+        f"OR c.photo_variants @> jsonb_build_array(jsonb_build_object('{name}', u.url))"
+        for name in _VARIANT_NAMES
+    )
+
+    # Пачка захоплюється короткою транзакцією; під час виклику S3 блокувань немає
+    async with db.db_pool.acquire() as connection:
+        async with connection.transaction():
+            urls = await connection.fetchval("""
+                SELECT array_agg(url) FROM (
+                    SELECT url FROM orphaned_objects
+                    WHERE created_at < now() - make_interval(secs => $1)
+                      AND (claimed_at IS NULL OR claimed_at < now() - make_interval(secs => $3))
+                    ORDER BY created_at
+                    LIMIT $2
+                    FOR UPDATE SKIP LOCKED
+                ) AS batch
+            """, grace_seconds, DELETE_BATCH_SIZE, CLAIM_LEASE)
+            if not urls:
+                return 0
+
+            referenced = set(await connection.fetchval(f"""
+                SELECT COALESCE(array_agg(u.url), '{{}}') FROM unnest($1::text[]) AS u(url)
+                WHERE EXISTS (
+                    SELECT 1 FROM clients c
+                    WHERE c.photo_url @> jsonb_build_array(u.url)
+                    {variant_checks}
+                )
+            """, urls))
+
+            keys = {}
+            for url in urls:
+                key = s3_storage.key_from_url(url)
+                if url not in referenced and key:
+                    keys[key] = url
+
+            # Використані знову та чужі URL лише знімаються з черги, решта захоплюється
+            await connection.execute("""
+                DELETE FROM orphaned_objects
+                WHERE url = ANY($1::text[]) AND url <> ALL($2::text[])
+            """, urls, list(keys.values()))
+            claimed_at = await connection.fetchval("""
+                UPDATE orphaned_objects SET claimed_at = now()
+                WHERE url = ANY($1::text[])
+                RETURNING now()
+            """, list(keys.values()))
+
+    deleted_keys = []
+    if keys:
+        try:
+            deleted_keys = await s3_storage.delete_objects(list(keys))
+        finally:
+            # Не видалені через помилку S3 об'єкти звільняються до наступного проходу
+            # (якщо й це не вдасться, захоплення втратить силу через CLAIM_LEASE)
+            async with db.db_pool.acquire() as connection:
+                async with connection.transaction():
+                    await connection.execute("""
+                        DELETE FROM orphaned_objects
+                        WHERE url = ANY($1::text[]) AND claimed_at = $2
+                    """, [keys[key] for key in deleted_keys], claimed_at)
+                    await connection.execute("""
+                        UPDATE orphaned_objects SET claimed_at = NULL
+                        WHERE url = ANY($1::text[]) AND claimed_at = $2
+                    """, list(keys.values()), claimed_at)
+
+    processed = len(urls) - len(keys) + len(deleted_keys)
+    logging.info(f"Storage GC: deleted {len(deleted_keys)} objects, kept {len(referenced)} referenced.")
+    return processed
+
+
+async def wait_for_sweeps(urls: List[str], timeout: float = CLAIM_LEASE, interval: float = 0.5) -> bool:
+    """
+    Чекає, поки прибиральник завершить видалення цих URL, якщо він їх уже
+    захопив. Викликається після прив'язки повторно використаного фото до клієнта:
+    пізніші проходи побачать посилання, а незавершений може встигнути видалити об'єкт.
+    Повертає True, якщо довелося чекати.
+    """
+    if not db.db_pool:
+        raise Exception("Database pool is not initialized.")
+
+    waited = False
+    deadline = asyncio.get_running_loop().time() + timeout
+    while True:
+        async with db.db_pool.acquire() as connection:
+            # FOR SHARE чекає на транзакцію, що саме захоплює ці записи, і бачить її результат
+            records = await connection.fetch("""
+                SELECT url, claimed_at > now() - make_interval(secs => $2) AS claimed
+                FROM orphaned_objects
+                WHERE url = ANY($1::text[])
+                FOR SHARE
+            """, urls, CLAIM_LEASE)
+        if not any(record['claimed'] for record in records):
+            return waited
+        if asyncio.get_running_loop().time() >= deadline:
+            logging.warning(f"Storage GC still holds {len(records)} objects after {timeout}s.")
+            return waited
+        waited = True
+        await asyncio.sleep(interval)
+
+
+async def _referenced_keys() -> Set[str]:
+    """Ключі всіх об'єктів, на які посилаються клієнти."""
+    async with db.db_pool.acquire() as connection:
+        records = await connection.fetch("""
+            SELECT url FROM clients, jsonb_array_elements_text(
+                CASE WHEN jsonb_typeof(photo_url) = 'array' THEN photo_url ELSE '[]'::jsonb END
+            ) AS url
+            UNION
+            SELECT variant.value FROM clients,
+                jsonb_array_elements(photo_variants) AS item,
+                jsonb_each_text(item) AS variant
+        """)
+    keys = (s3_storage.key_from_url(record['url']) for record in records)
+    return {key for key in keys if key}
+
+
+async def reconcile(enqueue: bool = False, grace_seconds: float = 3600.0, prefix: str = '') -> List[str]:
+    """
+    Звіряє вміст бакета з БД і повертає ключі, на які не посилається жоден клієнт.
+    Нещодавні об'єкти пропускаються: їх може саме зараз обробляти воркер фото.
+    З enqueue=True знайдені ключі додаються до orphaned_objects для sweep_once.
+    """
+    referenced = await _referenced_keys()
+    cutoff = datetime.now(timezone.utc) - timedelta(seconds=grace_seconds)
+
+    orphans = []
+    async for key, last_modified in s3_storage.list_objects(prefix):
+        if key not in referenced and last_modified < cutoff:
+            orphans.append(key)
+
+    if enqueue and orphans:
+        async with db.db_pool.acquire() as connection:
+            await connection.execute("""
+                INSERT INTO orphaned_objects (url)
+                SELECT * FROM unnest($1::text[])
+                ON CONFLICT DO NOTHING
+            """, [s3_storage.get_photo_url(key) for key in orphans])
+
+    logging.info(f"Storage reconcile: {len(orphans)} unreferenced objects found.")
+    return orphans
+
+
+class OrphanSweeper:
+    """Фоновий прибиральник: періодично викликає sweep_once, поки черга не спорожніє."""
+
+    def __init__(self, interval: float = 300.0, grace_seconds: float = 300.0):
+        self.interval = interval
+        self.grace_seconds = grace_seconds
+        self._task: Optional[asyncio.Task] = None
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            await asyncio.gather(self._task, return_exceptions=True)
+            self._task = None
+
+    async def _run(self):
+        while True:
+            try:
+                while await sweep_once(self.grace_seconds) == DELETE_BATCH_SIZE:
+                    pass
+            except Exception as e:
+                logging.error(f"Storage GC sweep failed: {e}")
+            await asyncio.sleep(self.interval)
+
+
+async def _main(args: argparse.Namespace):
+    await db.init_db()
+    try:
+        if args.command == 'sweep':
+            total = 0
+            while True:
+                processed = await sweep_once(args.grace)
+                total += processed
+                if processed < DELETE_BATCH_SIZE:
+                    break
+            print(f"Processed {total} orphaned objects.")
+        else:
+            orphans = await reconcile(enqueue=args.enqueue, grace_seconds=args.grace, prefix=args.prefix)
+            for key in orphans:
+                print(key)
+    finally:
+        await s3_storage.close_async_client()
+        await db.close_db()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Прибирання осиротілих об'єктів у Spaces.")
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    sweep_parser = subparsers.add_parser('sweep', help="Видалити об'єкти з черги orphaned_objects")
+    sweep_parser.add_argument('--grace', type=float, default=0.0, help="Мінімальний вік запису, с")
+
+    reconcile_parser = subparsers.add_parser('reconcile', help="Знайти об'єкти без посилань у БД")
+    reconcile_parser.add_argument('--enqueue', action='store_true', help="Додати знайдені до черги видалення")
+    reconcile_parser.add_argument('--grace', type=float, default=3600.0, help="Мінімальний вік об'єкта, с")
+    reconcile_parser.add_argument('--prefix', default='', help="Префікс ключів для перевірки")
+
+    asyncio.run(_main(parser.parse_args()))
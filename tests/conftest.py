@@ -0,0 +1,163 @@
+import asyncio
+import inspect
+import os
+import sys
+from datetime import datetime, timezone
+from typing import Dict, Tuple
+
+import asyncpg
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from config import settings
+import database as db
+import s3_storage
+
+
+@pytest.fixture(autouse=True)
+def event_loop():
+    loop = asyncio.new_event_loop()
+    yield loop
+    loop.close()
+
+
+def pytest_pyfunc_call(pyfuncitem):
+    """Асинхронні тести виконуються в циклі подій фікстури event_loop (без pytest-asyncio)."""
+    if inspect.iscoroutinefunction(pyfuncitem.obj):
+        arguments = {name: pyfuncitem.funcargs[name] for name in pyfuncitem._fixtureinfo.argnames}
+        pyfuncitem.funcargs['event_loop'].run_until_complete(pyfuncitem.obj(**arguments))
+        return True
+    return None
+
+
+# --- S3 ---
+
+class FakeS3Client:
+    """
+    Локальна заміна aiobotocore-клієнта Spaces: об'єкти в пам'яті, лише ті
+    виклики, які робить s3_storage. failing_keys імітують помилки DeleteObjects.
+    """
+
+    def __init__(self):
+        self.objects: Dict[str, Tuple[bytes, str, datetime]] = {}
+        self.failing_keys = set()
+        self.calls = []
+        self.active_puts = 0
+        self.max_active_puts = 0
+        self.put_delay = 0.0
+
+    async def put_object(self, Bucket, Key, Body, ACL=None, ContentType=None):
+        self.calls.append(('put_object', Key))
+        self.active_puts += 1
+        self.max_active_puts = max(self.max_active_puts, self.active_puts)
+        try:
+            await asyncio.sleep(self.put_delay)
+            self.objects[Key] = (bytes(Body), ContentType, datetime.now(timezone.utc))
+        finally:
+            self.active_puts -= 1
+        return {'ETag': '"fake"'}
+
+    async def head_object(self, Bucket, Key):
+        self.calls.append(('head_object', Key))
+        if Key not in self.objects:
+            raise KeyError(f"NoSuchKey: {Key}")
+        body, content_type, modified = self.objects[Key]
+        return {'ContentLength': len(body), 'ContentType': content_type, 'LastModified': modified}
+
+    async def head_bucket(self, Bucket):
+        return {}
+
+    async def delete_objects(self, Bucket, Delete):
+        keys = [item['Key'] for item in Delete['Objects']]
+        self.calls.append(('delete_objects', tuple(keys)))
+        errors = []
+        for key in keys:
+            if key in self.failing_keys:
+                errors.append({'Key': key, 'Code': 'InternalError', 'Message': 'injected failure'})
+            else:
+                self.objects.pop(key, None)
+        return {'Errors': errors} if errors else {}
+
+    async def list_objects_v2(self, Bucket, Prefix='', ContinuationToken=None, MaxKeys=1000):
+        keys = sorted(key for key in self.objects if key.startswith(Prefix))
+        start = int(ContinuationToken or 0)
+        page = keys[start:start + MaxKeys]
+        response = {
+            'Contents': [{'Key': key, 'LastModified': self.objects[key][2]} for key in page],
+            'IsTruncated': start + MaxKeys < len(keys),
+        }
+        if response['IsTruncated']:
+            response['NextContinuationToken'] = str(start + MaxKeys)
+        return response
+
+
+@pytest.fixture
+def s3(monkeypatch):
+    client = FakeS3Client()
+    monkeypatch.setattr(s3_storage, 'HAS_ASYNC_CLIENT', True)
+    monkeypatch.setattr(s3_storage, '_async_client', client)
+    monkeypatch.setattr(s3_storage, '_upload_slots', None)
+    monkeypatch.setattr(settings, 'SPACES_ENDPOINT_URL', 'https://spaces.test')
+    monkeypatch.setattr(settings, 'SPACES_BUCKET_NAME', 'crm-test')
+    return client
+
+
+# --- POSTGRES ---
+# Тести з фікстурою database потребують окремої тестової БД (UTF8) з розширеннями pg_trgm
+# і btree_gin. На початку сесії схема public видаляється й усі MIGRATIONS
+# застосовуються з нуля; між тестами таблиці лише очищуються:
+#   TEST_DATABASE_URL=postgresql://localhost/crm_test
+#   TEST_REPLICA_DATABASE_URL=postgresql://localhost:5433/crm_test  # друга інстанція (необов'язково)
+
+_TABLES = ('clients', 'operators', 'orphaned_objects', 'telegram_photo_cache', 'fsm_storage')
+
+
+def _test_dsns() -> Tuple[str, ...]:
+    return tuple(filter(None, (os.getenv('TEST_DATABASE_URL'), os.getenv('TEST_REPLICA_DATABASE_URL'))))
+
+
+async def _recreate_schema(dsn: str):
+    connection = await asyncpg.connect(dsn=dsn)
+    try:
+        await connection.execute("DROP SCHEMA public CASCADE; CREATE SCHEMA public;")
+        await db._setup_connection(connection)
+        await db._run_migrations(connection)
+    finally:
+        await connection.close()
+
+
+@pytest.fixture(scope='session')
+def database_schema():
+    """Схема тестових БД, створена міграціями з порожньої бази (раз на сесію)."""
+    if not os.getenv('TEST_DATABASE_URL'):
+        pytest.skip("TEST_DATABASE_URL is not set")
+    for dsn in _test_dsns():
+        asyncio.run(_recreate_schema(dsn))
+
+
+async def _prepare(dsn: str):
+    connection = await asyncpg.connect(dsn=dsn)
+    try:
+        await db._setup_connection(connection)
+        await db._run_migrations(connection)
+        await connection.execute(f"TRUNCATE {', '.join(_TABLES)} RESTART IDENTITY CASCADE")
+    finally:
+        await connection.close()
+
+
+@pytest.fixture
+def database(database_schema, event_loop, monkeypatch):
+    dsn = os.getenv('TEST_DATABASE_URL')
+    replica_dsn = os.getenv('TEST_REPLICA_DATABASE_URL', '')
+    monkeypatch.setattr(settings, 'DATABASE_URL', dsn)
+    monkeypatch.setattr(settings, 'DATABASE_REPLICA_URL', replica_dsn)
+    monkeypatch.setattr(settings, 'DB_AUTO_MIGRATE', True)
+
+    for target in filter(None, (dsn, replica_dsn)):
+        event_loop.run_until_complete(_prepare(target))
+    db.client_cache.clear()
+    db._recent_writes.clear()
+    event_loop.run_until_complete(db.init_db())
+    yield db
+    event_loop.run_until_complete(db.close_db())
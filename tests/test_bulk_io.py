@@ -0,0 +1,64 @@
+import asyncio
+import json
+
+import asyncpg
+
+from config import settings
+import bulk_io
+
+OWNER_ID = 3003
+SPACES = "https://spaces.test/crm-test/photos"
+
+
+def _write_jsonl(path, rows):
+    path.write_text("\n".join(json.dumps(row, ensure_ascii=False) for row in rows), encoding='utf-8')
+    return str(path)
+
+
+async def _orphans(database):
+    async with database.db_pool.acquire() as connection:
+        return {record['url'] for record in await connection.fetch("SELECT url FROM orphaned_objects")}
+
+
+async def test_import_sends_one_notification(database, tmp_path):
+    rows = [{'external_id': f"ext-{index}", 'phone': f"+38050{index:07d}", 'comment': 'imported'}
+            for index in range(200)]
+    path = _write_jsonl(tmp_path / "clients.jsonl", rows)
+
+    received = []
+    listener = await asyncpg.connect(dsn=settings.DATABASE_URL)
+    await listener.add_listener(database.CLIENTS_CHANGED_CHANNEL, lambda *args: received.append(args[3]))
+    try:
+        stats = await bulk_io.import_clients(path, OWNER_ID)
+        await asyncio.sleep(0.2)
+    finally:
+        await listener.close()
+
+    assert stats['imported'] == 200
+    assert received == [database.bulk_change_payload(OWNER_ID)]
+
+
+async def test_reimport_queues_replaced_photos_for_gc(database, tmp_path):
+    kept, dropped = f"{SPACES}/kept/original.jpg", f"{SPACES}/dropped/original.jpg"
+    path = _write_jsonl(tmp_path / "first.jsonl", [
+        {'external_id': 'ext-1', 'phone': '+380501111111', 'comment': 'first', 'photo_url': [kept, dropped]},
+    ])
+    await bulk_io.import_clients(path, OWNER_ID)
+    async with database.db_pool.acquire() as connection:
+        await connection.execute("""
+            UPDATE clients SET photo_variants = $1 WHERE external_id = 'ext-1'
+        """, [
+            {'original': kept, 'thumb': f"{SPACES}/kept/thumb.jpg"},
+            {'original': dropped, 'thumb': f"{SPACES}/dropped/thumb.jpg"},
+        ])
+
+    path = _write_jsonl(tmp_path / "second.jsonl", [
+        {'external_id': 'ext-1', 'phone': '+380501111111', 'comment': 'second', 'photo_url': [kept]},
+    ])
+    await bulk_io.import_clients(path, OWNER_ID)
+
+    assert await _orphans(database) == {dropped, f"{SPACES}/dropped/thumb.jpg"}
+    async with database.db_pool.acquire() as connection:
+        record = await connection.fetchrow("SELECT photo_url, photo_variants FROM clients WHERE external_id = 'ext-1'")
+    assert record['photo_url'] == [kept]
+    assert record['photo_variants'] == [{'original': kept, 'thumb': f"{SPACES}/kept/thumb.jpg"}]
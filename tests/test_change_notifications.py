@@ -0,0 +1,72 @@
+import asyncio
+
+import asyncpg
+import pytest
+
+from config import settings
+import face_index
+
+OWNER_ID = 2002
+
+
+async def _wait_until(condition, timeout: float = 5.0):
+    deadline = asyncio.get_running_loop().time() + timeout
+    while not condition():
+        assert asyncio.get_running_loop().time() < deadline, "change notification was not applied"
+        await asyncio.sleep(0.05)
+
+
+async def test_face_index_follows_changes_from_other_replicas(database):
+    if not face_index.index.available:
+        pytest.skip("numpy is not installed")
+    embedding = face_index.encode_embedding([0.1] * face_index.EMBEDDING_DIM)
+
+    # Інший процес бота пише в БД напряму: цей процес дізнається лише через NOTIFY
+    other = await asyncpg.connect(dsn=settings.DATABASE_URL)
+    try:
+        client_id = await other.fetchval("""
+            INSERT INTO clients (owner_id, telegram_id, phone, comment, face_embedding, photo_url)
+            VALUES ($1, $1, '[]', 'other replica', $2, '[]') RETURNING id
+        """, OWNER_ID, embedding)
+        await _wait_until(lambda: face_index.index.search([0.1] * face_index.EMBEDDING_DIM, owner_id=OWNER_ID))
+        assert face_index.index.search([0.1] * face_index.EMBEDDING_DIM, owner_id=OWNER_ID)[0][0] == client_id
+
+        await other.execute("DELETE FROM clients WHERE id = $1", client_id)
+        await _wait_until(lambda: not face_index.index.search([0.1] * face_index.EMBEDDING_DIM, owner_id=OWNER_ID))
+    finally:
+        await other.close()
+
+
+async def test_client_cache_is_invalidated_by_other_replicas(database):
+    client_id = await database.add_client(OWNER_ID, OWNER_ID, [], 'before', [], [])
+    assert (await database.find_client_by_id(client_id))['comment'] == 'before'
+
+    other = await asyncpg.connect(dsn=settings.DATABASE_URL)
+    try:
+        await other.execute("UPDATE clients SET comment = 'after' WHERE id = $1", client_id)
+    finally:
+        await other.close()
+    await _wait_until(lambda: database.client_cache.get(client_id) is None)
+    assert (await database.find_client_by_id(client_id))['comment'] == 'after'
+
+
+async def test_own_changes_are_not_reapplied(database, monkeypatch):
+    refreshed = []
+    monkeypatch.setattr(database, '_schedule_face_refresh', refreshed.append)
+    client_id = await database.add_client(OWNER_ID, OWNER_ID, [], 'before', [], [])
+    await database.set_client_comment(client_id, 'after')
+    assert database.client_cache.get(client_id)['comment'] == 'after'
+
+    # Зміна іншого процесу — маркер того, що попередні повідомлення вже доставлено
+    other = await asyncpg.connect(dsn=settings.DATABASE_URL)
+    try:
+        marker_id = await other.fetchval("""
+            INSERT INTO clients (owner_id, telegram_id, phone, comment, photo_url)
+            VALUES ($1, $1, '[]', 'marker', '[]') RETURNING id
+        """, OWNER_ID)
+    finally:
+        await other.close()
+    await _wait_until(lambda: marker_id in refreshed)
+
+    assert refreshed == [marker_id]
+    assert database.client_cache.get(client_id)['comment'] == 'after'
@@ -0,0 +1,25 @@
+import importlib.util
+
+import pytest
+
+from config import settings
+
+
+@pytest.fixture
+def valid_settings(monkeypatch):
+    for name, value in (('BOT_TOKEN', '1:a'), ('DATABASE_URL', 'postgresql://x'), ('API_ID', 1), ('API_HASH', 'x'),
+                        ('BOT_MODE', 'polling')):
+        monkeypatch.setattr(settings, name, value)
+    return settings
+
+
+def test_memory_face_index_requires_numpy(valid_settings, monkeypatch):
+    find_spec = importlib.util.find_spec
+    monkeypatch.setattr(importlib.util, 'find_spec',
+                        lambda name, *args: None if name == 'numpy' else find_spec(name, *args))
+
+    monkeypatch.setattr(settings, 'FACE_INDEX_BACKEND', 'memory')
+    with pytest.raises(ValueError, match="numpy"):
+        settings.validate()
+    monkeypatch.setattr(settings, 'FACE_INDEX_BACKEND', 'pgvector')
+    settings.validate()
@@ -0,0 +1,48 @@
+import pytest
+
+import face_embedding
+import face_index
+
+OWNER_ID = 6006
+
+
+async def test_photos_are_batched_and_stored(database, monkeypatch):
+    if not face_index.index.available:
+        pytest.skip("numpy is not installed")
+    batches = []
+    process = face_embedding.EmbeddingPipeline._process
+
+    async def recorded_process(self, batch):
+        batches.append([client_id for client_id, _ in batch])
+        await process(self, batch)
+
+    monkeypatch.setattr(face_embedding.EmbeddingPipeline, '_process', recorded_process)
+
+    photos = {}
+    for i in range(5):
+        client_id = await database.add_client(OWNER_ID, OWNER_ID, [], f'face {i}', [], [])
+        photos[client_id] = f"photo {i}".encode()
+
+    async def load_last() -> bytes:
+        return photos[max(photos)]
+
+    pipeline = face_embedding.EmbeddingPipeline('stub', workers=1, batch_size=4, batch_window=0.5)
+    await pipeline.start()
+    try:
+        for client_id, data in photos.items():
+            # Останнє фото завантажується вже в пайплайні, як з Telegram
+            pipeline.submit(client_id, load_last if client_id == max(photos) else data)
+    finally:
+        await pipeline.stop()
+
+    assert batches == [list(photos)[:4], list(photos)[4:]]
+    encoder = face_embedding.StubEncoder()
+    async with database.db_pool.acquire() as connection:
+        stored = dict(await connection.fetch(
+            "SELECT id, face_embedding FROM clients WHERE owner_id = $1", OWNER_ID
+        ))
+    for client_id, data in photos.items():
+        encoding = encoder.encode(data)
+        assert stored[client_id] == face_index.encode_embedding(encoding)
+        nearest = face_index.index.search(encoding, k=1, owner_id=OWNER_ID)
+        assert nearest[0][0] == client_id
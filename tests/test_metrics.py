@@ -0,0 +1,17 @@
+import metrics
+from cache import LRUTTLCache
+
+
+def test_cache_stats_are_exported():
+    cache = LRUTTLCache(maxsize=1, ttl=60)
+    metrics.watch_cache("test", cache)
+    cache.set('a', 1)
+    cache.get('a')
+    cache.get('missing')
+    cache.set('b', 2)
+
+    lines = metrics.render_metrics().splitlines()
+    assert 'crm_cache_entries{cache="test"} 1' in lines
+    assert 'crm_cache_events_total{cache="test",event="hit"} 1' in lines
+    assert 'crm_cache_events_total{cache="test",event="miss"} 1' in lines
+    assert 'crm_cache_events_total{cache="test",event="eviction"} 1' in lines
@@ -0,0 +1,44 @@
+import asyncpg
+
+from config import settings
+
+
+async def _run_logged(database):
+    """Запускає міграції та повертає виконані ними запити."""
+    queries = []
+    connection = await asyncpg.connect(dsn=settings.DATABASE_URL)
+    try:
+        await database._setup_connection(connection)
+        connection.add_query_logger(lambda record: queries.append(record.query))
+        await database._run_migrations(connection)
+    finally:
+        await connection.close()
+    return queries
+
+
+async def test_warm_start_does_no_schema_work(database):
+    queries = await _run_logged(database)
+    assert not any('pg_advisory_lock' in query or 'CREATE' in query for query in queries)
+
+
+async def test_optional_migration_runs_once_when_enabled(database, monkeypatch):
+    calls = []
+    enabled = []
+
+    async def migration(connection):
+        calls.append(connection)
+
+    monkeypatch.setattr(database, 'MIGRATIONS', database.MIGRATIONS + [(999, 'test_optional', migration)])
+    monkeypatch.setattr(database, 'MIGRATION_CONDITIONS', {999: lambda: bool(enabled)})
+    try:
+        # Вимкнена міграція не виконується й не записується
+        await _run_logged(database)
+        assert not calls
+
+        enabled.append(True)
+        await _run_logged(database)
+        await _run_logged(database)
+        assert len(calls) == 1
+    finally:
+        async with database.db_pool.acquire() as connection:
+            await connection.execute("DELETE FROM schema_migrations WHERE version = 999")
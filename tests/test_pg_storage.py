@@ -0,0 +1,89 @@
+from aiogram.fsm.storage.base import StorageKey
+
+from pg_storage import PostgresStorage, UpdateScope
+
+KEY = StorageKey(bot_id=1, chat_id=42, user_id=42)
+
+
+async def test_replicas_see_each_others_writes(database):
+    # Два процеси бота: наступне оновлення користувача обробляє інша репліка
+    first, second = PostgresStorage(), PostgresStorage()
+    scope_a, scope_b = UpdateScope(), UpdateScope()
+
+    async with scope_a.lock(KEY):
+        assert await first.get_state(KEY) is None
+        await first.set_state(KEY, 'ClientForm:phone_and_comment')
+        await first.set_data(KEY, {'phone': ['+380501234567']})
+
+    async with scope_b.lock(KEY):
+        assert await second.get_state(KEY) == 'ClientForm:phone_and_comment'
+        assert await second.get_data(KEY) == {'phone': ['+380501234567']}
+        await second.set_state(KEY, 'ClientForm:waiting_for_new_photo')
+
+    async with scope_a.lock(KEY):
+        # Кеш попереднього оновлення на першій репліці не використовується
+        assert await first.get_state(KEY) == 'ClientForm:waiting_for_new_photo'
+
+
+async def test_reads_within_one_update_are_cached(database):
+    storage = PostgresStorage()
+    await storage.set_data(KEY, {'comment': 'a'})
+
+    async with UpdateScope().lock(KEY):
+        assert await storage.get_data(KEY) == {'comment': 'a'}
+        async with database.db_pool.acquire() as connection:
+            await connection.execute("UPDATE fsm_storage SET data = '{\"comment\": \"b\"}'::jsonb")
+        assert await storage.get_data(KEY) == {'comment': 'a'}
+
+    # Поза оновленням (або в наступному) — завжди з БД
+    assert await storage.get_data(KEY) == {'comment': 'b'}
+
+
+async def test_clear_removes_conversation(database):
+    storage = PostgresStorage()
+    async with UpdateScope().lock(KEY):
+        await storage.set_state(KEY, 'ClientForm:phone_and_comment')
+        await storage.set_data(KEY, {'phone': []})
+        await storage.set_state(KEY, None)
+        await storage.set_data(KEY, {})
+        assert await storage.get_state(KEY) is None
+        assert await storage.get_data(KEY) == {}
+    async with database.db_pool.acquire() as connection:
+        assert await connection.fetchval("SELECT count(*) FROM fsm_storage") == 0
+
+
+async def test_update_writes_state_and_data_in_one_query(database, monkeypatch):
+    storage = PostgresStorage()
+    writes = []
+    write = storage._write
+
+    async def counted_write(key, entry, fields):
+        writes.append(set(fields))
+        await write(key, entry, fields)
+
+    monkeypatch.setattr(storage, '_write', counted_write)
+
+    async with UpdateScope().lock(KEY):
+        assert await storage.get_state(KEY) is None
+        await storage.set_state(KEY, 'ClientForm:phone_and_comment')
+        await storage.set_data(KEY, {'phone': []})
+        await storage.set_data(KEY, {'phone': ['+380501234567']})
+        # Зміни ще не збережені: інша репліка побачить їх після обробника
+        async with database.db_pool.acquire() as connection:
+            assert await connection.fetchval("SELECT count(*) FROM fsm_storage") == 0
+
+    assert writes == [{'state', 'data'}]
+    async with database.db_pool.acquire() as connection:
+        record = await connection.fetchrow("SELECT state, data FROM fsm_storage")
+    assert record['state'] == 'ClientForm:phone_and_comment'
+    assert record['data'] == {'phone': ['+380501234567']}
+
+
+async def test_data_change_keeps_state_written_elsewhere(database):
+    storage = PostgresStorage()
+    await storage.set_state(KEY, 'ClientForm:phone_and_comment')
+
+    async with UpdateScope().lock(KEY):
+        await storage.set_data(KEY, {'comment': 'a'})
+    assert await storage.get_state(KEY) == 'ClientForm:phone_and_comment'
+    assert await storage.get_data(KEY) == {'comment': 'a'}
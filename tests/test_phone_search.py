@@ -0,0 +1,37 @@
+import database as db
+
+
+def _matches(pattern: str, value: str) -> bool:
+    """LIKE-шаблон без екранування: лише % на початку та/або в кінці."""
+    body = pattern.strip('%')
+    if pattern.startswith('%') and pattern.endswith('%'):
+        return body in value
+    if pattern.endswith('%'):
+        return value.startswith(body)
+    return value == body
+
+
+def test_full_number_is_exact_match():
+    exact, suffix, substring = db._phone_search_params('+380 (50) 123-45-67')
+    assert exact == '380501234567'
+    assert _matches(substring, '380501234567')
+
+
+def test_fragment_without_country_code_keeps_partial_search():
+    exact, suffix, substring = db._phone_search_params('501234567')
+    # Канонізується за країною за замовчуванням — це найвищий за оцінкою збіг
+    assert exact == '380501234567'
+    # ...але номер іншої країни з тим самим фрагментом теж знаходиться
+    assert _matches(substring, '48501234567')
+    assert _matches(suffix, '48501234567'[::-1])
+
+
+def test_short_fragment():
+    exact, suffix, substring = db._phone_search_params('4567')
+    assert exact == '4567'
+    assert suffix == '7654%'
+    assert substring == '%4567%'
+
+
+def test_query_without_digits_searches_comments_only():
+    assert db._phone_search_params('Іван') == (None, None, None)
@@ -0,0 +1,86 @@
+from types import SimpleNamespace
+
+import pytest
+from aiogram.exceptions import TelegramBadRequest
+
+import client_fsm
+import database as db
+
+
+def _sent(source: str):
+    return SimpleNamespace(photo=[SimpleNamespace(file_id=f"small:{source}"), SimpleNamespace(file_id=f"id:{source}")])
+
+
+class FakeBot:
+    """Перевіряє обмеження Telegram: альбом — від 2 до 10 фото."""
+
+    def __init__(self, rejected=()):
+        self.calls = []
+        self.rejected = set(rejected)
+
+    def _check(self, sources):
+        if self.rejected & set(sources):
+            raise TelegramBadRequest(method=None, message="Bad Request: wrong file identifier")
+
+    async def send_photo(self, chat_id, photo):
+        self._check([photo])
+        self.calls.append(('photo', [photo]))
+        return _sent(photo)
+
+    async def send_media_group(self, chat_id, media):
+        sources = [item.media for item in media]
+        assert 2 <= len(sources) <= 10, "Telegram accepts 2-10 items in a media group"
+        self._check(sources)
+        self.calls.append(('group', sources))
+        return [_sent(source) for source in sources]
+
+
+@pytest.fixture
+def file_ids(monkeypatch):
+    stored = {}
+
+    async def get_photo_file_ids(urls):
+        return {url: stored[url] for url in urls if url in stored}
+
+    async def save_photo_file_ids(new_file_ids):
+        stored.update(new_file_ids)
+
+    monkeypatch.setattr(db, 'get_photo_file_ids', get_photo_file_ids)
+    monkeypatch.setattr(db, 'save_photo_file_ids', save_photo_file_ids)
+    return stored
+
+
+def _client(count: int) -> dict:
+    return {'id': 1, 'photo_url': [f"https://spaces.test/{i}.jpg" for i in range(count)], 'photo_variants': []}
+
+
+async def test_single_photo_is_sent_without_album(file_ids):
+    bot = FakeBot()
+    await client_fsm.send_photo_album(bot, 42, _client(1))
+
+    assert bot.calls == [('photo', ["https://spaces.test/0.jpg"])]
+    assert file_ids == {"https://spaces.test/0.jpg": "id:https://spaces.test/0.jpg"}
+
+
+async def test_eleven_photos_end_with_single_photo(file_ids):
+    bot = FakeBot()
+    client = _client(11)
+    await client_fsm.send_photo_album(bot, 42, client)
+
+    assert [(kind, len(sources)) for kind, sources in bot.calls] == [('group', 10), ('photo', 1)]
+    assert set(file_ids) == set(client['photo_url'])
+
+    # Повторний показ використовує збережені file_id
+    bot = FakeBot()
+    await client_fsm.send_photo_album(bot, 42, client)
+    assert bot.calls[1] == ('photo', ["id:https://spaces.test/10.jpg"])
+
+
+async def test_stale_file_id_of_single_photo_is_replaced(file_ids):
+    url = "https://spaces.test/0.jpg"
+    file_ids[url] = "stale"
+    bot = FakeBot(rejected={"stale"})
+    await client_fsm.send_photo_album(bot, 42, _client(1))
+
+    assert bot.calls == [('photo', [url])]
+    assert file_ids[url] == f"id:{url}"
@@ -0,0 +1,44 @@
+import os
+
+import asyncpg
+import pytest
+
+OWNER_ID = 3003
+
+
+@pytest.fixture
+def replica_database(database):
+    if database.read_pool is database.db_pool:
+        pytest.skip("TEST_REPLICA_DATABASE_URL is not set")
+    return database
+
+
+async def test_reads_go_to_primary_after_write(replica_database):
+    database = replica_database
+    # Тестова «репліка» — окрема інстанція без реплікації: нового рядка там немає
+    client_id = await database.add_client(OWNER_ID, OWNER_ID, [], 'fresh', [], [])
+    database.client_cache.clear()
+
+    assert database.read_pool_for(client_id=client_id) is database.db_pool
+    assert (await database.find_client_by_id(client_id))['comment'] == 'fresh'
+
+    # Після вікна read-your-writes читання знову йде в репліку
+    database._recent_writes.clear()
+    database.client_cache.clear()
+    assert database.read_pool_for(client_id=client_id, owner_id=OWNER_ID) is database.read_pool
+    assert await database.find_client_by_id(client_id) is None
+
+
+async def test_replica_rows_are_not_cached(replica_database):
+    database = replica_database
+    replica = await asyncpg.connect(dsn=os.environ['TEST_REPLICA_DATABASE_URL'])
+    try:
+        client_id = await replica.fetchval("""
+            INSERT INTO clients (owner_id, telegram_id, phone, comment, photo_url)
+            VALUES ($1, $1, '[]', 'stale', '[]') RETURNING id
+        """, OWNER_ID)
+    finally:
+        await replica.close()
+
+    assert (await database.find_client_by_id(client_id))['comment'] == 'stale'
+    assert database.client_cache.get(client_id) is None
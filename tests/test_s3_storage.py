@@ -0,0 +1,131 @@
+import asyncio
+import hashlib
+from io import BytesIO
+
+from PIL import Image
+
+from config import settings
+import s3_storage
+
+PNG_HEAD = b'\x89PNG\r\n\x1a\n'
+
+
+def _jpeg(color=(200, 30, 30), size=(640, 480)) -> bytes:
+    output = BytesIO()
+    Image.new('RGB', size, color).save(output, format='JPEG')
+    return output.getvalue()
+
+
+def test_detect_content_type():
+    assert s3_storage.detect_content_type(b'\xff\xd8\xff\xe0') == 'image/jpeg'
+    assert s3_storage.detect_content_type(PNG_HEAD + b'....') == 'image/png'
+    assert s3_storage.detect_content_type(b'RIFF\x00\x00\x00\x00WEBPVP8 ') == 'image/webp'
+    assert s3_storage.detect_content_type(b'plain text') == 'application/octet-stream'
+
+
+def test_key_from_url_roundtrip(s3):
+    url = s3_storage.get_photo_url('photos/ab/abc/original.jpg')
+    assert s3_storage.key_from_url(url) == 'photos/ab/abc/original.jpg'
+    assert s3_storage.key_from_url('https://elsewhere.test/photo.jpg') is None
+
+
+async def test_ingest_stores_original_and_variants(s3):
+    data = _jpeg()
+    stored = await s3_storage.ingest_photo(data)
+
+    content_hash = hashlib.sha256(data).hexdigest()
+    assert not stored.reused
+    assert set(stored.urls) == {'original', *s3_storage.PHOTO_VARIANTS}
+    original = s3.objects[f"photos/{content_hash[:2]}/{content_hash}/original.jpg"]
+    assert original[0] == data and original[1] == 'image/jpeg'
+
+    thumb, content_type, _ = s3.objects[s3_storage.key_from_url(stored.urls['thumb'])]
+    assert content_type == 'image/jpeg'
+    with Image.open(BytesIO(thumb)) as image:
+        assert max(image.size) <= settings.PHOTO_THUMB_SIZE
+
+
+async def test_ingest_takes_content_type_from_data(s3):
+    data = PNG_HEAD + b'not really decodable'
+    stored = await s3_storage.ingest_photo(data)
+
+    key = s3_storage.key_from_url(stored.urls['original'])
+    assert key.endswith('/original.png')
+    assert s3.objects[key][1] == 'image/png'
+    # Pillow не розібрав файл: варіантів немає, але оригінал збережено
+    assert set(stored.urls) == {'original'}
+
+
+async def test_second_ingest_of_same_photo_uploads_nothing(s3):
+    data = _jpeg()
+    first = await s3_storage.ingest_photo(data)
+    puts = sum(1 for call in s3.calls if call[0] == 'put_object')
+
+    second = await s3_storage.ingest_photo(data)
+    assert second.reused
+    assert second.urls == first.urls
+    assert sum(1 for call in s3.calls if call[0] == 'put_object') == puts
+
+
+async def test_ensure_photo_stored_uploads_missing_objects(s3):
+    data = _jpeg()
+    stored = await s3_storage.ingest_photo(data)
+    for url in stored.urls.values():
+        s3.objects.pop(s3_storage.key_from_url(url))
+
+    assert await s3_storage.ensure_photo_stored(data, stored.urls)
+    assert all(s3_storage.key_from_url(url) in s3.objects for url in stored.urls.values())
+
+
+async def test_concurrent_uploads_are_capped(s3, monkeypatch):
+    monkeypatch.setattr(settings, 'SPACES_MAX_CONCURRENT_UPLOADS', 2)
+    s3.put_delay = 0.01
+
+    await asyncio.gather(*(
+        s3_storage.ingest_photo(PNG_HEAD + str(index).encode()) for index in range(8)
+    ))
+    assert len(s3.objects) == 8
+    assert s3.max_active_puts == 2
+
+
+async def test_delete_objects_reports_only_deleted_keys(s3):
+    for key in ('a', 'b', 'c'):
+        await s3.put_object(Bucket='crm-test', Key=key, Body=b'x', ContentType='text/plain')
+    s3.failing_keys.add('b')
+
+    assert await s3_storage.delete_objects(['a', 'b', 'c']) == ['a', 'c']
+    assert set(s3.objects) == {'b'}
+
+
+async def test_list_objects_follows_pagination(s3):
+    for index in range(2500):
+        s3.objects[f"photos/{index:04d}"] = (b'', 'image/jpeg', None)
+    s3.objects['other/file'] = (b'', 'image/jpeg', None)
+
+    keys = [key async for key, _ in s3_storage.list_objects('photos/')]
+    assert len(keys) == 2500
+
+
+async def test_concurrent_first_calls_share_one_async_client(monkeypatch):
+    import aiobotocore.session
+
+    created = []
+    get_session = aiobotocore.session.get_session
+
+    def counting_session():
+        created.append(True)
+        return get_session()
+
+    monkeypatch.setattr(aiobotocore.session, 'get_session', counting_session)
+    monkeypatch.setattr(s3_storage, '_async_client', None)
+    monkeypatch.setattr(s3_storage, '_async_client_stack', None)
+    monkeypatch.setattr(s3_storage, '_async_client_lock', asyncio.Lock())
+    monkeypatch.setattr(settings, 'SPACES_ENDPOINT_URL', 'https://spaces.test')
+    monkeypatch.setattr(settings, 'SPACES_ACCESS_KEY', 'key')
+    monkeypatch.setattr(settings, 'SPACES_SECRET_KEY', 'secret')
+    try:
+        clients = await asyncio.gather(*(s3_storage.get_async_client() for _ in range(5)))
+        assert len(created) == 1
+        assert all(client is clients[0] for client in clients)
+    finally:
+        await s3_storage.close_async_client()
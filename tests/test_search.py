@@ -0,0 +1,71 @@
+OWNER_ID = 4004
+OTHER_OWNER_ID = 5005
+
+
+async def _add(database, comment: str, phones=(), owner_id: int = OWNER_ID) -> int:
+    return await database.add_client(owner_id, owner_id, list(phones), comment, [], [])
+
+
+async def test_comment_search_ranks_word_matches_first(database):
+    exact = await _add(database, "Іван, червоний седан")
+    partial = await _add(database, "червонийседан без пробілу")
+    await _add(database, "синій позашляховик")
+
+    results, cursor = await database.search_clients(OWNER_ID, "червоний")
+
+    assert [client['id'] for client in results] == [exact, partial]
+    assert results[0]['score'] > results[1]['score']
+    assert cursor is None
+
+
+async def test_phone_and_comment_scores_add_up(database):
+    both = await _add(database, "номер 501234567 у коментарі", ['+380501234567'])
+    phone_only = await _add(database, "без коментаря", ['+380501234567'])
+
+    results, _ = await database.search_clients(OWNER_ID, "501234567")
+
+    assert [client['id'] for client in results] == [both, phone_only]
+
+
+async def test_cursor_pages_cover_all_results_once(database):
+    ids = [await _add(database, f"постійний клієнт {i}") for i in range(7)]
+
+    everything, _ = await database.search_clients(OWNER_ID, "постійний", limit=None)
+    pages, cursor = [], None
+    while True:
+        page, cursor = await database.search_clients(OWNER_ID, "постійний", limit=3, after=cursor)
+        pages.append([client['id'] for client in page])
+        if cursor is None:
+            break
+
+    assert [len(page) for page in pages] == [3, 3, 1]
+    assert sum(pages, []) == [client['id'] for client in everything]
+    assert sorted(sum(pages, [])) == ids
+
+    # Компактний курсор для callback_data переживає кодування
+    _, cursor = await database.search_clients(OWNER_ID, "постійний", limit=3)
+    assert database.decode_search_cursor(database.encode_search_cursor(cursor)) == cursor
+
+
+async def test_browse_back_returns_previous_page(database):
+    for i in range(7):
+        await _add(database, f"постійний клієнт {i}")
+
+    first, prev_cursor, next_cursor = await database.browse_clients(OWNER_ID, "постійний", limit=3)
+    assert prev_cursor is None
+    second, prev_cursor, next_cursor = await database.browse_clients(OWNER_ID, "постійний", limit=3, after=next_cursor)
+    back, back_prev, back_next = await database.browse_clients(OWNER_ID, "постійний", limit=3, before=prev_cursor)
+
+    assert [client['id'] for client in back] == [client['id'] for client in first]
+    assert back_prev is None
+    assert back_next is not None
+    assert not {client['id'] for client in first} & {client['id'] for client in second}
+
+
+async def test_search_is_scoped_to_owner(database):
+    own = await _add(database, "спільний коментар", ['+380501234567'])
+    await _add(database, "спільний коментар", ['+380501234567'], owner_id=OTHER_OWNER_ID)
+
+    for query in ("спільний", "501234567", "+380501234567"):
+        results, _ = await database.search_clients(OWNER_ID, query)
+        assert [client['id'] for client in results] == [own]
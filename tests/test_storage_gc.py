@@ -0,0 +1,143 @@
+import asyncio
+
+import face_embedding
+import photo_jobs
+import s3_storage
+import storage_gc
+
+OWNER_ID = 1001
+
+
+async def _client_with_photo(database, s3, key: str) -> int:
+    await s3.put_object(Bucket='crm-test', Key=key, Body=b'\xff\xd8\xff photo', ContentType='image/jpeg')
+    return await database.add_client(OWNER_ID, OWNER_ID, ['+380501234567'], 'gc', [], [s3_storage.get_photo_url(key)])
+
+
+async def _age_orphans(database, seconds: float):
+    async with database.db_pool.acquire() as connection:
+        await connection.execute(
+            "UPDATE orphaned_objects SET created_at = now() - make_interval(secs => $1)", seconds
+        )
+
+
+async def _orphan_rows(database):
+    async with database.db_pool.acquire() as connection:
+        return {r['url']: r['claimed_at'] for r in await connection.fetch("SELECT url, claimed_at FROM orphaned_objects")}
+
+
+async def test_sweep_waits_for_grace_period(database, s3):
+    client_id = await _client_with_photo(database, s3, 'photos/aa/one.jpg')
+    assert await database.delete_client(client_id)
+
+    # Щойно осиротілий об'єкт ще в межах grace
+    assert await storage_gc.sweep_once(grace_seconds=300) == 0
+    assert 'photos/aa/one.jpg' in s3.objects
+
+    await _age_orphans(database, 600)
+    assert await storage_gc.sweep_once(grace_seconds=300) == 1
+    assert 'photos/aa/one.jpg' not in s3.objects
+    assert await _orphan_rows(database) == {}
+
+
+async def test_sweep_keeps_objects_referenced_again(database, s3):
+    first = await _client_with_photo(database, s3, 'photos/bb/shared.jpg')
+    # Те саме фото (однаковий хеш) прив'язане до іншого клієнта
+    await database.add_client(OWNER_ID, OWNER_ID, [], 'same photo', [], [s3_storage.get_photo_url('photos/bb/shared.jpg')])
+    assert await database.delete_client(first)
+    await _age_orphans(database, 600)
+
+    assert await storage_gc.sweep_once(grace_seconds=0) == 1
+    assert 'photos/bb/shared.jpg' in s3.objects
+    assert not any(call[0] == 'delete_objects' for call in s3.calls)
+    assert await _orphan_rows(database) == {}
+
+
+async def test_failed_delete_releases_claim(database, s3):
+    client_id = await _client_with_photo(database, s3, 'photos/cc/broken.jpg')
+    assert await database.delete_client(client_id)
+    s3.failing_keys.add('photos/cc/broken.jpg')
+
+    assert await storage_gc.sweep_once(grace_seconds=0) == 0
+    # Запис лишається в черзі й не захоплений: наступний прохід спробує знову
+    assert await _orphan_rows(database) == {s3_storage.get_photo_url('photos/cc/broken.jpg'): None}
+
+    s3.failing_keys.clear()
+    assert await storage_gc.sweep_once(grace_seconds=0) == 1
+    assert 'photos/cc/broken.jpg' not in s3.objects
+
+
+async def test_claimed_batch_is_skipped_until_lease_expires(database, s3):
+    client_id = await _client_with_photo(database, s3, 'photos/dd/claimed.jpg')
+    assert await database.delete_client(client_id)
+    async with database.db_pool.acquire() as connection:
+        await connection.execute("UPDATE orphaned_objects SET claimed_at = now()")
+
+    # Інший прибиральник саме видаляє цей об'єкт
+    assert await storage_gc.sweep_once(grace_seconds=0) == 0
+
+    async with database.db_pool.acquire() as connection:
+        await connection.execute(
+            "UPDATE orphaned_objects SET claimed_at = now() - make_interval(secs => $1)",
+            storage_gc.CLAIM_LEASE + 1
+        )
+    assert await storage_gc.sweep_once(grace_seconds=0) == 1
+    assert 'photos/dd/claimed.jpg' not in s3.objects
+
+
+async def test_reconcile_finds_unreferenced_objects(database, s3):
+    await _client_with_photo(database, s3, 'photos/ee/kept.jpg')
+    await s3.put_object(Bucket='crm-test', Key='photos/ee/lost.jpg', Body=b'x', ContentType='image/jpeg')
+
+    assert await storage_gc.reconcile(enqueue=True, grace_seconds=0) == ['photos/ee/lost.jpg']
+    assert list(await _orphan_rows(database)) == [s3_storage.get_photo_url('photos/ee/lost.jpg')]
+
+
+async def test_wait_for_sweeps_blocks_while_batch_is_claimed(database, s3):
+    client_id = await _client_with_photo(database, s3, 'photos/ff/busy.jpg')
+    assert await database.delete_client(client_id)
+    url = s3_storage.get_photo_url('photos/ff/busy.jpg')
+    async with database.db_pool.acquire() as connection:
+        await connection.execute("UPDATE orphaned_objects SET claimed_at = now()")
+
+    async def finish_sweep():
+        await asyncio.sleep(0.2)
+        async with database.db_pool.acquire() as connection:
+            await connection.execute("DELETE FROM orphaned_objects")
+
+    release = asyncio.create_task(finish_sweep())
+    assert await storage_gc.wait_for_sweeps([url], interval=0.05)
+    await release
+    assert not await storage_gc.wait_for_sweeps([url])
+
+
+async def test_reused_photo_removed_before_attach_is_uploaded_again(database, s3, monkeypatch):
+    data = b'\xff\xd8\xff' + b'same photo' * 100
+    stored = await s3_storage.ingest_photo(data)
+    original_key = s3_storage.key_from_url(stored.urls['original'])
+    first = await database.add_client(OWNER_ID, OWNER_ID, [], 'first', [], [stored.urls['original']])
+    assert await database.delete_client(first)
+
+    target = await database.add_client(OWNER_ID, OWNER_ID, [], 'target', [], [])
+    assert await database.enqueue_photo_job(target, 'file-1', OWNER_ID)
+    [job] = await database.claim_photo_jobs(1, 60)
+
+    async def download(bot, file_id):
+        return data
+
+    append_client_photo = database.append_client_photo
+
+    async def append_after_sweep(*args, **kwargs):
+        # GC встигає пройти між перевіркою наявності об'єкта і прив'язкою до клієнта
+        assert await storage_gc.sweep_once(grace_seconds=0) >= 1
+        assert original_key not in s3.objects
+        return await append_client_photo(*args, **kwargs)
+
+    monkeypatch.setattr(s3_storage, 'download_telegram_file', download)
+    monkeypatch.setattr(face_embedding, 'submit', lambda client_id, data: None)
+    monkeypatch.setattr(database, 'append_client_photo', append_after_sweep)
+
+    await photo_jobs.PhotoJobWorker(bot=None)._process(job)
+
+    assert original_key in s3.objects
+    client = await database.find_client_by_id(target)
+    assert stored.urls['original'] in client['photo_url']
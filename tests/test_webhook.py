@@ -0,0 +1,135 @@
+import asyncio
+import socket
+import time
+
+import pytest
+from aiogram import Bot, Dispatcher, Router
+from aiogram.filters import Command
+from aiogram.types import Message
+from aiohttp.test_utils import TestClient, TestServer
+
+from config import settings
+from loadtest import FakeSession
+import webhook
+
+SECRET = "test-secret_123"
+
+
+def _update(update_id: int, text: str) -> dict:
+    return {
+        'update_id': update_id,
+        'message': {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': 42, 'type': 'private'},
+            'from': {'id': 42, 'is_bot': False, 'first_name': 'Operator'},
+            'text': text,
+        },
+    }
+
+
+def _dispatcher(handled: list, delay: float = 0.0) -> Dispatcher:
+    router = Router()
+
+    @router.message(Command("start"))
+    async def start(message: Message):
+        await asyncio.sleep(delay)
+        await message.answer("hello")
+        handled.append(message.message_id)
+
+    dp = Dispatcher()
+    dp.include_router(router)
+    return dp
+
+
+async def _client(server: webhook.WebhookServer) -> TestClient:
+    client = TestClient(TestServer(server.create_app()))
+    await client.start_server()
+    return client
+
+
+async def test_fake_update_is_dispatched():
+    handled = []
+    session = FakeSession()
+    server = webhook.WebhookServer(Bot("123456:TEST", session=session), _dispatcher(handled), secret_token=SECRET)
+    client = await _client(server)
+    try:
+        response = await client.post("/webhook", json=_update(1, "/start"),
+                                     headers={webhook.SECRET_HEADER: SECRET})
+        assert response.status == 200
+        await server.drain()
+    finally:
+        await client.close()
+
+    assert handled == [1]
+    assert session.calls['SendMessage'] == 1
+
+
+async def test_requests_without_valid_secret_are_rejected():
+    handled = []
+    server = webhook.WebhookServer(Bot("123456:TEST", session=FakeSession()), _dispatcher(handled), secret_token=SECRET)
+    client = await _client(server)
+    try:
+        missing = await client.post("/webhook", json=_update(1, "/start"))
+        forged = await client.post("/webhook", json=_update(2, "/start"),
+                                   headers={webhook.SECRET_HEADER: "guess"})
+        invalid = await client.post("/webhook", data=b"not json", headers={webhook.SECRET_HEADER: SECRET})
+    finally:
+        await client.close()
+
+    assert (missing.status, forged.status, invalid.status) == (401, 401, 400)
+    assert handled == []
+
+
+async def test_shutdown_drains_in_flight_updates():
+    handled = []
+    server = webhook.WebhookServer(Bot("123456:TEST", session=FakeSession()), _dispatcher(handled, delay=0.2),
+                                   secret_token=SECRET)
+    client = await _client(server)
+    for update_id in (1, 2, 3):
+        response = await client.post("/webhook", json=_update(update_id, "/start"),
+                                     headers={webhook.SECRET_HEADER: SECRET})
+        assert response.status == 200
+    assert handled == []
+    # Зупинка сервера (on_shutdown) чекає на обробники, що вже виконуються
+    await client.close()
+    assert sorted(handled) == [1, 2, 3]
+
+
+def test_webhook_mode_requires_secret(monkeypatch):
+    for name, value in (('BOT_TOKEN', '1:a'), ('DATABASE_URL', 'postgresql://x'), ('API_ID', 1), ('API_HASH', 'x'),
+                        ('BOT_MODE', 'webhook'), ('WEBHOOK_URL', 'https://crm.test')):
+        monkeypatch.setattr(settings, name, value)
+
+    monkeypatch.setattr(settings, 'WEBHOOK_SECRET', None)
+    with pytest.raises(ValueError, match="WEBHOOK_SECRET"):
+        settings.validate()
+    monkeypatch.setattr(settings, 'WEBHOOK_SECRET', 'bad secret!')
+    with pytest.raises(ValueError, match="WEBHOOK_SECRET"):
+        settings.validate()
+    monkeypatch.setattr(settings, 'WEBHOOK_SECRET', SECRET)
+    settings.validate()
+
+
+async def test_failed_start_still_runs_shutdown(monkeypatch):
+    busy = socket.socket()
+    busy.bind(('127.0.0.1', 0))
+    busy.listen()
+    for name, value in (('WEBHOOK_SECRET', SECRET), ('WEBHOOK_URL', 'https://crm.test'),
+                        ('WEBHOOK_HOST', '127.0.0.1'), ('WEBHOOK_PORT', busy.getsockname()[1])):
+        monkeypatch.setattr(settings, name, value)
+
+    events = []
+    dp = _dispatcher([])
+    dp.startup.register(lambda: events.append('startup'))
+    dp.shutdown.register(lambda: events.append('shutdown'))
+
+    async def on_shutdown():
+        events.append('on_shutdown')
+
+    try:
+        with pytest.raises(OSError):
+            await webhook.run_webhook(Bot("123456:TEST", session=FakeSession()), dp, on_shutdown=on_shutdown)
+    finally:
+        busy.close()
+    assert events == ['startup', 'shutdown', 'on_shutdown']
@@ -0,0 +1,115 @@
+import asyncio
+import hmac
+import logging
+import signal
+from typing import Set
+
+from aiohttp import web
+from aiogram import Bot, Dispatcher
+from aiogram.types import Update
+
+from config import settings
+
+logging.basicConfig(level=logging.INFO)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+class WebhookServer:
+    """
+    aiohttp-сервер для режиму webhook: перевіряє секретний токен, одразу
+    відповідає Telegram 200 OK і обробляє оновлення у фонових задачах.
+    """
+
+    def __init__(self, bot: Bot, dp: Dispatcher, secret_token: str,
+                 path: str = "/webhook", drain_timeout: float = 30.0):
+        if not secret_token:
+            raise ValueError("Webhook secret token is required.")
+        self.bot = bot
+        self.dp = dp
+        self.secret_token = secret_token
+        self.path = path
+        self.drain_timeout = drain_timeout
+        self._in_flight: Set[asyncio.Task] = set()
+
+    def create_app(self) -> web.Application:
+        app = web.Application()
+        app.router.add_post(self.path, self.handle_update)
+        app.on_shutdown.append(self._on_shutdown)
+        return app
+
+    async def handle_update(self, request: web.Request) -> web.Response:
+        received = request.headers.get(SECRET_HEADER, "")
+        if not hmac.compare_digest(received.encode(), self.secret_token.encode()):
+            return web.Response(status=401)
+
+        try:
+            update = Update.model_validate(await request.json(), context={"bot": self.bot})
+        except Exception as e:
+            logging.error(f"Invalid webhook payload: {e}")
+            return web.Response(status=400)
+
+        task = asyncio.create_task(self._feed_update(update))
+        self._in_flight.add(task)
+        task.add_done_callback(self._in_flight.discard)
+        return web.Response()
+
+    async def _feed_update(self, update: Update):
+        try:
+            await self.dp.feed_update(self.bot, update)
+        except Exception as e:
+            logging.error(f"Failed to process update {update.update_id}: {e}")
+
+    async def drain(self):
+        """Дочікується завершення обробників, що вже виконуються."""
+        if not self._in_flight:
+            return
+        logging.info(f"Draining {len(self._in_flight)} in-flight updates...")
+        _, pending = await asyncio.wait(set(self._in_flight), timeout=self.drain_timeout)
+        for task in pending:
+            task.cancel()
+        if pending:
+            logging.warning(f"Cancelled {len(pending)} updates after drain timeout.")
+
+    async def _on_shutdown(self, app: web.Application):
+        await self.drain()
+
+
+async def run_webhook(bot: Bot, dp: Dispatcher, on_shutdown=None):
+    """Реєструє webhook у Telegram і обслуговує оновлення до сигналу зупинки."""
+    server = WebhookServer(
+        bot, dp,
+        secret_token=settings.WEBHOOK_SECRET,
+        path=settings.WEBHOOK_PATH,
+        drain_timeout=settings.WEBHOOK_DRAIN_TIMEOUT,
+    )
+    runner = web.AppRunner(server.create_app())
+    await runner.setup()
+    # Очищення виконується й тоді, коли старт не вдався (порт зайнятий, Telegram відхилив URL)
+    try:
+        site = web.TCPSite(runner, host=settings.WEBHOOK_HOST, port=settings.WEBHOOK_PORT)
+        await dp.emit_startup(bot=bot)
+        await site.start()
+        await bot.set_webhook(
+            url=settings.WEBHOOK_URL.rstrip('/') + settings.WEBHOOK_PATH,
+            secret_token=settings.WEBHOOK_SECRET,
+            allowed_updates=dp.resolve_used_update_types(),
+        )
+        logging.info(f"Webhook server listening on {settings.WEBHOOK_HOST}:{settings.WEBHOOK_PORT}{settings.WEBHOOK_PATH}")
+
+        stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, stop_event.set)
+            except NotImplementedError:
+                pass
+
+        await stop_event.wait()
+    finally:
+        # runner.cleanup() зупиняє прийом запитів і викликає drain() через on_shutdown
+        await runner.cleanup()
+        await dp.emit_shutdown(bot=bot)
+        if on_shutdown:
+            await on_shutdown()
+        await bot.session.close()